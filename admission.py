@@ -0,0 +1,324 @@
+"""
+This module contains the per-process admission control for calls and Lex requests
+
+Without limits a burst of calls is taken on by a process whatever its load,
+and every call on it gets slower together: frames queue behind each other on
+the event loop, turns wait for Lex and the callers hear long silences.
+AdmissionControl caps what one process (one worker, see workers.py) takes on:
+
+    ADMISSION_MAX_CALLS         active calls (media streams). Once reached,
+                                /twiml answers new calls with the busy TwiML
+                                (ADMISSION_BUSY_MESSAGE, then hang up) instead
+                                of connecting a stream, and a stream that gets
+                                in anyway, e.g. one whose /twiml was served by
+                                another worker, has its call updated to the
+                                busy TwiML and is closed with code 1013 (try
+                                again later).
+    ADMISSION_MAX_LEX_REQUESTS  Lex requests in flight, from opening the
+                                request until Lex answers. A turn over the
+                                limit queues for a slot, its audio buffered as
+                                when Lex is slow, for up to
+                                ADMISSION_LEX_QUEUE_TIMEOUT_SECS; after that
+                                the turn is not sent to Lex and the caller is
+                                asked to say it again (ADMISSION_RETRY_MESSAGE)
+                                with the call kept up. With PLAYBACK_MODE=stream
+                                there is no prompt to play, the turn is dropped
+                                and the call keeps listening.
+
+0 (the default) leaves either one unlimited; the in-flight counts are kept
+anyway. The load is the fuller of the two, calls against their limit and Lex
+requests (in flight and queued) against theirs. From ADMISSION_SHED_AT_LOAD
+on the process reports it is shedding: on /ping (which stays 200, it is
+liveness), on /metrics for the autoscaler and on /debug/admission. With
+ADMISSION_UNREADY_WHEN_SHEDDING=true /ready also answers 503 while shedding,
+so the load balancer sends new calls elsewhere; behind an ALB, ECS replaces
+a task that stays unhealthy, so this needs a health check threshold that
+outlasts a spike.
+
+The gauges and counters on /metrics cover every worker, whichever one answers
+the scrape: they are kept in a WorkerTable (see workers.py) and summed, and
+with several workers the load and shedding are reported per worker, with a
+worker label. /debug/admission shows the worker that answers it.
+
+Threads and event loops share one AdmissionControl: a Lex request slot
+released on a thread goes to a request waiting on an event loop through that
+loop's call_soon_threadsafe(), as asyncio futures are not thread safe.
+"""
+
+import asyncio
+import collections
+import logging
+import os
+import threading
+import time
+
+from twilio_call import voice_response
+from workers import WorkerStats, WorkerTable, worker_config, worker_index
+
+admission_config = {
+    # 0 for no limit
+    "MaxActiveCalls": int(os.environ.get('ADMISSION_MAX_CALLS', 0)),
+    "MaxLexRequests": int(os.environ.get('ADMISSION_MAX_LEX_REQUESTS', 0)),
+    "LexQueueTimeoutInSecs": float(os.environ.get('ADMISSION_LEX_QUEUE_TIMEOUT_SECS', 5)),
+    "ShedAtLoad": float(os.environ.get('ADMISSION_SHED_AT_LOAD', 0.9)),
+    "UnreadyWhenShedding": os.environ.get('ADMISSION_UNREADY_WHEN_SHEDDING', 'false').lower() == 'true',
+    "BusyMessage": os.environ.get('ADMISSION_BUSY_MESSAGE',
+                                  "Sorry, all of our lines are busy right now. Please call again later."),
+    "RetryMessage": os.environ.get('ADMISSION_RETRY_MESSAGE',
+                                   "Sorry, we are very busy right now. Could you say that again?")
+}
+
+# websocket close code for a stream turned away, "try again later"
+WS_TRY_AGAIN_LATER = 1013
+
+
+# the event loop running on this thread, None outside of one
+def running_loop():
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+# the TwiML a call gets when it is turned away
+def busy_twiml():
+    response = voice_response()
+    response.say(admission_config["BusyMessage"])
+    response.hangup()
+    return response.to_xml()
+
+
+# the TwiML a turn gets when it found no lex request slot: ask the caller to say it again and keep listening
+def retry_twiml():
+    response = voice_response()
+    response.say(admission_config["RetryMessage"])
+    response.pause(40)
+    return response.to_xml()
+
+
+class AdmissionControl:
+    COUNTERS = ("CallsAdmitted", "CallsRejected", "TwimlRejected", "LexRequests", "LexQueued", "LexRejected")
+    GAUGES = ("ActiveCalls", "LexInFlight", "LexQueued")
+
+    # the gauges then the counters of every worker. mapped when the server is imported, before the workers fork
+    table = WorkerTable(worker_config["Workers"], len(GAUGES) + len(COUNTERS))
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    # a table of its own unless given one
+    def __init__(self, max_calls, max_lex_requests, lex_queue_timeout, shed_at_load, unready_when_shedding,
+                 table=None, worker=None):
+        self.logger = logging.getLogger(__name__)
+        self.max_calls = max_calls
+        self.max_lex_requests = max_lex_requests
+        self.lex_queue_timeout = lex_queue_timeout
+        self.shed_at_load = shed_at_load
+        self.unready_when_shedding = unready_when_shedding
+        self.worker_stats = WorkerStats.shared()
+        # threads waiting for a lex slot wait on the condition, AsyncLexClientStreaming requests on a future
+        self.lock = threading.Condition()
+        self.lex_in_flight = 0
+        self.lex_queued = 0
+        self.lex_waiters = collections.deque()
+        self.table = WorkerTable(1, len(self.GAUGES) + len(self.COUNTERS)) if table is None else table
+        self.values = self.table.row(worker)
+        # a worker replacing one that exited carries on with its counters
+        self.counters = {name: int(self.values[len(self.GAUGES) + index]) for index, name in enumerate(self.COUNTERS)}
+        self.publish()
+
+    @classmethod
+    def shared(cls):
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls(admission_config["MaxActiveCalls"],
+                                      admission_config["MaxLexRequests"],
+                                      admission_config["LexQueueTimeoutInSecs"],
+                                      admission_config["ShedAtLoad"],
+                                      admission_config["UnreadyWhenShedding"],
+                                      cls.table, worker_index())
+        return cls._shared
+
+    def count(self, name):
+        self.counters[name] = self.counters[name] + 1
+        self.values[len(self.GAUGES) + self.COUNTERS.index(name)] = self.counters[name]
+
+    # the gauges of this worker into its row of the table, the caller holds the lock
+    def publish(self):
+        self.values[0] = self.worker_stats.active_calls
+        self.values[1] = self.lex_in_flight
+        self.values[2] = self.lex_queued
+
+    # whether /twiml connects a new call to a stream
+    def admit_twiml(self):
+        with self.lock:
+            if self.max_calls and self.worker_stats.active_calls >= self.max_calls:
+                self.count("TwimlRejected")
+                return False
+            return True
+
+    # take on a new media stream, counted as an active call until call_ended()
+    def admit_call(self):
+        with self.lock:
+            if self.max_calls and self.worker_stats.active_calls >= self.max_calls:
+                self.count("CallsRejected")
+                self.logger.warning("{0} active calls, turning a call away".format(self.worker_stats.active_calls))
+                return False
+            self.count("CallsAdmitted")
+            self.worker_stats.call_started()
+            self.publish()
+            return True
+
+    def call_ended(self):
+        with self.lock:
+            self.worker_stats.call_ended()
+            self.publish()
+
+    # wait for a lex request slot for up to the queue timeout, False if there was none. release_lex() gives it back
+    def acquire_lex(self):
+        with self.lock:
+            self.count("LexRequests")
+            if self.max_lex_requests and self.lex_in_flight >= self.max_lex_requests:
+                self.count("LexQueued")
+                self.lex_queued = self.lex_queued + 1
+                self.publish()
+                deadline = time.monotonic() + self.lex_queue_timeout
+                try:
+                    while self.lex_in_flight >= self.max_lex_requests:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.count("LexRejected")
+                            return False
+                        self.lock.wait(remaining)
+                finally:
+                    self.lex_queued = self.lex_queued - 1
+                    self.publish()
+            self.lex_in_flight = self.lex_in_flight + 1
+            self.publish()
+            return True
+
+    # acquire_lex() for a request on the event loop. a released slot is handed to the longest waiting request
+    async def acquire_lex_async(self):
+        with self.lock:
+            self.count("LexRequests")
+            if not self.max_lex_requests or (self.lex_in_flight < self.max_lex_requests and not self.lex_waiters):
+                self.lex_in_flight = self.lex_in_flight + 1
+                self.publish()
+                return True
+            self.count("LexQueued")
+            self.lex_queued = self.lex_queued + 1
+            self.publish()
+            loop = asyncio.get_running_loop()
+            waiter = loop.create_future()
+            self.lex_waiters.append((loop, waiter))
+        acquired = False
+        try:
+            acquired = await asyncio.wait_for(waiter, self.lex_queue_timeout)
+            return acquired
+        except asyncio.TimeoutError:
+            with self.lock:
+                self.count("LexRejected")
+            return False
+        finally:
+            with self.lock:
+                self.lex_queued = self.lex_queued - 1
+                self.publish()
+            # a slot handed over just as the wait timed out or was cancelled is passed on
+            if not acquired and waiter.done() and not waiter.cancelled():
+                self.release_lex()
+
+    # may be called from any thread: a waiter on an event loop the caller is not running is handed its slot by that loop
+    def release_lex(self):
+        with self.lock:
+            while self.lex_waiters:
+                loop, waiter = self.lex_waiters.popleft()
+                if waiter.done():
+                    continue
+                if running_loop() is loop:
+                    waiter.set_result(True)
+                    return
+                # futures are not thread safe, so set_result() has to run on the waiter's own loop
+                try:
+                    loop.call_soon_threadsafe(self.hand_over_lex, waiter)
+                    return
+                except RuntimeError:
+                    # the loop is closed, nothing waits on it any more
+                    continue
+            self.lex_in_flight = self.lex_in_flight - 1
+            self.publish()
+            self.lock.notify()
+
+    # on the waiter's loop, a slot released on another thread. passed on if the wait ended before the hand-off ran
+    def hand_over_lex(self, waiter):
+        if waiter.done():
+            self.release_lex()
+        else:
+            waiter.set_result(True)
+
+    # the fuller of calls and lex requests against their limits, 0 without limits
+    def load(self):
+        return self.load_of(self.worker_stats.active_calls, self.lex_in_flight, self.lex_queued)
+
+    def load_of(self, active_calls, lex_in_flight, lex_queued):
+        loads = [0.0]
+        if self.max_calls:
+            loads.append(active_calls / float(self.max_calls))
+        if self.max_lex_requests:
+            loads.append((lex_in_flight + lex_queued) / float(self.max_lex_requests))
+        return max(loads)
+
+    def shedding(self):
+        return self.shedding_at(self.load())
+
+    def shedding_at(self, load):
+        return bool(self.max_calls or self.max_lex_requests) and load >= self.shed_at_load
+
+    # whether /ready may report ready as far as the load goes
+    def ready(self):
+        return not (self.unready_when_shedding and self.shedding())
+
+    def snapshot(self):
+        with self.lock:
+            return {"MaxActiveCalls": self.max_calls,
+                    "ActiveCalls": self.worker_stats.active_calls,
+                    "MaxLexRequests": self.max_lex_requests,
+                    "LexInFlight": self.lex_in_flight,
+                    "LexQueued": self.lex_queued,
+                    "Load": round(self.load(), 3),
+                    "Shedding": self.shedding(),
+                    "Counters": dict(self.counters)}
+
+    # the gauges and counters of all the workers in the prometheus text exposition format, appended to the span
+    # histograms on /metrics
+    def render(self):
+        totals = self.table.totals()
+        gauges = dict(zip(self.GAUGES, totals))
+        counters = dict(zip(self.COUNTERS, totals[len(self.GAUGES):]))
+        lines = ["# HELP lex_twilio_load Active calls or lex requests against their limit, whichever is fuller",
+                 "# TYPE lex_twilio_load gauge"]
+        loads = [self.load_of(*row[:len(self.GAUGES)]) for row in self.table.rows()]
+        lines.extend(self.per_worker("lex_twilio_load", [repr(round(load, 3)) for load in loads]))
+        lines.append("# TYPE lex_twilio_shedding gauge")
+        lines.extend(self.per_worker("lex_twilio_shedding", [int(self.shedding_at(load)) for load in loads]))
+        lines.extend(["# TYPE lex_twilio_active_calls gauge",
+                      "lex_twilio_active_calls {0}".format(int(gauges["ActiveCalls"])),
+                      "# TYPE lex_twilio_lex_requests_in_flight gauge",
+                      "lex_twilio_lex_requests_in_flight {0}".format(int(gauges["LexInFlight"])),
+                      "# TYPE lex_twilio_lex_requests_queued gauge",
+                      "lex_twilio_lex_requests_queued {0}".format(int(gauges["LexQueued"])),
+                      "# TYPE lex_twilio_calls_rejected_total counter",
+                      'lex_twilio_calls_rejected_total{{at="twiml"}} {0}'.format(int(counters["TwimlRejected"])),
+                      'lex_twilio_calls_rejected_total{{at="stream"}} {0}'.format(int(counters["CallsRejected"])),
+                      "# TYPE lex_twilio_lex_requests_queued_total counter",
+                      "lex_twilio_lex_requests_queued_total {0}".format(int(counters["LexQueued"])),
+                      "# TYPE lex_twilio_lex_requests_rejected_total counter",
+                      "lex_twilio_lex_requests_rejected_total {0}".format(int(counters["LexRejected"]))])
+        return "\n".join(lines) + "\n"
+
+    # a sample per worker, labelled with the worker when there are several
+    @staticmethod
+    def per_worker(name, values):
+        if len(values) == 1:
+            return ["{0} {1}".format(name, values[0])]
+        return ['{0}{{worker="{1}"}} {2}'.format(name, worker, value) for worker, value in enumerate(values)]
@@ -0,0 +1,380 @@
+"""
+asyncio server mode for the Lex / Twilio media stream integration
+
+Serves the same endpoints as server.py (/ping, /ready, /twiml, /updatecall and the
+media stream WebSocket on /) from a single aiohttp event loop. WebSocket reads,
+voice and silence detection, streaming to Lex and the Twilio call updates (sent
+by an AsyncCallUpdateDispatcher, see call_updates.py) all run as coroutines, so a call costs a task rather than a gevent greenlet plus a
+request thread per utterance. Reading from the WebSocket pauses while Lex is
+behind on the audio already streamed to it.
+
+Run with:
+    python async_server.py
+
+or, with one event loop per core, WORKERS=4 python async_server.py (see workers.py).
+"""
+
+import asyncio
+import json
+import logging
+import os
+import signal
+import ssl
+import time
+import uuid
+
+import aiohttp
+from aiohttp import web
+
+from admission import WS_TRY_AGAIN_LATER, AdmissionControl, busy_twiml, retry_twiml
+from call_updates import AsyncCallUpdateDispatcher
+from http_session_pool import HttpSessionPool, PoolStats, pool_trace_config
+from lex_streaming_client import AsyncLexClientStreaming
+from media_frames import media_payload
+from metrics import NULL_TRACE, TurnMetrics
+from playback import LEX_AUDIO_ACCEPT, PLAYBACK_MODE, STREAM, MediaStreamPlayback, PlaybackMetrics
+from twilio_call import TwilioCall, build_twiml, fallback_twiml, is_goodbye
+from twiml_store import shared_store
+from vad_diagnostics import VadDiagnostics
+from voice_and_silence_detecting_lex_wrapper import AsyncVoiceAndSilenceDetectingLexClient
+from warm_up import Readiness, warm_up_async, warm_up_steps_async
+from workers import WorkerStats, reuse_port_socket, run_workers, worker_config
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+
+def log(msg, *args):
+    print("Media WS: ", msg, *args)
+
+
+# liveness, with the load shedding signal for whoever is watching (see admission.py)
+async def health_check_response(request):
+    admission = AdmissionControl.shared()
+    return web.json_response({"message": "echo...health check....",
+                              "Shedding": admission.shedding(),
+                              "Load": round(admission.load(), 3)})
+
+
+# 503 until the warm-up is done and again while draining, see warm_up.py. /ping only says the process is alive
+async def readiness_response(request):
+    readiness = Readiness.shared()
+    return web.json_response(readiness.snapshot(), status=200 if readiness.is_ready() else 503)
+
+
+async def metrics_response(request):
+    return web.Response(text=TurnMetrics.shared().render() + AdmissionControl.shared().render(), content_type="text/plain")
+
+
+async def traces_response(request):
+    return web.json_response(TurnMetrics.shared().traces())
+
+
+async def vad_diagnostics_response(request):
+    return web.json_response(VadDiagnostics.shared().snapshot())
+
+
+async def twiml_store_response(request):
+    return web.json_response(shared_store().stats())
+
+
+async def lex_pool_response(request):
+    return web.json_response(request.app["lex_pool_stats"].snapshot())
+
+
+async def call_updates_response(request):
+    return web.json_response(request.app["call_updates"].stats())
+
+
+async def playback_response(request):
+    return web.json_response(PlaybackMetrics.shared().snapshot())
+
+
+async def worker_response(request):
+    return web.json_response(WorkerStats.shared().snapshot())
+
+
+async def admission_response(request):
+    return web.json_response(AdmissionControl.shared().snapshot())
+
+
+async def return_twiml_for_call_sid(request):
+    request_object = await request.post()
+    TurnMetrics.shared().mark(request_object["CallSid"], "updatecall_fetched")
+    started = time.monotonic()
+    store = shared_store()
+    if store.blocking:
+        response = await asyncio.get_event_loop().run_in_executor(None, store.pop, request_object["CallSid"])
+    else:
+        response = store.pop(request_object["CallSid"])
+    TurnMetrics.shared().duration(request_object["CallSid"], "updatecall_pop", time.monotonic() - started)
+    if response is None:
+        logging.getLogger(__name__).warning("no TwiML stored for call {0}".format(request_object["CallSid"]))
+        response = fallback_twiml()
+    return web.Response(text=response, content_type="text/xml")
+
+
+async def return_twiml(request):
+    print("POST TwiML")
+    if not AdmissionControl.shared().admit_twiml():
+        return web.Response(text=busy_twiml(), content_type="text/xml")
+    template_name = "connect_stream.xml" if PLAYBACK_MODE == STREAM else "streams.xml"
+    with open(os.path.join(TEMPLATES_DIR, template_name)) as template:
+        return web.Response(text=template.read(), content_type="text/xml")
+
+
+async def echo(request):
+    print("Connection accepted")
+    ws = web.WebSocketResponse()
+    await ws.prepare(request)
+    admission = AdmissionControl.shared()
+    if not admission.admit_call():
+        await reject_call(ws, request.app["call_updates"])
+        return ws
+    client_data_processor = AsyncTwilioDataProcessor(ws, request.app["call_updates"])
+    try:
+        await client_data_processor.start()
+    finally:
+        admission.call_ended()
+    return ws
+
+
+# a stream over the call limit: the call is updated to the busy TwiML, which hangs up, and the stream is closed
+async def reject_call(ws, call_updates):
+    async for message in ws:
+        if message.type != aiohttp.WSMsgType.TEXT:
+            break
+        data = json.loads(message.data)
+        if data['event'] == "start":
+            twilio_call = TwilioCall(data["start"]["accountSid"], data["start"]["callSid"])
+            await twilio_call.persist_async(busy_twiml())
+            call_updates.submit(twilio_call)
+            break
+    await ws.close(code=WS_TRY_AGAIN_LATER)
+
+
+class AsyncTwilioDataProcessor:
+    PREWARM_LEX_STREAM = os.environ.get('LEX_PREWARM', 'false').lower() == 'true'
+
+    def __init__(self, ws, call_updates):
+        self.logger = logging.getLogger(__name__)
+        self.ws = ws
+        self.call_updates = call_updates
+        raw_id = str(uuid.uuid4())
+        self.user_id = raw_id[0:24].replace("-", "").upper()
+        self.accept = LEX_AUDIO_ACCEPT if PLAYBACK_MODE == STREAM else None
+        # carried from turn to turn, with adaptive thresholds
+        self.noise_floor = AsyncVoiceAndSilenceDetectingLexClient.call_noise_floor()
+        self.lex_streaming_client = AsyncVoiceAndSilenceDetectingLexClient(self.user_id, [self], [self], self.PREWARM_LEX_STREAM, self.accept, self.noise_floor)
+        self.twilio_call = None
+        self.trace = NULL_TRACE
+        self.turn_task = None
+        self.playback = None
+
+    async def start(self):
+        try:
+            async for message in self.ws:
+                if message.type != aiohttp.WSMsgType.TEXT:
+                    break
+
+                # media frames skip the json decoder
+                payload = media_payload(message.data)
+                if payload is not None:
+                    await self.receive_media(payload)
+                    continue
+
+                data = json.loads(message.data)
+                if data['event'] == "connected":
+                    log("Connected Message received", message.data)
+                if data['event'] == "start":
+                    log("Start Message received", message.data)
+                    self.twilio_call = TwilioCall(data["start"]["accountSid"], data["start"]["callSid"])
+                    self.trace = TurnMetrics.shared().start_call(data["start"]["callSid"])
+                    if PLAYBACK_MODE == STREAM:
+                        self.playback = MediaStreamPlayback(data["start"]["streamSid"])
+
+                if data['event'] == "media":
+                    await self.receive_media(data["media"]["payload"])
+                if data['event'] == "mark" and self.playback is not None:
+                    # the goodbye prompt has been played, closing the stream ends <Connect> and the call
+                    if self.playback.mark_received(data):
+                        await self.ws.close()
+                        break
+                if data['event'] == "closed":
+                    log("Closed Message received", message.data)
+                    break
+
+        except Exception as e:
+            self.logger.exception(e)
+        finally:
+            if self.turn_task is not None:
+                self.turn_task.cancel()
+            await self.lex_streaming_client.close_async()
+            self.trace.end()
+            if self.playback is not None:
+                self.playback.record()
+                self.logger.info("playback for call: {0}".format(self.playback.stats()))
+
+    # media received while a turn is being answered is not listened to, as in TwilioDataProcessor
+    async def receive_media(self, payload):
+        if self.turn_task is not None:
+            return
+        self.lex_streaming_client.stream_to_lex(payload)
+        if self.lex_streaming_client.is_utterance_complete():
+            self.turn_task = asyncio.get_running_loop().create_task(self.complete_turn())
+        else:
+            await self.lex_streaming_client.drain()
+
+    async def complete_turn(self):
+        try:
+            await self.lex_streaming_client.finish_utterance()
+            self.reset()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.logger.exception(e)
+            await self.ws.close()
+        finally:
+            self.turn_task = None
+
+    def reset(self):
+        self.logger.info("recreating VAD lex client")
+        self.lex_streaming_client = AsyncVoiceAndSilenceDetectingLexClient(self.user_id, [self], [self], self.PREWARM_LEX_STREAM, self.accept, self.noise_floor)
+
+    def voice_detected(self):
+        self.logger.info("voice detected in input stream passed to fancy lex client")
+        self.pause_playback()
+
+    async def silence_detected(self, **kwargs):
+        self.logger.info("silence detected in input stream passed. process the collected data and send the result to play back")
+        for key, value in kwargs.items():
+            self.logger.info("{0} = {1}".format(key, value))
+        self.trace.next_turn()
+        self.trace.lex_timings(self.lex_streaming_client.get_lex_timestamps())
+        self.process()
+        await self.send_data_to_client(kwargs.get("lex_response"))
+
+    # barge-in: drop the rest of the prompt twilio is playing. called from stream_to_lex, so the send is scheduled
+    def pause_playback(self):
+        if self.playback is None:
+            return
+        clear = self.playback.barge_in()
+        if clear is not None:
+            self.logger.info("voice detected during playback, clearing the prompt")
+            asyncio.ensure_future(self.ws.send_str(clear))
+
+    def process(self):
+        self.logger.info("processing data listened so far")
+
+    async def send_data_to_client(self, lex_response):
+        self.logger.info("sending data to client {0}".format(lex_response))
+        if lex_response.get("Rejected"):
+            await self.retry_turn()
+            return
+        if self.playback is not None:
+            await self.play(lex_response)
+            return
+        response = build_twiml(lex_response)
+        self.logger.info("response is {0}".format(response))
+        started = time.monotonic()
+        await self.twilio_call.persist_async(response.to_xml())
+        self.trace.duration("twiml_persist", time.monotonic() - started)
+        self.call_updates.submit(self.twilio_call)
+
+    # lex had no room for the turn, ask the caller to say it again. playing back over the stream there is nothing
+    # to play, and a call update would end <Connect>, so the call just keeps listening
+    async def retry_turn(self):
+        if self.playback is not None:
+            self.logger.warning("no lex request slot for the turn, listening for the caller again")
+            return
+        await self.twilio_call.persist_async(retry_twiml())
+        self.call_updates.submit(self.twilio_call)
+
+    # send the lex audio over the media stream as it arrives from lex
+    async def play(self, lex_response):
+        if lex_response.get("Audio") is None:
+            self.logger.warning("lex returned no audio, nothing to play back")
+            return
+        self.playback.start(is_goodbye(lex_response))
+        async for chunk in lex_response["Audio"]:
+            for message in self.playback.feed(chunk):
+                await self.ws.send_str(message)
+        for message in self.playback.finish():
+            await self.ws.send_str(message)
+        if self.playback.first_audio_at is not None:
+            self.trace.mark("first_audio_sent", self.playback.first_audio_at)
+
+
+async def open_http_session(app):
+    config = HttpSessionPool.http_pool_config
+    ssl_context = ssl.create_default_context(cafile=config["CaBundle"]) if config["CaBundle"] else None
+    # a lex stream holds its connection for the whole utterance, so concurrent connections are not capped here.
+    # idle connections are kept alive and reused as with HttpSessionPool
+    connector = aiohttp.TCPConnector(limit=0, limit_per_host=0, keepalive_timeout=config["IdleTimeoutInSecs"], ssl=ssl_context)
+    app["lex_pool_stats"] = PoolStats()
+    trace_config = pool_trace_config(app["lex_pool_stats"], AsyncLexClientStreaming.lex_endpoint())
+    app["http_session"] = aiohttp.ClientSession(connector=connector, trace_configs=[trace_config])
+    AsyncLexClientStreaming.use_session(app["http_session"])
+    app["call_updates"] = AsyncCallUpdateDispatcher.from_config(app["http_session"])
+
+
+async def close_http_session(app):
+    await app["call_updates"].close()
+    await app["http_session"].close()
+
+
+def create_app():
+    app = web.Application()
+    app.router.add_get("/ping", health_check_response)
+    app.router.add_get("/ready", readiness_response)
+    app.router.add_get("/metrics", metrics_response)
+    app.router.add_get("/debug/traces", traces_response)
+    app.router.add_get("/debug/vad", vad_diagnostics_response)
+    app.router.add_get("/debug/twiml", twiml_store_response)
+    app.router.add_get("/debug/lex", lex_pool_response)
+    app.router.add_get("/debug/twilio", call_updates_response)
+    app.router.add_get("/debug/playback", playback_response)
+    app.router.add_get("/debug/worker", worker_response)
+    app.router.add_get("/debug/admission", admission_response)
+    app.router.add_post("/updatecall", return_twiml_for_call_sid)
+    app.router.add_post("/twiml", return_twiml)
+    app.router.add_get("/", echo)
+    app.on_startup.append(open_http_session)
+    app.on_cleanup.append(close_http_session)
+    return app
+
+
+# run the server until SIGTERM, then stop accepting connections and let the active calls end, for up to the drain
+# timeout. web.run_app() is not used as its shutdown stops reading from the open websockets. workers share the port
+# through SO_REUSEPORT
+async def run_server(worker_index):
+    port = int(os.environ.get('CONTAINER_PORT'))
+    # calls still active after the drain timeout are closed right away
+    runner = web.AppRunner(create_app(), shutdown_timeout=1.0)
+    await runner.setup()
+    site = web.TCPSite(runner, port=port) if worker_index is None else web.SockSite(runner, reuse_port_socket(port))
+    await site.start()
+    print("Server listening on: http://localhost:{0}{1}".format(port, "" if worker_index is None else " (worker {0})".format(worker_index)))
+    warming_up = asyncio.get_running_loop().create_task(warm_up_async(warm_up_steps_async(runner.app["http_session"])))
+
+    stopping = asyncio.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        asyncio.get_running_loop().add_signal_handler(signum, stopping.set)
+    await stopping.wait()
+
+    warming_up.cancel()
+    await site.stop()
+    stats = WorkerStats.shared()
+    stats.draining = True
+    logging.getLogger(__name__).info("draining {0} active calls".format(stats.active_calls))
+    deadline = time.monotonic() + worker_config["DrainTimeoutInSecs"]
+    while stats.active_calls > 0 and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    await runner.cleanup()
+
+
+def serve(worker_index):
+    asyncio.run(run_server(worker_index))
+
+
+if __name__ == '__main__':
+    run_workers(serve)
@@ -0,0 +1,136 @@
+"""
+Turn duration with and without barge-in on bidirectional media streams.
+
+Runs async_server.py (or server.py with --server server.py) with
+PLAYBACK_MODE=stream against a FakeLex answering with --prompt-secs of audio.
+Each simulated call speaks for --voice-secs per turn, then waits for the
+prompt to be played back:
+
+    patient  - the caller waits until the prompt has been played (its mark
+               came back) before speaking again, as with <Say> playback.
+    barge-in - the caller starts speaking --barge-in-after secs into the prompt;
+               the server detects voice and clears the rest of the prompt.
+
+Reports the mean turn duration (start of speech to start of the next speech),
+the time from the barge-in speech to the clear message, and the server's
+/debug/playback totals. Media is paced in real time, so a run takes about
+calls-in-parallel x turns x (voice + silence + prompt) seconds.
+
+Usage:
+    python benchmarks/barge_in_benchmark.py [--calls 10] [--turns 3] [--prompt-secs 4] [--barge-in-after 1]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+from load_harness import wait_until_up
+from fake_services import FakeLex, FakeTwilio, MediaStreamClient, SILENT_FRAME, VOICED_FRAME
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+
+async def simulated_call(index, args, barge_in, server_url, session, turn_secs, clear_latencies):
+    client = MediaStreamClient(server_url.replace("http", "ws") + "/", "ACfake", "CA{0:032d}".format(index))
+    await client.connect(session)
+    speech_started = None
+    for _ in range(args.turns):
+        if speech_started is not None:
+            turn_secs.append(time.perf_counter() - speech_started)
+        speech_started = time.perf_counter()
+        prompts = len(client.prompts_started)
+        clears = len(client.clears)
+        for _ in range(int(args.voice_secs / 0.02)):
+            await client.send_frame(VOICED_FRAME)
+            if len(client.clears) > clears:
+                clear_latencies.append(client.clears[-1] - speech_started)
+                clears = len(client.clears)
+
+        # silence until the answer to this turn starts playing
+        deadline = time.perf_counter() + args.turn_timeout
+        while len(client.prompts_started) == prompts:
+            await client.send_frame(SILENT_FRAME)
+            if time.perf_counter() > deadline:
+                raise RuntimeError("call {0} got no prompt within {1} s".format(client.call_sid, args.turn_timeout))
+
+        if barge_in:
+            for _ in range(int(args.barge_in_after / 0.02)):
+                await client.send_frame(SILENT_FRAME)
+        else:
+            while client.is_playing():
+                await client.send_frame(SILENT_FRAME)
+    turn_secs.append(time.perf_counter() - speech_started)
+    await client.close()
+
+
+async def run_mode(args, barge_in):
+    lex = await FakeLex(latency=args.lex_latency, audio_secs=args.prompt_secs).start()
+    twilio = await FakeTwilio().start()
+    server_url = "http://127.0.0.1:{0}".format(args.port)
+    environment = dict(os.environ,
+                       CONTAINER_PORT=str(args.port),
+                       URL=server_url,
+                       PLAYBACK_MODE="stream",
+                       LEX_ENDPOINT=lex.endpoint,
+                       TWILIO_API_URL=twilio.endpoint,
+                       TWILIO_AUTH_TOKEN="fake",
+                       AWS_REGION="us-east-1",
+                       ACCESS_KEY_ID="AKIDEXAMPLE",
+                       SECRET_ACCESS_KEY="secret",
+                       LEX_BOT_NAME="BenchBot",
+                       LEX_BOT_ALIAS="bench")
+    server = subprocess.Popen([sys.executable, args.server], cwd=ROOT, env=environment,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        await wait_until_up(server_url, server)
+        turn_secs = []
+        clear_latencies = []
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+            results = await asyncio.gather(*[simulated_call(index, args, barge_in, server_url, session, turn_secs, clear_latencies)
+                                             for index in range(args.calls)], return_exceptions=True)
+            # the server records a call's playback once its websocket is closed
+            await asyncio.sleep(0.5)
+            async with session.get(server_url + "/debug/playback") as response:
+                playback = await response.json()
+
+        failures = [result for result in results if isinstance(result, Exception)]
+        print("{0:9s} turn p50 {1:.2f} s, mean {2:.2f} s over {3} turns, failed calls {4}".format(
+            "barge-in" if barge_in else "patient", statistics.median(turn_secs), statistics.mean(turn_secs),
+            len(turn_secs), len(failures)))
+        if failures:
+            print("          first failure: {0!r}".format(failures[0]))
+        if clear_latencies:
+            print("          speech -> clear p50 {0:.0f} ms, max {1:.0f} ms".format(
+                statistics.median(clear_latencies) * 1000, max(clear_latencies) * 1000))
+        print("          /debug/playback {0}".format(playback))
+    finally:
+        server.terminate()
+        server.wait()
+        await lex.stop()
+        await twilio.stop()
+
+
+async def run(args):
+    for mode in args.modes:
+        await run_mode(args, mode == "barge-in")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", default="async_server.py")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--calls", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--voice-secs", type=float, default=1.0)
+    parser.add_argument("--prompt-secs", type=float, default=4.0)
+    parser.add_argument("--barge-in-after", type=float, default=1.0)
+    parser.add_argument("--lex-latency", type=float, default=0.2)
+    parser.add_argument("--turn-timeout", type=float, default=15.0)
+    parser.add_argument("--modes", nargs="+", default=["patient", "barge-in"], choices=["patient", "barge-in"])
+    asyncio.run(run(parser.parse_args()))
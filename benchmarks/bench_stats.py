@@ -0,0 +1,11 @@
+"""
+Summary statistics shared by the benchmarks.
+"""
+
+
+# nearest-rank percentile of values (in any order), fraction between 0 and 1. 0.0 for no values
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
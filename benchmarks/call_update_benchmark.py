@@ -0,0 +1,117 @@
+"""
+Cost of Twilio call updates to the media loop, blocking vs. dispatched.
+
+Runs a FakeTwilio (see fake_services.py) with --latency and --failure-rate and
+sends --calls call updates, --repeat of them per CallSid in quick succession:
+
+    blocking    - the old path: a new twilio rest Client per update, called
+                  inline, so the media loop is stalled for the whole request.
+    dispatcher  - CallUpdateDispatcher.submit(), sent by --workers threads
+                  with the cached pooled rest client, retrying failed updates.
+
+Reports how long the caller (the media loop) was stalled per update, how long
+until all updates were delivered, connections opened to the fake Twilio,
+coalesced updates, retries and the maximum queue depth.
+
+Usage:
+    python benchmarks/call_update_benchmark.py [--calls 200] [--latency 0.05] [--failure-rate 0.05]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from bench_stats import percentile
+from fake_services import FakeTwilio
+
+
+def report(name, stalls, elapsed, fake, extra=""):
+    print("{0:10s} stall per update p50 {1:.3f} ms p99 {2:.3f} ms, all delivered in {3:.2f} s, "
+          "{4} connections, {5} requests ({6} failed){7}".format(
+              name, percentile(stalls, 0.5) * 1000, percentile(stalls, 0.99) * 1000, elapsed,
+              fake.connections, fake.attempts, fake.failures, extra))
+
+
+def run_blocking(args, fake, calls):
+    from twilio.rest import Client
+    from twilio_http import PooledTwilioHttpClient
+    from http_session_pool import PoolStats
+
+    stalls = []
+    errors = 0
+    started = time.perf_counter()
+    for twilio_call in calls:
+        update_started = time.perf_counter()
+        # a fresh client and connection pool per update, as TwilioCall.update() used to do
+        client = Client(twilio_call.account_sid, twilio_call.auth_token,
+                        http_client=PooledTwilioHttpClient(fake.endpoint, PoolStats(), 1, 10))
+        try:
+            client.calls(twilio_call.call_sid).update(method="POST", url=twilio_call.update_url())
+        except Exception:
+            errors = errors + 1
+        stalls.append(time.perf_counter() - update_started)
+    report("blocking", stalls, time.perf_counter() - started, fake, ", {0} updates lost".format(errors))
+
+
+def run_dispatcher(args, fake, calls):
+    from call_updates import CallUpdateDispatcher
+    from twilio_call import TwilioCall
+
+    dispatcher = CallUpdateDispatcher(args.workers, args.max_queued, args.max_attempts, args.backoff)
+    stalls = []
+    started = time.perf_counter()
+    for twilio_call in calls:
+        submit_started = time.perf_counter()
+        dispatcher.submit(twilio_call)
+        stalls.append(time.perf_counter() - submit_started)
+    dispatcher.join()
+    elapsed = time.perf_counter() - started
+    stats = dispatcher.stats()
+    dispatcher.close()
+    report("dispatcher", stalls, elapsed, fake,
+           "\n           sent {Sent}, failed {Failed}, coalesced {Coalesced}, retries {Retries}, rejected {Rejected}, "
+           "max queue depth {MaxQueueDepth}, mean queued {MeanQueuedMs} ms, mean send {MeanSendMs} ms, "
+           "pool {0}".format(TwilioCall.pool_stats.snapshot(), **stats))
+
+
+def run(args):
+    fake = FakeTwilio(fetch_twiml=False, latency=args.latency, failure_rate=args.failure_rate).start_in_thread()
+    os.environ["TWILIO_API_URL"] = fake.endpoint
+    os.environ["TWILIO_AUTH_TOKEN"] = "token"
+    os.environ.setdefault("URL", "https://example.com")
+    os.environ.setdefault("TWIML_STORE", "memory")
+
+    from twilio_call import TwilioCall
+
+    calls = []
+    for index in range(args.calls):
+        for _ in range(args.repeat):
+            calls.append(TwilioCall("AC" + "0" * 32, "CA{0:032x}".format(index)))
+
+    for mode in args.modes:
+        fake.transports.clear()
+        fake.attempts = 0
+        fake.failures = 0
+        if mode == "blocking":
+            run_blocking(args, fake, calls)
+        else:
+            run_dispatcher(args, fake, calls)
+
+    fake.stop_in_thread()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=2, help="updates submitted per CallSid")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake twilio response time in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.05)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--max-queued", type=int, default=1000)
+    parser.add_argument("--max-attempts", type=int, default=3)
+    parser.add_argument("--backoff", type=float, default=0.05)
+    parser.add_argument("--modes", nargs="+", default=["blocking", "dispatcher"], choices=["blocking", "dispatcher"])
+    run(parser.parse_args())
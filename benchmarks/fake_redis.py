@@ -0,0 +1,121 @@
+"""
+A local stand-in for Redis, speaking enough of RESP for RedisTwimlStore.
+
+Supports HELLO, PING, GET, SET (with EX/PX), DEL, GETDEL, MULTI/EXEC and answers
++OK to connection setup commands (CLIENT, SELECT, ...). Keys expire lazily
+on access. One thread per connection; `latency` is added to every command to
+stand in for the network hop to a real Redis. Use with REDIS_URL=server.url.
+"""
+
+import socket
+import socketserver
+import threading
+import time
+
+
+class FakeRedisServer:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.data = {}
+        self.lock = threading.Lock()
+        self.commands = 0
+        self.connections = 0
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                # like redis, no nagle delay on replies
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                with server.lock:
+                    server.connections = server.connections + 1
+                queued = None
+                protocol = 2
+                while True:
+                    command = server.read_command(self.rfile)
+                    if command is None:
+                        return
+                    name = command[0].upper()
+                    if name == b"MULTI":
+                        queued = []
+                        reply = b"+OK\r\n"
+                    elif name == b"EXEC":
+                        replies = [server.execute(queued_command, protocol) for queued_command in queued or []]
+                        queued = None
+                        reply = b"*" + str(len(replies)).encode() + b"\r\n" + b"".join(replies)
+                    elif queued is not None:
+                        queued.append(command)
+                        reply = b"+QUEUED\r\n"
+                    elif name == b"HELLO":
+                        protocol = int(command[1]) if len(command) > 1 else 2
+                        reply = server.hello(protocol)
+                    else:
+                        reply = server.execute(command, protocol)
+                    self.wfile.write(reply)
+                    self.wfile.flush()
+
+        class Server(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self.server = Server(("127.0.0.1", 0), Handler)
+        self.url = "redis://127.0.0.1:{0}/0".format(self.server.server_address[1])
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def read_command(self, rfile):
+        line = rfile.readline()
+        if not line:
+            return None
+        count = int(line[1:])
+        arguments = []
+        for _ in range(count):
+            length = int(rfile.readline()[1:])
+            arguments.append(rfile.read(length + 2)[:-2])
+        return arguments
+
+    def hello(self, protocol):
+        fields = [(b"server", b"$5\r\nredis\r\n"), (b"version", b"$5\r\n7.2.0\r\n"),
+                  (b"proto", b":" + str(protocol).encode() + b"\r\n")]
+        reply = b"".join(b"$" + str(len(key)).encode() + b"\r\n" + key + b"\r\n" + value for key, value in fields)
+        if protocol == 3:
+            return b"%3\r\n" + reply
+        return b"*6\r\n" + reply
+
+    def execute(self, command, protocol=2):
+        if self.latency:
+            time.sleep(self.latency)
+        name = command[0].upper()
+        now = time.monotonic()
+        with self.lock:
+            self.commands = self.commands + 1
+            if name == b"PING":
+                return b"+PONG\r\n"
+            if name == b"SET":
+                expires_at = None
+                options = [option.upper() for option in command[3:]]
+                if b"EX" in options:
+                    expires_at = now + float(command[3 + options.index(b"EX") + 1])
+                elif b"PX" in options:
+                    expires_at = now + float(command[3 + options.index(b"PX") + 1]) / 1000
+                self.data[command[1]] = (command[2], expires_at)
+                return b"+OK\r\n"
+            if name in (b"GET", b"GETDEL"):
+                entry = self.data.get(command[1])
+                if entry is not None and entry[1] is not None and entry[1] < now:
+                    del self.data[command[1]]
+                    entry = None
+                if entry is None:
+                    return b"_\r\n" if protocol == 3 else b"$-1\r\n"
+                if name == b"GETDEL":
+                    del self.data[command[1]]
+                return b"$" + str(len(entry[0])).encode() + b"\r\n" + entry[0] + b"\r\n"
+            if name == b"DEL":
+                deleted = sum(1 for key in command[1:] if self.data.pop(key, None) is not None)
+                return b":" + str(deleted).encode() + b"\r\n"
+            return b"+OK\r\n"
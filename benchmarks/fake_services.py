@@ -0,0 +1,324 @@
+"""
+asyncio stand-ins for Lex, the Twilio REST API and Twilio media stream clients.
+
+FakeLex serves PostContent on /bot/<bot>/alias/<alias>/user/<user>/content,
+reads the whole streamed body, recording when each piece of it arrived (in
+received), and answers after a configurable latency, plus
+up to latency_jitter either way, with its responses in turn (dicts as
+returned by LexClientStreaming.get_response(), see lex_response_headers())
+and audio_secs of 16 kHz PCM in the body when asked for audio/pcm, streamed
+in chunks of synthesis_chunk_secs of audio produced at synthesis_speed times
+real time, like a TTS engine.
+FakeTwilio serves the call update endpoint
+(/2010-04-01/Accounts/<account>/Calls/<call>.json) and, like Twilio, fetches
+the new TwiML from the Url it was given. It can add latency and fail a
+fraction of the updates with 503. MediaStreamClient plays the part of a
+Twilio media stream, sending connected/start/media/stop messages over a
+WebSocket. Like Twilio on a bidirectional stream, it "plays" media sent back by
+the server in real time (scaled by speed), echoes marks once the audio before
+them has been played and drops buffered audio on clear. Point a server at the fakes with LEX_ENDPOINT and TWILIO_API_URL.
+
+The fakes count the connections they accepted and serve HTTPS when given an
+ssl.SSLContext, e.g. one built by self_signed_context() (set LEX_CA_BUNDLE to
+the certificate it returns). Benchmarks without an event loop of their own
+run a fake with start_in_thread().
+"""
+
+import array
+import asyncio
+import base64
+import json
+import math
+import os
+import random
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+
+import aiohttp
+from aiohttp import web
+
+FRAME_SECS = 0.02
+# mu-law bytes 0x00 and 0x80 decode to -32124 and 32124, 0xff decodes to 0
+VOICED_FRAME = base64.b64encode(bytes([0x00, 0x80]) * 80).decode("ascii")
+SILENT_FRAME = base64.b64encode(bytes([0xff]) * 160).decode("ascii")
+
+
+class FakeService:
+    def __init__(self, host="127.0.0.1", port=0, ssl_context=None):
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context
+        self.app = web.Application(middlewares=[self.count_connection])
+        self.runner = None
+        self.loop = None
+        # the connections requests arrived on
+        self.transports = set()
+
+    @property
+    def endpoint(self):
+        return "{0}://{1}:{2}".format("https" if self.ssl_context is not None else "http", self.host, self.port)
+
+    @property
+    def connections(self):
+        return len(self.transports)
+
+    @web.middleware
+    async def count_connection(self, request, handler):
+        self.transports.add(request.transport)
+        return await handler(request)
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port, ssl_context=self.ssl_context)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    # serve from an event loop in a background thread, for benchmarks that do not run one
+    def start_in_thread(self):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self.start(), self.loop).result()
+        return self
+
+    def stop_in_thread(self):
+        asyncio.run_coroutine_threadsafe(self.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+# returns (context, certificate path) for a throwaway self-signed localhost certificate
+def self_signed_context():
+    directory = tempfile.mkdtemp(prefix="fake-lex-")
+    cert_path = os.path.join(directory, "cert.pem")
+    key_path = os.path.join(directory, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                    "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+                    "-keyout", key_path, "-out", cert_path],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_path, key_path)
+    return context, cert_path
+
+
+# lex response headers for a response given as in LexClientStreaming.get_response(), e.g. {"DialogState": "Fulfilled"}
+def lex_response_headers(response):
+    names = {"DialogState": "x-amz-lex-dialog-state",
+             "Message": "x-amz-lex-message",
+             "Utterance": "x-amz-lex-input-transcript",
+             "IntentName": "x-amz-lex-intent-name",
+             "LexRequestId": "x-amzn-RequestId"}
+    return {names.get(key, key): value for key, value in response.items() if value is not None}
+
+
+class FakeLex(FakeService):
+    def __init__(self, latency=0.0, response_headers=None, audio_secs=3.0, synthesis_chunk_secs=0.1,
+                 synthesis_speed=5.0, responses=None, latency_jitter=0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.random = random.Random(1)
+        self.synthesis_chunk_bytes = int(16000 * 2 * synthesis_chunk_secs)
+        self.synthesis_chunk_delay = synthesis_chunk_secs / synthesis_speed if synthesis_speed else 0.0
+        # a quiet 16 kHz 16-bit sine wave standing in for the synthesized prompt
+        self.audio = array.array("h", (int(1000 * math.sin(2 * math.pi * 440 * index / 16000.0))
+                                       for index in range(int(16000 * audio_secs)))).tobytes()
+        self.response_headers = response_headers or {
+            "x-amz-lex-dialog-state": "ElicitSlot",
+            "x-amz-lex-message": "What city are you in?",
+            "x-amz-lex-input-transcript": "book a hotel",
+            "x-amz-lex-intent-name": "BookHotel",
+            "x-amzn-RequestId": "fake-request-id"
+        }
+        # answered in turn, one per request
+        self.responses = [lex_response_headers(response) for response in responses] if responses else [self.response_headers]
+        self.requests = 0
+        self.bytes_received = 0
+        # per request its path and (arrival time, bytes) for every piece of the body as it was read
+        self.received = []
+        self.app.router.add_post("/bot/{bot}/alias/{alias}/user/{user}/content", self.post_content)
+
+    async def post_content(self, request):
+        chunks = []
+        async for data in request.content.iter_any():
+            chunks.append((time.perf_counter(), data))
+        self.received.append({"path": request.path, "chunks": chunks})
+        body = b"".join(data for _, data in chunks)
+        headers = self.responses[self.requests % len(self.responses)]
+        self.requests = self.requests + 1
+        self.bytes_received = self.bytes_received + len(body)
+        latency = self.latency + self.random.uniform(-self.latency_jitter, self.latency_jitter)
+        if latency > 0:
+            await asyncio.sleep(latency)
+        if request.headers.get("Accept", "").startswith("audio/pcm"):
+            return await self.stream_audio(request, headers)
+        return web.Response(headers=headers)
+
+    async def stream_audio(self, request, headers):
+        response = web.StreamResponse(headers=headers)
+        response.content_type = "audio/pcm"
+        response.enable_chunked_encoding()
+        await response.prepare(request)
+        try:
+            for offset in range(0, len(self.audio), self.synthesis_chunk_bytes):
+                if self.synthesis_chunk_delay:
+                    await asyncio.sleep(self.synthesis_chunk_delay)
+                await response.write(self.audio[offset:offset + self.synthesis_chunk_bytes])
+            await response.write_eof()
+        except ConnectionResetError:
+            # the caller hung up, or barged in, before the prompt was read to the end
+            pass
+        return response
+
+
+class FakeTwilio(FakeService):
+    def __init__(self, fetch_twiml=True, latency=0.0, failure_rate=0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.fetch_twiml = fetch_twiml
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(1)
+        self.attempts = 0
+        self.failures = 0
+        self.updates = {}
+        self.update_times = {}
+        self.twiml_fetched = {}
+        self.waiters = {}
+        self.session = None
+        self.app.router.add_post("/2010-04-01/Accounts/{account}/Calls/{call}.json", self.update_call)
+        self.app.on_cleanup.append(self.close_session)
+
+    async def close_session(self, app):
+        if self.session is not None:
+            await self.session.close()
+
+    # resolves with the time the next update for call_sid arrived
+    def wait_for_update(self, call_sid):
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[call_sid] = future
+        return future
+
+    async def update_call(self, request):
+        call_sid = request.match_info["call"]
+        received_at = time.perf_counter()
+        form = await request.post()
+        self.attempts = self.attempts + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.random.random() < self.failure_rate:
+            self.failures = self.failures + 1
+            return web.json_response({"code": 20503, "message": "Service Unavailable", "status": 503}, status=503)
+        self.updates[call_sid] = self.updates.get(call_sid, 0) + 1
+        self.update_times.setdefault(call_sid, []).append(received_at)
+
+        if self.fetch_twiml and form.get("Url"):
+            if self.session is None:
+                self.session = aiohttp.ClientSession()
+            async with self.session.post(form["Url"], data={"CallSid": call_sid}) as twiml:
+                await twiml.read()
+            self.twiml_fetched[call_sid] = time.perf_counter()
+
+        waiter = self.waiters.pop(call_sid, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(received_at)
+        return web.json_response({"sid": call_sid, "status": "in-progress"})
+
+
+# a media message as twilio sends it: compact json with "event" first
+def twilio_media_message(stream_sid, sequence_number, payload):
+    return json.dumps({"event": "media",
+                       "sequenceNumber": str(sequence_number),
+                       "media": {"track": "inbound", "chunk": str(sequence_number - 1),
+                                 "timestamp": str((sequence_number - 2) * 20), "payload": payload},
+                       "streamSid": stream_sid}, separators=(",", ":"))
+
+
+class MediaStreamClient:
+    def __init__(self, url, account_sid, call_sid, speed=1.0):
+        self.url = url
+        self.account_sid = account_sid
+        self.call_sid = call_sid
+        self.stream_sid = "MZ" + call_sid[2:]
+        self.speed = speed
+        self.frame_interval = FRAME_SECS / speed
+        self.ws = None
+        self.sequence_number = 1
+        # when each media frame was sent
+        self.sent_at = []
+        self.next_frame_at = None
+        self.receiver = None
+        # playback of the media sent back by the server
+        self.played_until = 0.0
+        self.mark_tasks = set()
+        self.prompts_started = []
+        self.marks_played = []
+        self.clears = []
+
+    async def connect(self, session):
+        self.ws = await session.ws_connect(self.url)
+        await self.ws.send_str(json.dumps({"event": "connected", "protocol": "Call", "version": "1.0.0"}))
+        await self.ws.send_str(json.dumps({
+            "event": "start",
+            "streamSid": self.stream_sid,
+            "start": {"accountSid": self.account_sid, "callSid": self.call_sid, "streamSid": self.stream_sid,
+                      "tracks": ["inbound"], "mediaFormat": {"encoding": "audio/x-mulaw", "sampleRate": 8000, "channels": 1}}
+        }))
+        self.next_frame_at = time.perf_counter()
+        self.receiver = asyncio.ensure_future(self.receive())
+
+    def is_playing(self):
+        return self.played_until > time.perf_counter()
+
+    async def receive(self):
+        async for message in self.ws:
+            if message.type != aiohttp.WSMsgType.TEXT:
+                break
+            data = json.loads(message.data)
+            now = time.perf_counter()
+            if data["event"] == "media":
+                if self.played_until <= now:
+                    self.prompts_started.append(now)
+                    self.played_until = now
+                audio_secs = len(base64.b64decode(data["media"]["payload"])) / 8000.0
+                self.played_until = self.played_until + audio_secs / self.speed
+            elif data["event"] == "mark":
+                task = asyncio.ensure_future(self.echo_mark(data["mark"]["name"], self.played_until - now))
+                self.mark_tasks.add(task)
+                task.add_done_callback(self.mark_tasks.discard)
+            elif data["event"] == "clear":
+                self.clears.append(now)
+                self.played_until = now
+                # twilio sends back the marks of cleared audio right away
+                for task in list(self.mark_tasks):
+                    task.cancel()
+
+    async def echo_mark(self, name, delay):
+        try:
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.marks_played.append((name, time.perf_counter()))
+        finally:
+            if not self.ws.closed:
+                await self.ws.send_str(json.dumps({"event": "mark", "streamSid": self.stream_sid, "mark": {"name": name}}))
+
+    # send one media message, paced to the configured speed
+    async def send_frame(self, payload):
+        self.next_frame_at = self.next_frame_at + self.frame_interval
+        delay = self.next_frame_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self.sequence_number = self.sequence_number + 1
+        await self.ws.send_str(twilio_media_message(self.stream_sid, self.sequence_number, payload))
+        self.sent_at.append(time.perf_counter())
+
+    async def close(self):
+        await self.ws.send_str(json.dumps({"event": "stop", "streamSid": self.stream_sid}))
+        await self.ws.close()
+        if self.receiver is not None:
+            self.receiver.cancel()
@@ -0,0 +1,211 @@
+"""
+CPU time and allocations per media frame, from the WebSocket message to the Lex request body.
+
+Replays --turns synthetic turns (silence, speech, then silence until the end
+of the utterance) as the media messages Twilio sends, through:
+
+    before - json.loads() of every message, base64.b64decode(), a new pcm bytes
+             object per frame from VadEngine.process() and one write to the
+             lex request body per speech frame (the stream_to_lex() of before
+             media_frames and the chunk buffer).
+    after  - media_frames.media_payload(), binascii.a2b_base64() and
+             VadEngine.decode_into() the reusable chunk buffer, speech written
+             to lex in chunks of LexChunkMs (--chunk-ms).
+
+for every available VAD engine. Lex is replaced by a client counting the
+writes; each write is one chunk of the chunked request body, i.e. one send
+and a chunk header and trailer on the wire.
+
+CPU time is measured with tracemalloc off. Allocations are measured in a
+second pass with tracemalloc on: the high-water mark of memory allocated
+while handling a frame, above what was allocated before it, averaged over
+all frames ("peak bytes/frame"). Memory allocated and freed again within a
+frame counts once, at its largest.
+
+Usage:
+    python benchmarks/frame_path_benchmark.py [--turns 20] [--repeat 5] [--chunk-ms 100]
+"""
+
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+import tracemalloc
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore", DeprecationWarning)
+    from vad_engines import audioop, available_engines
+
+from endpointing import Endpointer
+from fake_services import twilio_media_message
+from media_frames import media_payload
+from voice_and_silence_detecting_lex_wrapper import VoiceAndSilenceDetectingLexClient
+
+FRAME_BYTES = 160
+STREAM_SID = "MZ" + "0" * 32
+
+
+class CountingLexClient:
+    """Stands in for LexClientStreaming, counting the writes to the request body"""
+    writes = 0
+    body_bytes = 0
+    framing_bytes = 0
+
+    def __init__(self, user_id, accept=None):
+        self.user_id = user_id
+
+    def prewarm(self):
+        pass
+
+    def add_to_stream(self, data):
+        cls = CountingLexClient
+        cls.writes = cls.writes + 1
+        cls.body_bytes = cls.body_bytes + len(data)
+        # "<size in hex>\r\n" before and "\r\n" after every chunk
+        cls.framing_bytes = cls.framing_bytes + len("{0:x}".format(len(data))) + 4
+
+    def stop(self):
+        pass
+
+    def abort(self):
+        pass
+
+    def is_crashed(self):
+        return False
+
+    def get_response(self):
+        return {}
+
+    def get_timings(self):
+        return {}
+
+
+class AfterLexClient(VoiceAndSilenceDetectingLexClient):
+    lex_client_class = CountingLexClient
+
+    def silence_detected(self):
+        pass
+
+    def record_diagnostics(self):
+        pass
+
+
+class BeforeLexClient(AfterLexClient):
+    # stream_to_lex() as it was before decode_into() and the chunk buffer
+    def stream_to_lex(self, base_64_encoded_data):
+        if self.stop_data_processing.is_set():
+            return
+        raw_audio_data, rms = self.engine.process(base64.b64decode(base_64_encoded_data))
+        event = self.endpointer.update(rms, len(raw_audio_data) // self.width)
+        self.energies.append(rms, self.endpointer.voiced)
+        if event == Endpointer.VOICE_STARTED:
+            self.voice_detected()
+            self.lex_client.add_to_stream(b"".join(list(self.pre_roll) + self.onset_audio_data + [raw_audio_data]))
+            self.pre_roll.clear()
+            self.onset_audio_data = []
+        elif self.endpointer.state == Endpointer.ONSET:
+            self.onset_audio_data.append(raw_audio_data)
+        elif self.endpointer.state == Endpointer.SPEECH:
+            self.lex_client.add_to_stream(raw_audio_data)
+        elif event == Endpointer.UTTERANCE_ENDED:
+            self.lex_client.add_to_stream(raw_audio_data)
+            self.end_of_utterance()
+        else:
+            self.pre_roll.extend(self.onset_audio_data)
+            self.pre_roll.append(raw_audio_data)
+            self.onset_audio_data = []
+
+
+def before_frame(client, message):
+    data = json.loads(message)
+    if data["event"] == "media":
+        client.stream_to_lex(data["media"]["payload"])
+
+
+def after_frame(client, message):
+    payload = media_payload(message)
+    if payload is not None:
+        client.stream_to_lex(payload)
+        return
+    data = json.loads(message)
+    if data["event"] == "media":
+        client.stream_to_lex(data["media"]["payload"])
+
+
+def ulaw_frame(amplitude):
+    pcm_data = b"".join(int(amplitude if index % 2 else -amplitude).to_bytes(2, "little", signed=True)
+                        for index in range(FRAME_BYTES))
+    return audioop.lin2ulaw(pcm_data, 2) if audioop is not None else bytes([0xff if amplitude < 100 else 0x9f]) * FRAME_BYTES
+
+
+def synthetic_messages(turns):
+    silent = base64.b64encode(ulaw_frame(10)).decode("ascii")
+    voiced = base64.b64encode(ulaw_frame(3000)).decode("ascii")
+    payloads = []
+    for _ in range(turns):
+        payloads += [silent] * 25 + [voiced] * 50 + [silent] * 110
+    return [twilio_media_message(STREAM_SID, index + 2, payload) for index, payload in enumerate(payloads)]
+
+
+# runs the messages through a new client per turn, returns the seconds and peak bytes allocated per frame
+def replay(client_class, handle_frame, messages, measure_allocations):
+    client = client_class("bench")
+    peak_bytes = 0
+    started = time.perf_counter()
+    for message in messages:
+        if measure_allocations:
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+        handle_frame(client, message)
+        if measure_allocations:
+            _, peak = tracemalloc.get_traced_memory()
+            peak_bytes = peak_bytes + peak - before
+        if client.stop_data_processing.is_set():
+            client = client_class("bench")
+    elapsed = time.perf_counter() - started
+    return elapsed / len(messages), peak_bytes / len(messages)
+
+
+def run(args):
+    messages = synthetic_messages(args.turns)
+    VoiceAndSilenceDetectingLexClient.vad_sd_config["LexChunkMs"] = args.chunk_ms
+    print("{0} frames, {1} turns, chunk {2} ms".format(len(messages), args.turns, args.chunk_ms))
+
+    started = time.perf_counter()
+    for message in messages:
+        json.loads(message)["media"]["payload"]
+    json_secs = (time.perf_counter() - started) / len(messages)
+    started = time.perf_counter()
+    for message in messages:
+        media_payload(message)
+    fast_secs = (time.perf_counter() - started) / len(messages)
+    print("payload only: json.loads {0:.2f} us/frame, media_payload {1:.2f} us/frame".format(json_secs * 1e6, fast_secs * 1e6))
+
+    for engine in available_engines():
+        VoiceAndSilenceDetectingLexClient.vad_sd_config["Engine"] = engine
+        for name, client_class, handle_frame in (("before", BeforeLexClient, before_frame),
+                                                 ("after", AfterLexClient, after_frame)):
+            replay(client_class, handle_frame, messages[:500], False)
+            secs = min(replay(client_class, handle_frame, messages, False)[0] for _ in range(args.repeat))
+
+            CountingLexClient.writes = CountingLexClient.body_bytes = CountingLexClient.framing_bytes = 0
+            tracemalloc.start()
+            _, peak_bytes = replay(client_class, handle_frame, messages, True)
+            tracemalloc.stop()
+            print("{0:>8} {1:6s} {2:7.2f} us/frame, peak {3:6.0f} bytes/frame, "
+                  "{4:4.1f} lex writes/turn, {5:5.0f} chunk framing bytes/turn".format(
+                      engine, name, secs * 1e6, peak_bytes, CountingLexClient.writes / float(args.turns),
+                      CountingLexClient.framing_bytes / float(args.turns)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--chunk-ms", type=int, default=100)
+    run(parser.parse_args())
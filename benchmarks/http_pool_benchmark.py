@@ -0,0 +1,84 @@
+"""
+Benchmark of pooled keep-alive Lex connections against a local HTTPS stand-in.
+
+Runs --utterances sequential utterances through LexClientStreaming against a
+FakeLex serving TLS with a throwaway self-signed certificate, once with
+the shared HttpSessionPool and once with a fresh requests.post per utterance
+(the previous behaviour). Reports per-utterance latency from stop() to the
+Lex response, TLS handshakes seen by the server and the pool counters.
+
+Usage:
+    python benchmarks/http_pool_benchmark.py [--utterances 50] [--frames 10]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from fake_services import FakeLex, self_signed_context
+
+FRAME = bytes(320)
+
+
+def run_utterances(client_class, utterances, frames):
+    latencies = []
+    for utterance in range(utterances):
+        client = client_class("pool{0}".format(utterance))
+        for _ in range(frames):
+            client.add_to_stream(FRAME)
+        started = time.perf_counter()
+        client.stop()
+        latencies.append(time.perf_counter() - started)
+        if client.is_crashed():
+            raise RuntimeError("lex client crashed, see log output")
+    return latencies
+
+
+def run(args):
+    context, cert_path = self_signed_context()
+    server = FakeLex(ssl_context=context).start_in_thread()
+    os.environ["LEX_ENDPOINT"] = server.endpoint
+    os.environ["LEX_CA_BUNDLE"] = cert_path
+    os.environ.setdefault("AWS_REGION", "us-east-1")
+    os.environ.setdefault("ACCESS_KEY_ID", "AKIDEXAMPLE")
+    os.environ.setdefault("SECRET_ACCESS_KEY", "secret")
+    os.environ.setdefault("LEX_BOT_NAME", "BenchBot")
+    os.environ.setdefault("LEX_BOT_ALIAS", "bench")
+
+    import requests
+    from http_session_pool import HttpSessionPool
+    from lex_streaming_client import LexClientStreaming
+
+    class UnpooledLexClientStreaming(LexClientStreaming):
+        class OneShotSession:
+            @staticmethod
+            def post(url, **kwargs):
+                return requests.post(url, verify=cert_path, **kwargs)
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.session_pool = self.OneShotSession
+
+    for name, client_class in (("unpooled", UnpooledLexClientStreaming), ("pooled", LexClientStreaming)):
+        connections_before = server.connections
+        latencies = run_utterances(client_class, args.utterances, args.frames)
+        print("{0:>8}: stop() -> response mean {1:.2f} ms, p50 {2:.2f} ms, max {3:.2f} ms, server connections {4}".format(
+            name,
+            statistics.mean(latencies) * 1000,
+            statistics.median(latencies) * 1000,
+            max(latencies) * 1000,
+            server.connections - connections_before))
+
+    print("pool stats: {0}".format(HttpSessionPool.shared().stats()))
+    server.stop_in_thread()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--utterances", type=int, default=50)
+    parser.add_argument("--frames", type=int, default=10)
+    run(parser.parse_args())
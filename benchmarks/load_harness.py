@@ -0,0 +1,493 @@
+"""
+Load harness: replays media streams over WebSockets against a server pointed at local Lex and Twilio stand-ins.
+
+Runs async_server.py (or server.py with --server server.py, with --workers
+worker processes) against FakeLex and FakeTwilio from fake_services.py, and
+opens --calls concurrent simulated calls. Each call streams a fixed sequence
+of media payloads paced at --speed times real time:
+
+    --recordings  recorded calls, one payload per line as read by
+                  vad_replay.read_payloads() (base64 or media messages as the
+                  servers log them); the calls take the recordings in turn.
+    otherwise     --turns synthetic turns: --voice-secs of speech, then
+                  --gap-secs of silence after the end of the utterance, for
+                  the answer.
+
+After the last payload, a call stays silent until every expected answer has
+arrived or --turn-timeout has passed. The expected turns come from replaying
+the same payloads through voice and silence detection offline (vad_replay),
+with the VAD_* settings of the server: the end of an utterance is the frame
+that completed the silence. A turn's latency is from when that frame was sent
+to when the answer arrived: the call update at FakeTwilio, or with
+--playback stream the first media message of the prompt. Speech the caller
+starts while the server is still answering is ignored by the server but not
+by the offline replay, so recordings should leave time to answer.
+
+FakeLex answers after --lex-latency (+- --lex-jitter) with the responses in
+--lex-responses in turn, a JSON list of dicts as returned by
+LexClientStreaming.get_response(), e.g.
+
+    [{"DialogState": "ElicitSlot", "Message": "Which city?", "IntentName": "BookHotel"},
+     {"DialogState": "Fulfilled", "Message": "Bye", "IntentName": "GoodbyeIntent"}]
+
+FakeTwilio takes --twilio-latency per update and fails --twilio-failure-rate
+of them with 503.
+
+Overload: --max-calls, --max-lex-requests and --lex-queue-timeout set the
+server's admission limits (see admission.py). A call turned away (its stream
+closed with 1013) is counted as rejected rather than failed and its turns are
+not expected; the highest load /ping reported and whether it said it was
+shedding are reported as well.
+
+The server's output goes to --server-log. The harness exits with status 1
+when the server died during the run, or when no turn was answered although
+the calls should have had some, whatever the other results are.
+
+Workers: with --workers above 1 the calls each worker took are reported
+from /debug/worker (worker_scaling_benchmark.py runs the harness for several
+worker counts). With --drain-after the server is sent SIGTERM that many
+seconds into the run, as on a deploy: the calls have to finish their turns on
+the draining workers, no new connection may be accepted, and the server has
+to exit once they are done, with status 0, or the harness fails.
+
+Reported: calls and turns per second, turn latency percentiles, answers
+missing after the timeout, and the CPU (also as cores used) and peak RSS of
+the server (all worker processes) per call. CPU time and RSS are read from /proc, so this
+runs on Linux only. With --json the results are written to a file; with
+--baseline they are compared to an earlier --json file and the harness exits
+with status 1 when latency, CPU or RSS per call got worse by more than
+--tolerance (relative), or more calls failed or answers went missing.
+
+Usage:
+    python benchmarks/load_harness.py [--calls 100] [--speed 1] [--turns 3] [--recordings call.txt ...]
+        [--lex-latency 0.2] [--lex-responses responses.json] [--playback redirect|stream] [--workers 1]
+        [--max-calls 50] [--max-lex-requests 20] [--lex-queue-timeout 5] [--drain-after 1]
+        [--json results.json] [--baseline baseline.json] [--tolerance 0.2] [--server-log server.log]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from admission import WS_TRY_AGAIN_LATER
+from bench_stats import percentile
+from fake_services import FakeLex, FakeTwilio, MediaStreamClient, FRAME_SECS, SILENT_FRAME, VOICED_FRAME
+from vad_replay import read_payloads, replay
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+# results compared with --baseline, all worse when higher
+COMPARED = ("LatencyP50Ms", "LatencyP95Ms", "LatencyP99Ms", "CpuMsPerCallSec", "RssMbPerCall")
+# compared without tolerance
+COUNTED = ("FailedCalls", "MissingAnswers", "RejectedCalls")
+
+
+class CallScript:
+    """The payloads of one simulated call and the frames at which the server should detect the end of an utterance"""
+
+    def __init__(self, name, payloads):
+        self.name = name
+        self.payloads = payloads
+        decisions, _ = replay(payloads, user_id=name)
+        self.utterance_ends = [decision["Frame"] for decision in decisions if decision["Event"] == "silence_detected"]
+
+
+def synthetic_script(args):
+    payloads = [SILENT_FRAME] * int(args.lead_secs / FRAME_SECS)
+    for _ in range(args.turns):
+        payloads += [VOICED_FRAME] * int(args.voice_secs / FRAME_SECS)
+        payloads += [SILENT_FRAME] * int((args.silence_secs + args.gap_secs) / FRAME_SECS)
+    return CallScript("synthetic", payloads)
+
+
+def recorded_scripts(paths):
+    scripts = []
+    for path in paths:
+        with open(path) as recording:
+            scripts.append(CallScript(os.path.basename(path), read_payloads(recording)))
+    return scripts
+
+
+# the time each answer arrived at the fakes
+def answer_times(args, twilio, client):
+    if args.playback == "stream":
+        return list(client.prompts_started)
+    return list(twilio.update_times.get(client.call_sid, []))
+
+
+# pairs every answer with the latest utterance end sent before it, returns the latencies and the number of utterances
+# sent that got no answer
+def turn_latencies(script, client, answers):
+    ends = [client.sent_at[frame] for frame in script.utterance_ends if frame < len(client.sent_at)]
+    latencies = []
+    answered = set()
+    for answered_at in sorted(answers):
+        earlier = [index for index, ended_at in enumerate(ends) if ended_at <= answered_at and index not in answered]
+        if earlier:
+            answered.add(earlier[-1])
+            latencies.append(answered_at - ends[earlier[-1]])
+    return latencies, len(ends) - len(answered)
+
+
+async def simulated_call(index, args, script, server_url, twilio, session, results):
+    client = MediaStreamClient(server_url.replace("http", "ws") + "/", "ACfake", "CA{0:032d}".format(index), args.speed)
+    await client.connect(session)
+    try:
+        for payload in script.payloads:
+            await client.send_frame(payload)
+        deadline = time.perf_counter() + args.turn_timeout
+        while time.perf_counter() < deadline and len(answer_times(args, twilio, client)) < len(script.utterance_ends):
+            await client.send_frame(SILENT_FRAME)
+    except ConnectionResetError:
+        # the server ended the call, e.g. after a goodbye intent with --playback stream
+        pass
+    finally:
+        if not client.ws.closed:
+            await client.close()
+    if client.ws.close_code == WS_TRY_AGAIN_LATER:
+        # turned away by admission control, the busy TwiML update is not an answer
+        results["Rejected"] = results["Rejected"] + 1
+        return
+    latencies, missing = turn_latencies(script, client, answer_times(args, twilio, client))
+    results["Latencies"].extend(latencies)
+    results["MissingAnswers"] = results["MissingAnswers"] + missing
+    results["AudioSecs"] = results["AudioSecs"] + len(client.sent_at) * FRAME_SECS
+
+
+def new_results():
+    return {"Latencies": [], "MissingAnswers": 0, "Rejected": 0, "AudioSecs": 0.0}
+
+
+def process_cpu_secs(pid):
+    with open("/proc/{0}/stat".format(pid)) as stat:
+        fields = stat.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def process_rss_mb(pid):
+    with open("/proc/{0}/status".format(pid)) as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024.0
+    return 0.0
+
+
+def child_pids(pid):
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open("/proc/{0}/stat".format(entry)) as stat:
+                fields = stat.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(entry))
+    return children
+
+
+def tree_cpu_secs(pids):
+    total = 0.0
+    for pid in pids:
+        try:
+            total = total + process_cpu_secs(pid)
+        except OSError:
+            pass
+    return total
+
+
+def tree_rss_mb(pids):
+    total = 0.0
+    for pid in pids:
+        try:
+            total = total + process_rss_mb(pid)
+        except OSError:
+            pass
+    return total
+
+
+# poll /ping until the server answers, failing as soon as the server process, when given, exits
+async def wait_until_up(url, server=None, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            if server is not None and server.poll() is not None:
+                raise RuntimeError("server exited with status {0} before it came up".format(server.returncode))
+            try:
+                async with session.get(url + "/ping") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError("server did not come up at {0}".format(url))
+
+
+# the highest load /ping reported while the calls run, and whether the server said it was shedding. a new
+# connection each time, so no idle keep-alive connection holds up a draining server
+async def sample_load(server_url, peak):
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(force_close=True)) as session:
+        while True:
+            try:
+                async with session.get(server_url + "/ping") as response:
+                    ping = await response.json()
+                peak["Load"] = max(peak["Load"], ping.get("Load", 0.0))
+                peak["Shedding"] = peak["Shedding"] or ping.get("Shedding", False)
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.25)
+
+
+# calls handled by each worker. every request is a new connection, so the kernel hands it to any of the workers
+async def calls_per_worker(server_url, attempts):
+    workers = {}
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(force_close=True)) as session:
+        for _ in range(attempts):
+            async with session.get(server_url + "/debug/worker") as response:
+                stats = await response.json()
+            workers[str(stats["Worker"])] = stats["Calls"]
+    return dict(sorted(workers.items()))
+
+
+# SIGTERM once the calls are connected, then check that the listener is closed and the server exits after the calls
+async def drain(args, server, server_url):
+    await asyncio.sleep(args.drain_after)
+    signalled = time.perf_counter()
+    server.send_signal(signal.SIGTERM)
+    await asyncio.sleep(0.5)
+    # on a new connection, the load sampler's keep-alive connections were accepted before SIGTERM
+    try:
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(force_close=True)) as fresh_session:
+            async with fresh_session.get(server_url + "/ping") as response:
+                await response.read()
+        refused = False
+    except aiohttp.ClientError:
+        refused = True
+    while server.poll() is None:
+        await asyncio.sleep(0.1)
+    return {"NewConnectionsRefused": refused,
+            "ExitSecs": round(time.perf_counter() - signalled, 1),
+            "ExitStatus": server.returncode}
+
+
+# the highest RSS of the server processes while the calls run
+async def sample_rss(pids, peak):
+    while True:
+        peak[0] = max(peak[0], tree_rss_mb(pids))
+        await asyncio.sleep(0.25)
+
+
+async def run(args):
+    scripts = recorded_scripts(args.recordings) if args.recordings else [synthetic_script(args)]
+    responses = None
+    if args.lex_responses:
+        with open(args.lex_responses) as responses_file:
+            responses = json.load(responses_file)
+    lex = await FakeLex(latency=args.lex_latency, latency_jitter=args.lex_jitter, responses=responses).start()
+    twilio = await FakeTwilio(latency=args.twilio_latency, failure_rate=args.twilio_failure_rate).start()
+
+    server_url = "http://127.0.0.1:{0}".format(args.port)
+    environment = dict(os.environ,
+                       WORKERS=str(args.workers),
+                       PLAYBACK_MODE=args.playback,
+                       CONTAINER_PORT=str(args.port),
+                       URL=server_url,
+                       LEX_ENDPOINT=lex.endpoint,
+                       TWILIO_API_URL=twilio.endpoint,
+                       TWILIO_AUTH_TOKEN="fake",
+                       AWS_REGION="us-east-1",
+                       ACCESS_KEY_ID="AKIDEXAMPLE",
+                       SECRET_ACCESS_KEY="secret",
+                       LEX_BOT_NAME="BenchBot",
+                       LEX_BOT_ALIAS="bench")
+    if args.max_calls is not None:
+        environment["ADMISSION_MAX_CALLS"] = str(args.max_calls)
+    if args.max_lex_requests is not None:
+        environment["ADMISSION_MAX_LEX_REQUESTS"] = str(args.max_lex_requests)
+    if args.lex_queue_timeout is not None:
+        environment["ADMISSION_LEX_QUEUE_TIMEOUT_SECS"] = str(args.lex_queue_timeout)
+    if args.drain_after is not None:
+        environment["DRAIN_TIMEOUT_SECS"] = str(args.drain_timeout)
+        # a draining server no longer accepts twilio's /updatecall request, behind a load balancer another task gets it
+        environment.setdefault("TWIML_STORE", "inline")
+    server_log = open(args.server_log, "w")
+    server = subprocess.Popen([sys.executable, args.server], cwd=ROOT, env=environment,
+                              stdout=server_log, stderr=subprocess.STDOUT)
+    try:
+        await wait_until_up(server_url, server)
+        pids = [server.pid] + child_pids(server.pid)
+        idle_rss = tree_rss_mb(pids)
+        peak_rss = [idle_rss]
+        results = new_results()
+        peak_load = {"Load": 0.0, "Shedding": False}
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+            sampler = asyncio.ensure_future(sample_rss(pids, peak_rss))
+            load_sampler = asyncio.ensure_future(sample_load(server_url, peak_load))
+            cpu_before = tree_cpu_secs(pids)
+            started = time.perf_counter()
+            draining = None
+            if args.drain_after is not None:
+                draining = asyncio.ensure_future(drain(args, server, server_url))
+            calls = await asyncio.gather(*[simulated_call(index, args, scripts[index % len(scripts)], server_url,
+                                                          twilio, session, results)
+                                           for index in range(args.calls)], return_exceptions=True)
+            wall = time.perf_counter() - started
+            cpu = tree_cpu_secs(pids) - cpu_before
+            sampler.cancel()
+            load_sampler.cancel()
+            drained = await draining if draining is not None else None
+            spread = await calls_per_worker(server_url, 10 * args.workers) if args.workers > 1 and not drained else None
+        # checked before terminating it, any exit status so far means the server died under the calls
+        exit_status = server.poll() if drained is None else None
+    finally:
+        if server.poll() is None:
+            server.terminate()
+        server.wait()
+        server_log.close()
+        await lex.stop()
+        await twilio.stop()
+
+    failures = [call for call in calls if isinstance(call, Exception)]
+    ordered = sorted(results["Latencies"])
+    summary = {
+        "Server": args.server,
+        "Workers": args.workers,
+        "Playback": args.playback,
+        "Calls": args.calls,
+        "Speed": args.speed,
+        "FailedCalls": len(failures),
+        "RejectedCalls": results["Rejected"],
+        "Turns": len(ordered),
+        "MissingAnswers": results["MissingAnswers"],
+        "WallSecs": round(wall, 2),
+        "CallsPerSec": round(args.calls / wall, 2),
+        "TurnsPerSec": round(len(ordered) / wall, 2),
+        "LatencyP50Ms": round(percentile(ordered, 0.5) * 1000, 1),
+        "LatencyP90Ms": round(percentile(ordered, 0.9) * 1000, 1),
+        "LatencyP95Ms": round(percentile(ordered, 0.95) * 1000, 1),
+        "LatencyP99Ms": round(percentile(ordered, 0.99) * 1000, 1),
+        "LatencyMaxMs": round(ordered[-1] * 1000, 1) if ordered else 0.0,
+        "CpuSecs": round(cpu, 2),
+        "CoresUsed": round(cpu / wall, 2),
+        "CpuMsPerCall": round(cpu * 1000 / args.calls, 1),
+        # cpu per second of call audio: what a real-time call costs, whatever --speed was
+        "CpuMsPerCallSec": round(cpu * 1000 / results["AudioSecs"], 3) if results["AudioSecs"] else 0.0,
+        "IdleRssMb": round(idle_rss, 1),
+        "PeakRssMb": round(peak_rss[0], 1),
+        "RssMbPerCall": round((peak_rss[0] - idle_rss) / args.calls, 3),
+        "PeakLoad": peak_load["Load"],
+        "Shedding": peak_load["Shedding"],
+        "LexRequests": lex.requests,
+        "TwilioUpdates": sum(twilio.updates.values())
+    }
+    if spread is not None:
+        summary["CallsPerWorker"] = spread
+    if drained is not None:
+        summary["Drain"] = drained
+    report(summary, failures)
+    print("server log: {0}".format(args.server_log))
+    if exit_status is not None:
+        print("FAILED the server exited with status {0} during the run, see its log".format(exit_status))
+        return 1
+    if drained is not None and (drained["ExitStatus"] != 0 or not drained["NewConnectionsRefused"]):
+        print("FAILED the server did not drain cleanly, see its log")
+        return 1
+    # turns were expected from a call that was not turned away, so none at all means the server never answered,
+    # also when the calls were cut off before their utterances were sent
+    if not ordered and results["Rejected"] < args.calls and any(script.utterance_ends for script in scripts):
+        print("FAILED no turn was answered, see the server log")
+        return 1
+
+    if args.json:
+        with open(args.json, "w") as results_file:
+            json.dump(summary, results_file, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(summary, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        if regressions:
+            return 1
+        print("no regression against {0} (tolerance {1:.0%})".format(args.baseline, args.tolerance))
+    return 0
+
+
+def report(summary, failures):
+    print("{Server} with {Workers} worker(s), playback {Playback}: {Calls} calls at {Speed}x, "
+          "failed calls {FailedCalls}, rejected calls {RejectedCalls}, turns {Turns}, missing answers {MissingAnswers}"
+          .format(**summary))
+    if failures:
+        print("    first failure: {0!r}".format(failures[0]))
+    print("throughput: {CallsPerSec} calls/s, {TurnsPerSec} turns/s over {WallSecs} s".format(**summary))
+    print("end of utterance -> answer: p50 {LatencyP50Ms} ms, p90 {LatencyP90Ms} ms, p95 {LatencyP95Ms} ms, "
+          "p99 {LatencyP99Ms} ms, max {LatencyMaxMs} ms".format(**summary))
+    print("server cpu {CpuSecs} s ({CoresUsed} cores): {CpuMsPerCall} ms/call, {CpuMsPerCallSec} ms per second of call audio".format(**summary))
+    print("server rss idle {IdleRssMb} MB, peak {PeakRssMb} MB: {RssMbPerCall} MB/call".format(**summary))
+    print("peak load on /ping {PeakLoad}, shedding {Shedding}".format(**summary))
+    print("lex requests {LexRequests}, call updates {TwilioUpdates}".format(**summary))
+    if "CallsPerWorker" in summary:
+        print("calls per worker {CallsPerWorker}".format(**summary))
+    if "Drain" in summary:
+        print("drain: new connections refused {NewConnectionsRefused}, server exited {ExitSecs} s after SIGTERM "
+              "with status {ExitStatus}".format(**summary["Drain"]))
+
+
+# the results that got worse than the baseline
+def compare(summary, baseline, tolerance):
+    regressions = []
+    for name in COMPARED:
+        if name in baseline and summary[name] > baseline[name] * (1 + tolerance):
+            regressions.append("{0}: {1} (baseline {2})".format(name, summary[name], baseline[name]))
+    for name in COUNTED:
+        if name in baseline and summary[name] > baseline[name]:
+            regressions.append("{0}: {1} (baseline {2})".format(name, summary[name], baseline[name]))
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", default="async_server.py")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--playback", choices=("redirect", "stream"), default="redirect")
+    parser.add_argument("--calls", type=int, default=100)
+    parser.add_argument("--speed", type=float, default=1.0, help="media pacing relative to real time")
+    parser.add_argument("--recordings", nargs="+", help="recorded calls, replayed instead of synthetic turns")
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--lead-secs", type=float, default=0.5, help="silence before the first synthetic turn")
+    parser.add_argument("--voice-secs", type=float, default=1.0)
+    parser.add_argument("--silence-secs", type=float, default=2.0,
+                        help="silence ending a synthetic utterance, the server's SilenceDurationTimeInSecs")
+    parser.add_argument("--gap-secs", type=float, default=3.0, help="silence after a synthetic utterance for the answer")
+    parser.add_argument("--turn-timeout", type=float, default=15.0)
+    parser.add_argument("--lex-latency", type=float, default=0.2)
+    parser.add_argument("--lex-jitter", type=float, default=0.0)
+    parser.add_argument("--lex-responses", help="JSON list of lex responses, answered in turn")
+    parser.add_argument("--twilio-latency", type=float, default=0.0)
+    parser.add_argument("--twilio-failure-rate", type=float, default=0.0)
+    parser.add_argument("--max-calls", type=int, help="the server's ADMISSION_MAX_CALLS")
+    parser.add_argument("--max-lex-requests", type=int, help="the server's ADMISSION_MAX_LEX_REQUESTS")
+    parser.add_argument("--lex-queue-timeout", type=float, help="the server's ADMISSION_LEX_QUEUE_TIMEOUT_SECS")
+    parser.add_argument("--drain-after", type=float, help="send the server SIGTERM this many seconds into the run")
+    parser.add_argument("--drain-timeout", type=float, default=60.0, help="the server's DRAIN_TIMEOUT_SECS")
+    parser.add_argument("--server-log", default=os.path.join(tempfile.gettempdir(), "load_harness_server.log"),
+                        help="file the server's stdout and stderr go to")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(run(parse_args())))
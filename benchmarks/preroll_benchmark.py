@@ -0,0 +1,124 @@
+"""
+Effect of the VAD pre-roll buffer on what is sent to Lex and on time to the Lex response.
+
+Replays recordings (see vad_replay.py for the format) or, by default, a
+synthetic call whose utterances start with a soft onset below VoiceThreshold,
+once per --pre-roll-ms value. For every setting it reports the audio sent to
+Lex per turn and how much of the soft onset made it in. With --lex it also
+streams every replayed turn through LexClientStreaming to a local
+FakeLex, paced at --speed times real time, and reports the time from the
+first frame to the Lex response and from stop() to the response.
+
+Usage:
+    python benchmarks/preroll_benchmark.py [--pre-roll-ms 0 100 200 300] [--lex] [recording ...]
+"""
+
+import argparse
+import base64
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from vad_engines import ULAW_TABLE
+
+FRAME_SAMPLES = 160
+
+
+# a 20 ms frame with the given rms: a square wave of the mu-law value closest to amplitude
+def frame_with_rms(amplitude):
+    positive = min(range(256), key=lambda ulaw_byte: abs(ULAW_TABLE[ulaw_byte] - amplitude))
+    negative = min(range(256), key=lambda ulaw_byte: abs(ULAW_TABLE[ulaw_byte] + amplitude))
+    return base64.b64encode(bytes([positive, negative]) * (FRAME_SAMPLES // 2)).decode("ascii")
+
+
+# silence, a 200 ms soft onset ramping up below the threshold, 1 s of speech, then 2.2 s of silence, per turn
+def synthetic_call(turns=5):
+    payloads = []
+    soft_onset = [frame_with_rms(amplitude) for amplitude in range(60, 460, 40)]
+    for _ in range(turns):
+        payloads += [frame_with_rms(10)] * 25
+        payloads += soft_onset
+        payloads += [frame_with_rms(3000)] * 50
+        payloads += [frame_with_rms(10)] * 110
+    return payloads, len(soft_onset)
+
+
+def stream_turns(turn_audio, speed):
+    from lex_streaming_client import LexClientStreaming
+
+    first_frame_to_response = []
+    stop_to_response = []
+    for index, chunks in enumerate(turn_audio):
+        client = LexClientStreaming("preroll{0}".format(index))
+        started = time.perf_counter()
+        # chunks are written as their audio arrives, the first one carries the pre-roll with the first voiced frame
+        for position, chunk in enumerate(chunks):
+            client.add_to_stream(chunk)
+            time.sleep((0.02 if position == 0 else len(chunk) / (FRAME_SAMPLES * 2) * 0.02) / speed)
+        stopped = time.perf_counter()
+        client.stop()
+        finished = time.perf_counter()
+        if client.is_crashed():
+            raise RuntimeError("lex client crashed, see log output")
+        first_frame_to_response.append(finished - started)
+        stop_to_response.append(finished - stopped)
+    return first_frame_to_response, stop_to_response
+
+
+def run(args):
+    if args.recordings:
+        from vad_replay import read_payloads
+        payloads = []
+        for path in args.recordings:
+            with open(path) as recording:
+                payloads += read_payloads(recording)
+        soft_onset_frames = None
+    else:
+        payloads, soft_onset_frames = synthetic_call(args.turns)
+
+    if args.lex:
+        from fake_services import FakeLex
+        server = FakeLex(latency=args.lex_latency).start_in_thread()
+        os.environ["LEX_ENDPOINT"] = server.endpoint
+        os.environ.setdefault("AWS_REGION", "us-east-1")
+        os.environ.setdefault("ACCESS_KEY_ID", "AKIDEXAMPLE")
+        os.environ.setdefault("SECRET_ACCESS_KEY", "secret")
+        os.environ.setdefault("LEX_BOT_NAME", "BenchBot")
+        os.environ.setdefault("LEX_BOT_ALIAS", "bench")
+
+    from voice_and_silence_detecting_lex_wrapper import VoiceAndSilenceDetectingLexClient
+    from vad_replay import replay
+
+    for pre_roll_ms in args.pre_roll_ms:
+        VoiceAndSilenceDetectingLexClient.vad_sd_config["PreRollMs"] = pre_roll_ms
+        decisions, turn_audio = replay(payloads)
+        sizes = [sum(len(chunk) for chunk in chunks) for chunks in turn_audio]
+        line = "pre-roll {0:4d} ms: {1} turns, mean {2:,.0f} bytes/turn, first write {3:,} bytes".format(
+            pre_roll_ms, len(sizes), statistics.mean(sizes) if sizes else 0,
+            len(turn_audio[0][0]) if turn_audio else 0)
+        if soft_onset_frames:
+            pre_roll_frames = len(turn_audio[0][0]) // (FRAME_SAMPLES * 2) - 1 if turn_audio else 0
+            line = line + ", soft onset kept {0}/{1} frames".format(min(pre_roll_frames, soft_onset_frames), soft_onset_frames)
+        print(line)
+
+        if args.lex:
+            first_frame_to_response, stop_to_response = stream_turns(turn_audio, args.speed)
+            print("    first frame -> response mean {0:.1f} ms, stop() -> response mean {1:.2f} ms".format(
+                statistics.mean(first_frame_to_response) * 1000, statistics.mean(stop_to_response) * 1000))
+
+    if args.lex:
+        server.stop_in_thread()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recordings", nargs="*")
+    parser.add_argument("--pre-roll-ms", type=int, nargs="+", default=[0, 100, 200, 300])
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--lex", action="store_true", help="also stream the turns to a local fake Lex")
+    parser.add_argument("--lex-latency", type=float, default=0.0)
+    parser.add_argument("--speed", type=float, default=10.0)
+    run(parser.parse_args())
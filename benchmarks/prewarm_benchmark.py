@@ -0,0 +1,78 @@
+"""
+Per-turn time-to-first-byte with and without a pre-warmed Lex stream.
+
+Simulates --turns conversational turns against a local HTTPS FakeLex.
+Each turn creates a new LexClientStreaming (as TwilioDataProcessor.reset()
+does), waits --playback-secs for the prompt to play back, then streams
+--frames 20 ms frames and stops. With pre-warm the client is prepared at the
+start of the playback gap. Reported timings come from
+LexClientStreaming.get_timings(). A connection opened at the start of the
+playback gap is evicted if the gap outlasts LEX_POOL_IDLE_TIMEOUT_SECS, so keep
+the idle timeout above the longest prompt.
+
+Usage:
+    python benchmarks/prewarm_benchmark.py [--turns 20] [--playback-secs 0.5] [--frames 25]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from fake_services import FakeLex, self_signed_context
+
+FRAME = bytes(320)
+
+
+def summarize(values):
+    values = [value for value in values if value is not None]
+    return "mean {0:7.3f} ms  p50 {1:7.3f} ms  max {2:7.3f} ms".format(
+        statistics.mean(values), statistics.median(values), max(values))
+
+
+def run(args):
+    context, cert_path = self_signed_context()
+    server = FakeLex(ssl_context=context).start_in_thread()
+    os.environ["LEX_ENDPOINT"] = server.endpoint
+    os.environ["LEX_CA_BUNDLE"] = cert_path
+    os.environ.setdefault("AWS_REGION", "us-east-1")
+    os.environ.setdefault("ACCESS_KEY_ID", "AKIDEXAMPLE")
+    os.environ.setdefault("SECRET_ACCESS_KEY", "secret")
+    os.environ.setdefault("LEX_BOT_NAME", "BenchBot")
+    os.environ.setdefault("LEX_BOT_ALIAS", "bench")
+
+    from lex_streaming_client import LexClientStreaming
+
+    for prewarm in (False, True):
+        timings = []
+        for turn in range(args.turns):
+            client = LexClientStreaming("turn{0}".format(turn))
+            if prewarm:
+                client.prewarm()
+            time.sleep(args.playback_secs)
+            for _ in range(args.frames):
+                client.add_to_stream(FRAME)
+                time.sleep(args.frame_interval)
+            client.stop()
+            if client.is_crashed():
+                raise RuntimeError("lex client crashed, see log output")
+            timings.append(client.get_timings())
+
+        print("prewarm {0}".format("on" if prewarm else "off"))
+        print("  time to first byte:      " + summarize([timing["TimeToFirstByteMs"] for timing in timings]))
+        print("  first frame to request:  " + summarize([timing["FirstFrameToRequestMs"] for timing in timings]))
+        print("  stop to response:        " + summarize([timing["StopToResponseMs"] for timing in timings]))
+
+    server.stop_in_thread()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--playback-secs", type=float, default=0.5)
+    parser.add_argument("--frames", type=int, default=25)
+    parser.add_argument("--frame-interval", type=float, default=0.02)
+    run(parser.parse_args())
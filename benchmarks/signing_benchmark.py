@@ -0,0 +1,86 @@
+"""
+Benchmark of SigV4 signing cost per Lex request.
+
+Signs one request per simulated utterance for --users distinct Lex users, spread
+over --threads concurrent threads, and reports the mean cost per signed
+request. The legacy path re-derives the signing key and rebuilds the canonical
+request from scratch on every call, the way LexClientStreaming did before
+sigv4_signer; the cached path uses the shared SigV4Signer and RequestTemplate.
+
+Usage:
+    python benchmarks/signing_benchmark.py [--users 5000] [--threads 64] [--rounds 3]
+"""
+
+import argparse
+import datetime
+import hashlib
+import hmac
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from sigv4_signer import SigV4Signer, request_template
+
+ACCESS_KEY = "AKIDEXAMPLE"
+SECRET_KEY = "wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY"
+REGION = "us-east-1"
+SERVICE = "lex"
+HOST = "runtime.lex.{0}.amazonaws.com".format(REGION)
+CONTENT_TYPE = 'audio/lpcm; sample-rate=8000; sample-size-bits=16; channel-count=1; is-big-endian=false'
+
+
+def legacy_sign(user_id):
+    def sign(key, msg):
+        return hmac.new(key, msg.encode('utf-8'), hashlib.sha256).digest()
+
+    t = datetime.datetime.utcnow()
+    amz_date = t.strftime('%Y%m%dT%H%M%SZ')
+    date_stamp = t.strftime('%Y%m%d')
+    canonical_uri = "/bot/{0}/alias/{1}/user/{2}/{3}".format("BenchBot", "bench", user_id, "content")
+    canonical_headers = 'content-type:' + CONTENT_TYPE + '\n' + 'host:' + HOST + '\n' + 'x-amz-date:' + amz_date + '\n'
+    signed_headers = 'content-type;host;x-amz-date'
+    canonical_request = "POST" + '\n' + canonical_uri + '\n' + "" + '\n' + canonical_headers + '\n' + signed_headers + '\n' + "UNSIGNED-PAYLOAD"
+    credential_scope = date_stamp + '/' + REGION + '/' + SERVICE + '/' + 'aws4_request'
+    string_to_sign = 'AWS4-HMAC-SHA256' + '\n' + amz_date + '\n' + credential_scope + '\n' + hashlib.sha256(
+        canonical_request.encode('utf-8')).hexdigest()
+    k_signing = sign(sign(sign(sign(('AWS4' + SECRET_KEY).encode('utf-8'), date_stamp), REGION), SERVICE), 'aws4_request')
+    signature = hmac.new(k_signing, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+    return 'AWS4-HMAC-SHA256 Credential=' + ACCESS_KEY + '/' + credential_scope + ', SignedHeaders=' \
+           + signed_headers + ', Signature=' + signature
+
+
+def cached_sign(user_id):
+    canonical_uri = "/bot/{0}/alias/{1}/user/{2}/content".format("BenchBot", "bench", user_id)
+    template = request_template(HOST, canonical_uri, CONTENT_TYPE, REGION, SERVICE)
+    return template.sign(SigV4Signer.shared(ACCESS_KEY, SECRET_KEY))['Authorization']
+
+
+def measure(sign_function, users, threads, rounds):
+    user_ids = ["lex_USER{0:08d}".format(index) for index in range(users)]
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        # warm up thread pool (and, for the cached path, templates for the first round)
+        list(executor.map(sign_function, user_ids[:threads]))
+        started = time.perf_counter()
+        for _ in range(rounds):
+            list(executor.map(sign_function, user_ids, chunksize=max(1, users // threads)))
+        elapsed = time.perf_counter() - started
+    return elapsed / (users * rounds)
+
+
+def run(args):
+    for name, sign_function in (("legacy", legacy_sign), ("cached", cached_sign)):
+        per_request = measure(sign_function, args.users, args.threads, args.rounds)
+        print("{0:>6}: {1:8.2f} us/request ({2} concurrent utterances, {3} threads)".format(
+            name, per_request * 1e6, args.users, args.threads))
+    print("signing key derivations on shared signer: {0}".format(SigV4Signer.shared(ACCESS_KEY, SECRET_KEY).derivations))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=64)
+    parser.add_argument("--rounds", type=int, default=3)
+    run(parser.parse_args())
@@ -0,0 +1,169 @@
+"""
+Start up time: importing the server, time to live, time to ready and the first call.
+
+Imports:
+    Imports --server's module in a fresh interpreter --repeat times and
+    reports the median, then the modules that are only imported on first use
+    (twilio.rest, the TwiML builders and the pooled Twilio http client, see
+    twilio_call.py, and numpy, see vad_engines.py) on top of it, which start
+    up used to pay for as well. A deferred module the server import pulls in
+    anyway is reported, as its time is then part of the server import. The
+    slowest imports are listed from python -X importtime with --top.
+
+Time to ready:
+    Starts the server against FakeLex and FakeTwilio with WARM_UP=false and
+    with WARM_UP=true, polls /ping and /ready every few milliseconds and
+    reports the time from spawning the process until each answers 200, the
+    warm-up steps from /ready and the end of utterance to call update latency
+    of the first call taken right after /ready, whose turn pays for whatever was
+    not warmed up. Fake services are local and plain HTTP, so the connection
+    set up saved here is a loopback connect; against Lex and Twilio it is a
+    TLS handshake over the network.
+
+Usage:
+    python benchmarks/startup_benchmark.py [--server async_server.py] [--repeat 5] [--top 10]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+import aiohttp
+
+from load_harness import new_results, simulated_call, synthetic_script
+from fake_services import FakeLex, FakeTwilio
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+DEFERRED_MODULES = ("twilio.rest", "twilio.twiml.voice_response", "twilio_http", "numpy")
+
+# placeholders so the server modules can be imported, they read their configuration at import time
+IMPORT_ENVIRONMENT = {"CONTAINER_PORT": "8080", "URL": "http://localhost:8080", "AWS_REGION": "us-east-1"}
+
+# one turn: a second of speech, then silence until the answer
+FIRST_CALL = synthetic_script(SimpleNamespace(lead_secs=0.5, turns=1, voice_secs=1.0, silence_secs=2.0, gap_secs=1.0))
+
+IMPORT_TIMER = """
+import sys, time
+started = time.perf_counter()
+import {0}
+imported = time.perf_counter()
+already_imported = [name for name in {1!r} if name in sys.modules]
+for name in {1!r}:
+    __import__(name)
+print(imported - started, time.perf_counter() - imported, ",".join(already_imported) or "-")
+"""
+
+
+def import_times(args):
+    module = os.path.splitext(os.path.basename(args.server))[0]
+    environment = dict(os.environ, **IMPORT_ENVIRONMENT)
+    server_secs = []
+    deferred_secs = []
+    for _ in range(args.repeat):
+        output = subprocess.check_output([sys.executable, "-c", IMPORT_TIMER.format(module, DEFERRED_MODULES)],
+                                         cwd=ROOT, env=environment, universal_newlines=True)
+        server, deferred, already_imported = output.split()
+        server_secs.append(float(server))
+        deferred_secs.append(float(deferred))
+    print("import {0}: {1:.1f} ms, deferred until first use: {2:.1f} ms ({3})".format(
+        module, statistics.median(server_secs) * 1000, statistics.median(deferred_secs) * 1000,
+        ", ".join(DEFERRED_MODULES)))
+    if already_imported != "-":
+        print("    imported by {0} although deferred: {1}".format(module, already_imported.replace(",", ", ")))
+
+    if args.top:
+        # -X importtime lines are "import time: self [us] | cumulative | imported package"
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                                cwd=ROOT, env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                universal_newlines=True, check=True)
+        rows = []
+        for line in result.stderr.splitlines():
+            fields = line.split("|")
+            if len(fields) == 3 and fields[1].strip().isdigit():
+                rows.append((int(fields[1]), fields[2].strip()))
+        print("slowest imports (cumulative):")
+        for cumulative, name in sorted(rows, reverse=True)[:args.top]:
+            print("    {0:8.1f} ms  {1}".format(cumulative / 1000.0, name))
+
+
+async def poll(session, url):
+    try:
+        async with session.get(url) as response:
+            return response.status, (await response.json() if response.status in (200, 503) else None)
+    except aiohttp.ClientError:
+        return None, None
+
+
+async def time_to_ready(args, warm_up, lex, twilio):
+    server_url = "http://127.0.0.1:{0}".format(args.port)
+    environment = dict(os.environ,
+                       WARM_UP=str(warm_up).lower(),
+                       CONTAINER_PORT=str(args.port),
+                       URL=server_url,
+                       LEX_ENDPOINT=lex.endpoint,
+                       TWILIO_API_URL=twilio.endpoint,
+                       TWILIO_AUTH_TOKEN="fake",
+                       AWS_REGION="us-east-1",
+                       ACCESS_KEY_ID="AKIDEXAMPLE",
+                       SECRET_ACCESS_KEY="secret",
+                       LEX_BOT_NAME="BenchBot",
+                       LEX_BOT_ALIAS="bench")
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, args.server], cwd=ROOT, env=environment,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    live_secs = ready_secs = None
+    readiness = None
+    results = new_results()
+    try:
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+            while ready_secs is None:
+                if time.perf_counter() - started > args.timeout:
+                    raise RuntimeError("server was not ready within {0} s".format(args.timeout))
+                if live_secs is None and (await poll(session, server_url + "/ping"))[0] == 200:
+                    live_secs = time.perf_counter() - started
+                if live_secs is not None:
+                    status, readiness = await poll(session, server_url + "/ready")
+                    if status == 200:
+                        ready_secs = time.perf_counter() - started
+                        break
+                await asyncio.sleep(args.poll_interval)
+            call_args = SimpleNamespace(speed=1.0, playback="redirect", turn_timeout=args.timeout)
+            await simulated_call(0, call_args, FIRST_CALL, server_url, twilio, session, results)
+    finally:
+        server.terminate()
+        server.wait()
+
+    print("WARM_UP={0}: live after {1:.0f} ms, ready after {2:.0f} ms, warm-up steps {3} ms{4}, "
+          "first call end of utterance -> update {5:.1f} ms".format(
+              str(warm_up).lower(), live_secs * 1000, ready_secs * 1000, readiness["StepsMs"],
+              ", errors {0}".format(readiness["Errors"]) if readiness["Errors"] else "", results["Latencies"][0] * 1000))
+
+
+async def run(args):
+    import_times(args)
+    lex = await FakeLex(latency=args.lex_latency).start()
+    twilio = await FakeTwilio().start()
+    try:
+        for warm_up in (False, True):
+            await time_to_ready(args, warm_up, lex, twilio)
+    finally:
+        await lex.stop()
+        await twilio.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", default="async_server.py")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters to time the imports in")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list, 0 for none")
+    parser.add_argument("--lex-latency", type=float, default=0.2)
+    parser.add_argument("--poll-interval", type=float, default=0.005)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    asyncio.run(run(parser.parse_args()))
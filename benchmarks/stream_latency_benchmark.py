@@ -0,0 +1,126 @@
+"""
+Micro-benchmark for the gap between LexClientStreaming.add_to_stream() and the
+bytes reaching the PostContent request body.
+
+Every frame carries its sequence number in its first four bytes. A local
+FakeLex timestamps every piece of the body it reads off the wire, so the per-frame
+gap is arrival time minus the time add_to_stream() was called. The time spent
+in stop() (final flush plus Lex response) is reported as end-of-utterance
+latency. --legacy runs the same load against the previous 100 ms polling
+iterator for comparison.
+
+Usage:
+    python benchmarks/stream_latency_benchmark.py [--utterances 20] [--frames 100] [--legacy]
+"""
+
+import argparse
+import os
+import statistics
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from bench_stats import percentile
+from fake_services import FakeLex
+
+FRAME_BYTES = 320
+FRAME_INTERVAL_SECS = 0.02
+
+
+def make_legacy_client_class(base):
+    # the pre-StreamBuffer behaviour: append to a list, poll it every 100 ms
+    class PollingLexClientStreaming(base):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.frames = []
+            self.frame_index = 0
+
+        def add_to_stream(self, data):
+            if self.request_thread is None:
+                self.request_thread = threading.Thread(target=self.run)
+                self.request_thread.start()
+            if self.close_stream is False:
+                self.frames.append(data)
+
+        # the request used to be sent as soon as the thread started, polling for the first frame like the rest
+        def wait_for_data(self):
+            return True
+
+        def stream_iterator(self):
+            while not self.close_stream:
+                if self.frame_index < len(self.frames):
+                    yield self.frames[self.frame_index]
+                    self.frame_index = self.frame_index + 1
+                else:
+                    time.sleep(0.1)
+            while self.frame_index < len(self.frames):
+                yield self.frames[self.frame_index]
+                self.frame_index = self.frame_index + 1
+
+    return PollingLexClientStreaming
+
+
+def run(args):
+    server = FakeLex().start_in_thread()
+    os.environ["LEX_ENDPOINT"] = server.endpoint
+    os.environ.setdefault("AWS_REGION", "us-east-1")
+    os.environ.setdefault("ACCESS_KEY_ID", "AKIDEXAMPLE")
+    os.environ.setdefault("SECRET_ACCESS_KEY", "secret")
+    os.environ.setdefault("LEX_BOT_NAME", "BenchBot")
+    os.environ.setdefault("LEX_BOT_ALIAS", "bench")
+
+    from lex_streaming_client import LexClientStreaming
+    client_class = make_legacy_client_class(LexClientStreaming) if args.legacy else LexClientStreaming
+
+    frame_gaps = []
+    end_of_utterance = []
+    for utterance in range(args.utterances):
+        client = client_class("bench{0}".format(utterance))
+        requests_before = len(server.received)
+        sent_at = []
+        for index in range(args.frames):
+            sent_at.append(time.perf_counter())
+            client.add_to_stream(struct.pack(">I", index) + bytes(FRAME_BYTES - 4))
+            time.sleep(args.interval)
+        stop_started = time.perf_counter()
+        client.stop()
+        end_of_utterance.append(time.perf_counter() - stop_started)
+
+        if client.is_crashed() or len(server.received) == requests_before:
+            server.stop_in_thread()
+            sys.exit("utterance {0}: the lex stand-in received no request".format(utterance))
+
+        # a piece read off the wire may carry several frames or part of one, a frame arrived with its last byte
+        body = b""
+        for arrived_at, data in server.received[-1]["chunks"]:
+            body = body + data
+            while len(body) >= FRAME_BYTES:
+                index = struct.unpack(">I", body[:4])[0]
+                frame_gaps.append(arrived_at - sent_at[index])
+                body = body[FRAME_BYTES:]
+
+    server.stop_in_thread()
+
+    mode = "legacy polling" if args.legacy else "stream buffer"
+    print("mode: {0}, utterances: {1}, frames/utterance: {2}".format(mode, args.utterances, args.frames))
+    print("add_to_stream -> request body (ms): mean {0:.3f} p50 {1:.3f} p99 {2:.3f} max {3:.3f}".format(
+        statistics.mean(frame_gaps) * 1000,
+        percentile(frame_gaps, 0.5) * 1000,
+        percentile(frame_gaps, 0.99) * 1000,
+        max(frame_gaps) * 1000))
+    print("stop() -> response (ms): mean {0:.3f} p50 {1:.3f} max {2:.3f}".format(
+        statistics.mean(end_of_utterance) * 1000,
+        percentile(end_of_utterance, 0.5) * 1000,
+        max(end_of_utterance) * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--utterances", type=int, default=20)
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--interval", type=float, default=FRAME_INTERVAL_SECS)
+    parser.add_argument("--legacy", action="store_true", help="benchmark the previous 100 ms polling iterator")
+    run(parser.parse_args())
@@ -0,0 +1,134 @@
+"""
+Time to first audio per turn: Lex audio streamed over the media stream vs. TwiML <Say> redirects.
+
+Runs async_server.py (or server.py with --server server.py) against FakeLex and
+FakeTwilio, once per mode:
+
+    redirect - PLAYBACK_MODE=redirect: the answer is stored as <Say> TwiML, the
+               call is updated through the (fake) Twilio REST API and Twilio
+               fetches the TwiML from /updatecall. First audio is when the
+               TwiML has been fetched, plus --twilio-tts-secs for Twilio to
+               synthesize the <Say>. The fake Twilio API answers after
+               --twilio-latency; both are 0 by default, so the redirect path
+               is measured at its best case.
+    stream   - PLAYBACK_MODE=stream: Lex is asked for audio, FakeLex streams
+               --prompt-secs of PCM at --synthesis-speed times real time and
+               the server forwards it as 20 ms mu-law frames as it arrives.
+               First audio is when the first media message reaches the caller.
+
+Every call speaks for --voice-secs per turn. Reported times are from the end
+of the caller's speech, minus the VAD silence duration (2 s by default), i.e.
+from the moment the end of the utterance is detected.
+
+Usage:
+    python benchmarks/time_to_first_audio_benchmark.py [--calls 10] [--turns 3] [--lex-latency 0.2]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+from load_harness import wait_until_up
+from fake_services import FakeLex, FakeTwilio, MediaStreamClient, SILENT_FRAME, VOICED_FRAME
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+
+async def simulated_call(index, args, mode, server_url, twilio, session, first_audio):
+    client = MediaStreamClient(server_url.replace("http", "ws") + "/", "ACfake", "CA{0:032d}".format(index))
+    await client.connect(session)
+    for _ in range(args.turns):
+        update = twilio.wait_for_update(client.call_sid)
+        prompts = len(client.prompts_started)
+        for _ in range(int(args.voice_secs / 0.02)):
+            await client.send_frame(VOICED_FRAME)
+        speech_ended_at = time.perf_counter()
+
+        deadline = speech_ended_at + args.turn_timeout
+        while not (update.done() if mode == "redirect" else len(client.prompts_started) > prompts):
+            await client.send_frame(SILENT_FRAME)
+            if time.perf_counter() > deadline:
+                raise RuntimeError("call {0} got no answer within {1} s".format(client.call_sid, args.turn_timeout))
+        if mode == "redirect":
+            first_audio.append(twilio.twiml_fetched[client.call_sid] + args.twilio_tts_secs - speech_ended_at)
+        else:
+            first_audio.append(client.prompts_started[-1] - speech_ended_at)
+            # listen to the whole prompt rather than barge in
+            while client.is_playing():
+                await client.send_frame(SILENT_FRAME)
+    await client.close()
+
+
+async def run_mode(args, mode):
+    lex = await FakeLex(latency=args.lex_latency, audio_secs=args.prompt_secs,
+                        synthesis_speed=args.synthesis_speed).start()
+    twilio = await FakeTwilio(latency=args.twilio_latency).start()
+    server_url = "http://127.0.0.1:{0}".format(args.port)
+    environment = dict(os.environ,
+                       CONTAINER_PORT=str(args.port),
+                       URL=server_url,
+                       PLAYBACK_MODE=mode,
+                       LEX_ENDPOINT=lex.endpoint,
+                       TWILIO_API_URL=twilio.endpoint,
+                       TWILIO_AUTH_TOKEN="fake",
+                       AWS_REGION="us-east-1",
+                       ACCESS_KEY_ID="AKIDEXAMPLE",
+                       SECRET_ACCESS_KEY="secret",
+                       LEX_BOT_NAME="BenchBot",
+                       LEX_BOT_ALIAS="bench")
+    server = subprocess.Popen([sys.executable, args.server], cwd=ROOT, env=environment,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        await wait_until_up(server_url, server)
+        first_audio = []
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+            results = await asyncio.gather(*[simulated_call(index, args, mode, server_url, twilio, session, first_audio)
+                                             for index in range(args.calls)], return_exceptions=True)
+            await asyncio.sleep(0.5)
+            async with session.get(server_url + "/debug/playback") as response:
+                playback = await response.json()
+
+        failures = [result for result in results if isinstance(result, Exception)]
+        after_endpoint = sorted(value - args.silence_secs for value in first_audio)
+        print("{0:8s} end of utterance -> first audio p50 {1:.0f} ms, p95 {2:.0f} ms, max {3:.0f} ms over {4} turns, "
+              "failed calls {5}".format(mode, statistics.median(after_endpoint) * 1000,
+                                        after_endpoint[int(0.95 * (len(after_endpoint) - 1))] * 1000,
+                                        after_endpoint[-1] * 1000, len(after_endpoint), len(failures)))
+        if failures:
+            print("         first failure: {0!r}".format(failures[0]))
+        print("         lex requests {0}, twilio call updates {1}, server lex response -> first frame {2} ms".format(
+            lex.requests, sum(twilio.updates.values()), playback["MeanTimeToFirstAudioMs"]))
+    finally:
+        server.terminate()
+        server.wait()
+        await lex.stop()
+        await twilio.stop()
+
+
+async def run(args):
+    for mode in args.modes:
+        await run_mode(args, mode)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", default="async_server.py")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--calls", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--voice-secs", type=float, default=1.0)
+    parser.add_argument("--silence-secs", type=float, default=2.0, help="the server's VAD silence duration")
+    parser.add_argument("--prompt-secs", type=float, default=3.0)
+    parser.add_argument("--synthesis-speed", type=float, default=5.0, help="fake lex audio production vs real time")
+    parser.add_argument("--lex-latency", type=float, default=0.2)
+    parser.add_argument("--twilio-latency", type=float, default=0.0, help="fake twilio rest api response time")
+    parser.add_argument("--twilio-tts-secs", type=float, default=0.0)
+    parser.add_argument("--turn-timeout", type=float, default=15.0)
+    parser.add_argument("--modes", nargs="+", default=["redirect", "stream"], choices=["redirect", "stream"])
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,102 @@
+"""
+Latency and hit rate of the TwiML stores, and whether /updatecall works across tasks.
+
+For every backend (memory, redis against a local FakeRedisServer, or a real
+Redis with --redis-url, and inline) it runs --calls turns. Each turn's TwiML is
+put by one task and popped by another, picked at random out of --tasks store
+instances, as when Twilio's /updatecall callback is load balanced to any
+task. A --late fraction of the pops happens after the TTL, and a --lost
+fraction of the puts is never popped. Reports put/pop latency percentiles
+and the stats() of the store that served the pops.
+
+Usage:
+    python benchmarks/twiml_store_benchmark.py [--calls 2000] [--tasks 2] [--redis-latency-ms 0.5]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from bench_stats import percentile
+from twiml_store import InMemoryTwimlStore, InlineTwimlStore, RedisTwimlStore
+
+TWIML = '<?xml version="1.0" encoding="UTF-8"?><Response><Say>{0}</Say><Pause length="40"/></Response>'
+
+
+def run_backend(name, stores, args):
+    random.seed(1)
+    put_latency = []
+    pop_latency = []
+    served = 0
+    expected = 0
+    for index in range(args.calls):
+        call_sid = "CA{0:032x}".format(index)
+        twiml = TWIML.format("turn {0}".format(index))
+        started = time.perf_counter()
+        random.choice(stores).put(call_sid, twiml)
+        put_latency.append(time.perf_counter() - started)
+        if random.random() < args.lost:
+            continue
+        expected = expected + 1
+        if random.random() < args.late:
+            # popped after the ttl: only happens once the stores' clocks have moved past it
+            for store in stores:
+                store.ttl_secs = 0
+            random.choice(stores).put(call_sid, twiml)
+            time.sleep(0.002)
+            for store in stores:
+                store.ttl_secs = args.ttl
+        started = time.perf_counter()
+        twiml_served = random.choice(stores).pop(call_sid)
+        pop_latency.append(time.perf_counter() - started)
+        if twiml_served is not None:
+            served = served + 1
+
+    print("{0:7s} put p50 {1:.3f} ms p99 {2:.3f} ms, pop p50 {3:.3f} ms p99 {4:.3f} ms, served {5}/{6} callbacks".format(
+        name, percentile(put_latency, 0.5) * 1000, percentile(put_latency, 0.99) * 1000,
+        percentile(pop_latency, 0.5) * 1000, percentile(pop_latency, 0.99) * 1000, served, expected))
+    totals = {}
+    for store in stores:
+        for key, value in store.stats().items():
+            if isinstance(value, int):
+                totals[key] = totals.get(key, 0) + value
+    pops = totals["Hits"] + totals["Misses"]
+    print("        stats over {0} task(s): {1}, hit rate {2:.3f}, mean put {3:.3f} ms, mean pop {4:.3f} ms".format(
+        len(stores), totals, totals["Hits"] / float(pops) if pops else 0.0,
+        statistics.mean(put_latency) * 1000, statistics.mean(pop_latency) * 1000))
+
+
+def run(args):
+    run_backend("memory", [InMemoryTwimlStore(args.ttl, args.max_entries) for _ in range(args.tasks)], args)
+
+    server = None
+    redis_url = args.redis_url
+    if redis_url is None:
+        from fake_redis import FakeRedisServer
+        server = FakeRedisServer(latency=args.redis_latency_ms / 1000.0).start()
+        redis_url = server.url
+    run_backend("redis", [RedisTwimlStore(args.ttl, redis_url) for _ in range(args.tasks)], args)
+    if server is not None:
+        server.stop()
+
+    # inline sends the twiml with the call update: there is no callback and nothing to serve
+    inline = InlineTwimlStore(args.ttl)
+    print("inline  no /updatecall callback, no store round trip; stats {0}".format(inline.stats()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--tasks", type=int, default=2)
+    parser.add_argument("--ttl", type=float, default=300)
+    parser.add_argument("--max-entries", type=int, default=10000)
+    parser.add_argument("--late", type=float, default=0.01, help="fraction of callbacks arriving after the ttl")
+    parser.add_argument("--lost", type=float, default=0.01, help="fraction of turns whose callback never arrives")
+    parser.add_argument("--redis-url", default=None, help="use this redis instead of a local FakeRedisServer")
+    parser.add_argument("--redis-latency-ms", type=float, default=0.0)
+    run(parser.parse_args())
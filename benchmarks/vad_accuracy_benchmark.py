@@ -0,0 +1,292 @@
+"""
+Accuracy and CPU of voice and silence detection with fixed and adaptive thresholds on a labeled corpus.
+
+Every call of the corpus is replayed as the servers would run it (a new
+VoiceAndSilenceDetectingLexClient per turn, see vad_replay), once with the
+fixed VoiceThreshold and SilenceThreshold and once with a per-call NoiseFloor
+(noise_floor.py). Each labeled stretch of speech is scored:
+
+    detected     - voice detected between 100 ms before it starts and its end
+    late start   - detected more than PreRollMs after it started, so even with
+                   the pre-roll Lex misses the start of it
+    cut off      - the end of the utterance was declared before the speech ended
+    never ended  - no end of utterance before the next speech or the end of the
+                   call: on a real call Lex gets audio until it times out
+    end delay    - time from the end of the speech to the end of the utterance,
+                   minus SilenceDurationTimeInSecs (0 is ideal)
+
+plus false starts (voice detected where nobody speaks) and the precision and
+recall of the voiced/silent decision per frame. CPU time per frame covers
+base64 decoding, the VAD engine, the noise floor and end pointing.
+
+Without --corpus the corpus is synthetic: --calls calls for each line
+condition below, each with --turns utterances of syllable-like harmonic
+bursts over low-pass noise, separated by long enough silences.
+
+    quiet         - soft talker on a quiet line, speech below the fixed threshold
+    normal        - clear speech, moderate line noise
+    noisy         - line noise louder than the fixed threshold
+    speakerphone  - loud noise whose level drifts, distant speech
+
+--write-corpus saves it in the --corpus format: for every call NAME.txt with
+one base64 payload per line (as read by vad_replay.read_payloads(), so
+recorded calls work too) and NAME.json with the labels:
+
+    {"Condition": "noisy", "Speech": [[1.0, 2.3], [5.9, 7.4]], "VoicedFrames": "....^^^^.^^^..."}
+
+where Speech holds the start and end of each utterance in seconds and the
+optional VoicedFrames marks the frames that carry speech.
+
+Usage:
+    python benchmarks/vad_accuracy_benchmark.py [--calls 5] [--turns 3] [--corpus DIR] [--write-corpus DIR]
+"""
+
+import argparse
+import array
+import base64
+import glob
+import json
+import math
+import os
+import random
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore", DeprecationWarning)
+    from vad_engines import audioop
+
+from bench_stats import percentile
+from noise_floor import NoiseFloor
+from playback import ULAW_ENCODE_TABLE
+from vad_replay import ReplayRecorder, ReplayVoiceAndSilenceDetectingLexClient, read_payloads
+from voice_and_silence_detecting_lex_wrapper import VoiceAndSilenceDetectingLexClient
+
+RATE = 8000
+FRAME_SAMPLES = 160
+FRAME_SECS = 0.02
+
+# name, noise rms, speech rms, noise level drift
+CONDITIONS = (
+    ("quiet", 8, 350, 0.0),
+    ("normal", 60, 2500, 0.0),
+    ("noisy", 700, 3500, 0.0),
+    ("speakerphone", 900, 2500, 0.4)
+)
+
+# one period of a voiced sound, a few harmonics of falling strength
+WAVE_POINTS = 64
+WAVE = [sum(amplitude * math.sin(2 * math.pi * harmonic * point / WAVE_POINTS)
+            for harmonic, amplitude in ((1, 1.0), (2, 0.6), (3, 0.4), (4, 0.3), (5, 0.2)))
+        for point in range(WAVE_POINTS)]
+
+
+def encode_ulaw(samples):
+    pcm = array.array("h", samples)
+    if audioop is not None:
+        if sys.byteorder != "little":
+            pcm.byteswap()
+        return audioop.lin2ulaw(pcm.tobytes(), 2)
+    return bytes(ULAW_ENCODE_TABLE[(sample >> 2) & 0x3fff] for sample in pcm)
+
+
+# a stretch of speech: syllables with gaps inside words and longer ones between them, peaking at about 1
+def speech(rng, secs):
+    samples = []
+    phase = 0.0
+    f0 = rng.uniform(100, 220)
+    while len(samples) < secs * RATE:
+        for _ in range(rng.randint(1, 3)):
+            length = int(rng.uniform(0.12, 0.3) * RATE)
+            for index in range(length):
+                envelope = math.sin(math.pi * index / length) ** 0.5
+                phase = (phase + (f0 * (1 + 0.1 * math.sin(2 * math.pi * index / length))) / RATE) % 1.0
+                samples.append(envelope * WAVE[int(phase * WAVE_POINTS)])
+            samples.extend([0.0] * int(rng.uniform(0.02, 0.06) * RATE))
+        samples.extend([0.0] * int(rng.uniform(0.1, 0.25) * RATE))
+    while samples and samples[-1] == 0.0:
+        samples.pop()
+    return samples
+
+
+def synthetic_call(rng, name, condition, turns):
+    _, noise_rms, speech_rms, drift = [entry for entry in CONDITIONS if entry[0] == condition][0]
+    signal = [0.0] * int(rng.uniform(0.8, 1.5) * RATE)
+    segments = []
+    for _ in range(turns):
+        words = speech(rng, rng.uniform(0.8, 2.5))
+        voiced = [sample for sample in words if sample]
+        scale = speech_rms / math.sqrt(sum(sample * sample for sample in voiced) / len(voiced))
+        segments.append((len(signal), len(signal) + len(words)))
+        signal.extend(sample * scale for sample in words)
+        signal.extend([0.0] * int(rng.uniform(3.0, 4.0) * RATE))
+
+    # low-pass filtered white noise at noise_rms, its level drifting slowly by up to drift either way
+    noise = []
+    state = 0.0
+    for _ in signal:
+        state = 0.7 * state + rng.gauss(0.0, 1.0)
+        noise.append(state)
+    noise_scale = noise_rms / math.sqrt(sum(sample * sample for sample in noise) / len(noise))
+    drift_hz = rng.uniform(0.1, 0.3)
+    samples = [int(max(-32768, min(32767, value + noise_sample * noise_scale * (1 + drift * math.sin(2 * math.pi * drift_hz * index / RATE)))))
+               for index, (value, noise_sample) in enumerate(zip(signal, noise))]
+
+    ulaw = encode_ulaw(samples)
+    payloads = [base64.b64encode(ulaw[start:start + FRAME_SAMPLES]).decode("ascii")
+                for start in range(0, len(ulaw) - FRAME_SAMPLES + 1, FRAME_SAMPLES)]
+    # a frame carries speech if the speech in it is louder than a tenth of the talker's level
+    frames = []
+    for start in range(0, len(payloads) * FRAME_SAMPLES, FRAME_SAMPLES):
+        frame = signal[start:start + FRAME_SAMPLES]
+        frames.append("^" if math.sqrt(sum(sample * sample for sample in frame) / len(frame)) > speech_rms / 10.0 else ".")
+    labels = {"Condition": condition,
+              "Speech": [[round(start / float(RATE), 3), round(end / float(RATE), 3)] for start, end in segments],
+              "VoicedFrames": "".join(frames)}
+    return name, payloads, labels
+
+
+def synthetic_corpus(args):
+    rng = random.Random(args.seed)
+    return [synthetic_call(rng, "{0}-{1}".format(condition, index), condition, args.turns)
+            for condition, _, _, _ in CONDITIONS for index in range(args.calls)]
+
+
+def read_corpus(directory):
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.txt"))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        with open(path) as recording:
+            payloads = read_payloads(recording)
+        with open(os.path.join(directory, name + ".json")) as labels_file:
+            corpus.append((name, payloads, json.load(labels_file)))
+    return corpus
+
+
+def write_corpus(directory, corpus):
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    for name, payloads, labels in corpus:
+        with open(os.path.join(directory, name + ".txt"), "w") as recording:
+            recording.write("\n".join(payloads) + "\n")
+        with open(os.path.join(directory, name + ".json"), "w") as labels_file:
+            json.dump(labels, labels_file)
+
+
+# replays a call as vad_replay.replay() does, returns the decisions and the voiced decision of every frame
+def detect(payloads, adaptive):
+    recorder = ReplayRecorder()
+    noise_floor = NoiseFloor(RATE) if adaptive else None
+    client = ReplayVoiceAndSilenceDetectingLexClient("BENCH", [recorder], [recorder], noise_floor=noise_floor)
+    voiced = bytearray(len(payloads))
+    for frame_index, payload in enumerate(payloads):
+        recorder.frame_index = frame_index
+        client.stream_to_lex(payload)
+        voiced[frame_index] = client.endpointer.voiced
+        if recorder.turn_ended:
+            recorder.turn = recorder.turn + 1
+            recorder.turn_ended = False
+            client = ReplayVoiceAndSilenceDetectingLexClient("BENCH", [recorder], [recorder], noise_floor=noise_floor)
+    return recorder.decisions, voiced
+
+
+def score(labels, decisions, voiced, totals):
+    config = VoiceAndSilenceDetectingLexClient.vad_sd_config
+    turns = {}
+    for decision in decisions:
+        turns.setdefault(decision["Turn"], {})[decision["Event"]] = decision["Frame"]
+    starts = sorted((turn.get("voice_detected"), turn.get("silence_detected")) for turn in turns.values()
+                    if turn.get("voice_detected") is not None)
+    segments = [(int(start / FRAME_SECS), int(end / FRAME_SECS)) for start, end in labels["Speech"]]
+
+    # a turn that started on noise before the speech and is still going covers it too
+    counted = set()
+    for index, (start, end) in enumerate(segments):
+        next_start = segments[index + 1][0] if index + 1 < len(segments) else len(voiced)
+        totals["Segments"] = totals["Segments"] + 1
+        turn = [(voice, silence) for voice, silence in starts
+                if voice <= end and (silence is None or silence > start) and voice not in counted]
+        if not turn:
+            continue
+        voice, silence = turn[0]
+        totals["Detected"] = totals["Detected"] + 1
+        if voice >= start - 5:
+            counted.add(voice)
+        if (voice - start) * FRAME_SECS * 1000 > config["PreRollMs"]:
+            totals["LateStarts"] = totals["LateStarts"] + 1
+        if silence is None or silence >= next_start:
+            totals["NeverEnded"] = totals["NeverEnded"] + 1
+        elif silence < end:
+            totals["CutOff"] = totals["CutOff"] + 1
+        else:
+            totals["EndDelays"].append((silence - end) * FRAME_SECS - config["SilenceDurationTimeInSecs"])
+    totals["FalseStarts"] = totals["FalseStarts"] + len([voice for voice, _ in starts if voice not in counted])
+
+    for decision, label in zip(voiced, labels.get("VoicedFrames", "")):
+        if decision and label == "^":
+            totals["TruePositives"] = totals["TruePositives"] + 1
+        elif decision:
+            totals["FalsePositives"] = totals["FalsePositives"] + 1
+        elif label == "^":
+            totals["FalseNegatives"] = totals["FalseNegatives"] + 1
+
+
+def new_totals():
+    return {"Segments": 0, "Detected": 0, "LateStarts": 0, "CutOff": 0, "NeverEnded": 0, "FalseStarts": 0,
+            "EndDelays": [], "TruePositives": 0, "FalsePositives": 0, "FalseNegatives": 0}
+
+
+def report(condition, mode, totals):
+    delays = sorted(totals["EndDelays"]) or [0.0]
+    labelled = totals["TruePositives"] + totals["FalseNegatives"]
+    flagged = totals["TruePositives"] + totals["FalsePositives"]
+    print("{0:>12} {1:8s} {2:3d}/{3:<3d} detected, late start {4:2d}, cut off {5:2d}, never ended {6:2d}, "
+          "false starts {7:2d}, end delay p50 {8:5.0f} ms p95 {9:5.0f} ms, frames precision {10:.2f} recall {11:.2f}".format(
+              condition, mode, totals["Detected"], totals["Segments"], totals["LateStarts"], totals["CutOff"],
+              totals["NeverEnded"], totals["FalseStarts"], percentile(delays, 0.5) * 1000, percentile(delays, 0.95) * 1000,
+              totals["TruePositives"] / float(flagged) if flagged else 0.0,
+              totals["TruePositives"] / float(labelled) if labelled else 0.0))
+
+
+def run(args):
+    corpus = read_corpus(args.corpus) if args.corpus else synthetic_corpus(args)
+    if args.write_corpus:
+        write_corpus(args.write_corpus, corpus)
+    frames = sum(len(payloads) for _, payloads, _ in corpus)
+    print("{0} calls, {1} frames ({2:.0f} s of audio), VAD engine {3}".format(
+        len(corpus), frames, frames * FRAME_SECS, VoiceAndSilenceDetectingLexClient.vad_sd_config["Engine"]))
+
+    conditions = []
+    for _, _, labels in corpus:
+        if labels.get("Condition", "all") not in conditions:
+            conditions.append(labels.get("Condition", "all"))
+    for mode, adaptive in (("fixed", False), ("adaptive", True)):
+        results = []
+        started = time.process_time()
+        for name, payloads, labels in corpus:
+            results.append(detect(payloads, adaptive))
+        cpu = time.process_time() - started
+        overall = new_totals()
+        for condition in conditions:
+            totals = new_totals()
+            for (_, _, labels), (decisions, voiced) in zip(corpus, results):
+                if labels.get("Condition", "all") == condition:
+                    score(labels, decisions, voiced, totals)
+                    score(labels, decisions, voiced, overall)
+            report(condition, mode, totals)
+        if len(conditions) > 1:
+            report("all", mode, overall)
+        print("{0:>12} {1:8s} {2:.2f} us/frame".format("cpu", mode, cpu / frames * 1e6))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=5, help="synthetic calls per line condition")
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--corpus", help="directory of labeled calls to replay instead of the synthetic corpus")
+    parser.add_argument("--write-corpus", help="directory to save the corpus to")
+    run(parser.parse_args())
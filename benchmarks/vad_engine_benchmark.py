@@ -0,0 +1,83 @@
+"""
+Frames per second per core for each VAD engine.
+
+Every engine decodes --frames random 20 ms mu-law frames (base64 encoded, as
+they arrive from Twilio) into a reused buffer and computes their RMS. "current" is the per-frame
+path VoiceAndSilenceDetectingLexClient used before vad_engines
+(audioop.ulaw2lin + audioop.rms); "batch" runs NumpyVadEngine.process_batch()
+over --batch frames at a time, e.g. the latest frame of that many calls. The
+results of every engine are checked against audioop before timing.
+
+Usage:
+    python benchmarks/vad_engine_benchmark.py [--frames 50000] [--batch 500]
+"""
+
+import argparse
+import base64
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore", DeprecationWarning)
+    from vad_engines import audioop, available_engines, create_engine
+
+FRAME_BYTES = 160
+
+
+def measure(label, function, payloads):
+    started = time.process_time()
+    function(payloads)
+    elapsed = time.process_time() - started
+    print("{0:>16}: {1:12,.0f} frames/s/core ({2:.2f} us/frame)".format(
+        label, len(payloads) / elapsed, elapsed / len(payloads) * 1e6))
+
+
+def run(args):
+    payloads = [base64.b64encode(os.urandom(FRAME_BYTES)) for _ in range(args.frames)]
+
+    if audioop is not None:
+        expected = [audioop.rms(audioop.ulaw2lin(base64.b64decode(payload), 2), 2) for payload in payloads[:1000]]
+        for name in available_engines():
+            engine = create_engine(name)
+            assert [engine.process(base64.b64decode(payload))[1] for payload in payloads[:1000]] == expected, name
+        if "numpy" in available_engines():
+            frames = [base64.b64decode(payload) for payload in payloads[:1000]]
+            assert create_engine("numpy").process_batch(frames)[1] == expected
+
+        def current(payloads):
+            for payload in payloads:
+                pcm = audioop.ulaw2lin(base64.b64decode(payload), 2)
+                audioop.rms(pcm, 2)
+
+        measure("current", current, payloads)
+
+    for name in available_engines():
+        engine = create_engine(name)
+
+        # as VoiceAndSilenceDetectingLexClient does, decoding into a reused buffer
+        def per_frame(payloads, engine=engine):
+            out = bytearray(FRAME_BYTES * 2)
+            for payload in payloads:
+                engine.process_into(base64.b64decode(payload), out)
+
+        measure(name, per_frame, payloads if name != "python" else payloads[:args.frames // 10])
+
+    if "numpy" in available_engines():
+        engine = create_engine("numpy")
+
+        def batched(payloads):
+            for start in range(0, len(payloads), args.batch):
+                engine.process_batch([base64.b64decode(payload) for payload in payloads[start:start + args.batch]])
+
+        measure("numpy batch {0}".format(args.batch), batched, payloads)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=50000)
+    parser.add_argument("--batch", type=int, default=500)
+    run(parser.parse_args())
@@ -0,0 +1,36 @@
+"""
+Concurrent calls vs. worker processes, and draining active calls on deploy.
+
+Runs load_harness.py once for each of --workers, putting the same load on
+the server each time: by default 200 simulated calls of 2 turns, media paced
+at 5 times real time (so 200 calls carry the frames of 1000 real-time calls).
+Compare the cores used, how the calls were spread over the workers and the
+turn latency, which grows once the workers cannot keep up with the frames. On
+a machine with at least as many cores as workers, the latency stays flat as
+the load grows with more workers, while a single worker saturates one core.
+
+Any other option is passed on to load_harness.py, e.g. --drain-after 1 to
+send SIGTERM once every call is connected, as on a deploy.
+
+Usage:
+    python benchmarks/worker_scaling_benchmark.py [--workers 1 2 4] [load_harness.py options, e.g. --drain-after 1]
+"""
+
+import argparse
+import asyncio
+import sys
+
+import load_harness
+
+# the load for every worker count, options given on the command line take precedence
+DEFAULT_LOAD = ["--calls", "200", "--turns", "2", "--speed", "5", "--turn-timeout", "30"]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args, harness_argv = parser.parse_known_args()
+    status = 0
+    for workers in args.workers:
+        harness_args = load_harness.parse_args(DEFAULT_LOAD + harness_argv + ["--workers", str(workers)])
+        status = max(status, asyncio.run(load_harness.run(harness_args)))
+    sys.exit(status)
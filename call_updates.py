@@ -0,0 +1,265 @@
+"""
+This module contains the dispatchers that send Twilio call updates off the media path
+
+A call update used to be a synchronous REST call made from silence_detected,
+on the same stack as the loop receiving the call's media, so no frames were
+read while it was in flight. submit() now only records the update and returns;
+a bounded set of workers sends it with TwilioCall.update() (threads, for
+server.py) or TwilioCall.update_async() (asyncio tasks, for async_server.py).
+
+Updates are coalesced per CallSid: an update submitted while an earlier one
+for the same call is still queued replaces it, as only the latest TwiML
+matters, and updates for one call are never sent concurrently. Failed updates
+are retried on connection errors, 429 and 5xx responses with exponential
+backoff and full jitter. Queue depth, in-flight updates and outcome counters
+are available from stats().
+"""
+
+import asyncio
+import collections
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+
+from metrics import TurnMetrics
+
+
+class CallUpdateQueue:
+    dispatcher_config = {
+        "Workers": int(os.environ.get('TWILIO_UPDATE_WORKERS', 4)),
+        "MaxQueued": int(os.environ.get('TWILIO_UPDATE_MAX_QUEUED', 1000)),
+        "MaxAttempts": int(os.environ.get('TWILIO_UPDATE_MAX_ATTEMPTS', 3)),
+        "BackoffInSecs": float(os.environ.get('TWILIO_UPDATE_BACKOFF_SECS', 0.2))
+    }
+    # errors without an http status that are worth retrying
+    retriable_errors = ()
+
+    def __init__(self, workers, max_queued, max_attempts, backoff_secs):
+        self.logger = logging.getLogger(__name__)
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_attempts = max_attempts
+        self.backoff_secs = backoff_secs
+        self.order = collections.deque()
+        self.queued = {}
+        self.in_flight = set()
+        self.counters = {"Submitted": 0, "Coalesced": 0, "Rejected": 0, "Sent": 0, "Retries": 0, "Failed": 0}
+        self.max_queue_depth = 0
+        self.send_secs = 0.0
+        self.queued_secs = 0.0
+
+    # record the update, returns False when the queue is full. the caller holds the lock
+    def enqueue(self, twilio_call):
+        call_sid = twilio_call.call_sid
+        self.counters["Submitted"] = self.counters["Submitted"] + 1
+        if call_sid in self.queued:
+            self.queued[call_sid] = (twilio_call, self.queued[call_sid][1])
+            self.counters["Coalesced"] = self.counters["Coalesced"] + 1
+            return True
+        if len(self.queued) >= self.max_queued:
+            self.counters["Rejected"] = self.counters["Rejected"] + 1
+            self.logger.error("call update queue full, dropping update for call {0}".format(call_sid))
+            return False
+        self.queued[call_sid] = (twilio_call, time.perf_counter())
+        if call_sid not in self.in_flight:
+            self.order.append(call_sid)
+        self.max_queue_depth = max(self.max_queue_depth, len(self.queued))
+        return True
+
+    # next update whose call has no update in flight, None if there is none. the caller holds the lock
+    def dequeue(self):
+        if not self.order:
+            return None
+        call_sid = self.order.popleft()
+        twilio_call, queued_at = self.queued.pop(call_sid)
+        self.in_flight.add(call_sid)
+        self.queued_secs = self.queued_secs + time.perf_counter() - queued_at
+        return twilio_call
+
+    # the caller holds the lock
+    def finish(self, twilio_call, sent, send_secs):
+        call_sid = twilio_call.call_sid
+        self.in_flight.discard(call_sid)
+        self.counters["Sent" if sent else "Failed"] += 1
+        self.send_secs = self.send_secs + send_secs
+        if sent:
+            TurnMetrics.shared().mark(call_sid, "twilio_update_sent")
+            TurnMetrics.shared().duration(call_sid, "twilio_update", send_secs)
+        # an update submitted while this one was in flight goes out next
+        if call_sid in self.queued:
+            self.order.append(call_sid)
+
+    def retriable(self, error):
+        status = getattr(error, "status", None)
+        if status is not None:
+            return status == 429 or status >= 500
+        return isinstance(error, self.retriable_errors)
+
+    # full jitter: a random delay up to the exponential backoff of the attempt
+    def backoff(self, attempt):
+        return random.uniform(0, self.backoff_secs * (2 ** (attempt - 1)))
+
+    def log_failure(self, twilio_call, attempt, error):
+        self.logger.warning("call update for {0} failed on attempt {1}/{2}: {3}".format(
+            twilio_call.call_sid, attempt, self.max_attempts, error))
+
+    def snapshot(self):
+        stats = dict(self.counters)
+        done = stats["Sent"] + stats["Failed"]
+        stats.update({"Workers": self.workers,
+                      "QueueDepth": len(self.queued),
+                      "MaxQueueDepth": self.max_queue_depth,
+                      "InFlight": len(self.in_flight),
+                      "MeanQueuedMs": round(self.queued_secs / done * 1000, 3) if done else None,
+                      "MeanSendMs": round(self.send_secs / done * 1000, 3) if done else None})
+        return stats
+
+
+class CallUpdateDispatcher(CallUpdateQueue):
+    retriable_errors = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, workers, max_queued, max_attempts, backoff_secs):
+        super().__init__(workers, max_queued, max_attempts, backoff_secs)
+        self.lock = threading.Condition()
+        self.closed = False
+        self.threads = [threading.Thread(target=self.work, name="call-update-{0}".format(index), daemon=True)
+                        for index in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    @classmethod
+    def shared(cls):
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls(cls.dispatcher_config["Workers"], cls.dispatcher_config["MaxQueued"],
+                                      cls.dispatcher_config["MaxAttempts"], cls.dispatcher_config["BackoffInSecs"])
+        return cls._shared
+
+    # queue a call update for twilio_call, returns immediately
+    def submit(self, twilio_call):
+        with self.lock:
+            accepted = self.enqueue(twilio_call)
+            self.lock.notify_all()
+        return accepted
+
+    def work(self):
+        while True:
+            with self.lock:
+                twilio_call = self.dequeue()
+                while twilio_call is None:
+                    if self.closed:
+                        return
+                    self.lock.wait()
+                    twilio_call = self.dequeue()
+            started = time.perf_counter()
+            sent = self.send(twilio_call)
+            with self.lock:
+                self.finish(twilio_call, sent, time.perf_counter() - started)
+                self.lock.notify_all()
+
+    def send(self, twilio_call):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                twilio_call.update()
+                return True
+            except Exception as e:
+                self.log_failure(twilio_call, attempt, e)
+                if attempt == self.max_attempts or not self.retriable(e):
+                    return False
+                with self.lock:
+                    self.counters["Retries"] = self.counters["Retries"] + 1
+                time.sleep(self.backoff(attempt))
+        return False
+
+    # wait until every queued update was sent, True if that happened within timeout
+    def join(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.lock:
+            while self.queued or self.in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.lock.wait(remaining)
+        return True
+
+    def stats(self):
+        with self.lock:
+            return self.snapshot()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.lock.notify_all()
+
+
+class AsyncCallUpdateDispatcher(CallUpdateQueue):
+    """Same dispatcher on the running event loop, sending with TwilioCall.update_async() on the given aiohttp session"""
+
+    def __init__(self, session, workers, max_queued, max_attempts, backoff_secs):
+        super().__init__(workers, max_queued, max_attempts, backoff_secs)
+        import aiohttp
+        self.retriable_errors = (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+        self.session = session
+        self.ready = asyncio.Condition()
+        self.closed = False
+        self.tasks = [asyncio.ensure_future(self.work()) for _ in range(workers)]
+
+    @classmethod
+    def from_config(cls, session):
+        return cls(session, cls.dispatcher_config["Workers"], cls.dispatcher_config["MaxQueued"],
+                   cls.dispatcher_config["MaxAttempts"], cls.dispatcher_config["BackoffInSecs"])
+
+    # queue a call update for twilio_call. nothing is awaited, everything runs on the event loop thread
+    def submit(self, twilio_call):
+        accepted = self.enqueue(twilio_call)
+        asyncio.ensure_future(self.notify())
+        return accepted
+
+    async def notify(self):
+        async with self.ready:
+            self.ready.notify_all()
+
+    async def work(self):
+        while True:
+            async with self.ready:
+                await self.ready.wait_for(lambda: self.closed or self.order)
+                if self.closed:
+                    return
+                twilio_call = self.dequeue()
+            started = time.perf_counter()
+            sent = await self.send(twilio_call)
+            self.finish(twilio_call, sent, time.perf_counter() - started)
+            await self.notify()
+
+    async def send(self, twilio_call):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                await twilio_call.update_async(self.session)
+                return True
+            except Exception as e:
+                self.log_failure(twilio_call, attempt, e)
+                if attempt == self.max_attempts or not self.retriable(e):
+                    return False
+                self.counters["Retries"] = self.counters["Retries"] + 1
+                await asyncio.sleep(self.backoff(attempt))
+        return False
+
+    async def join(self):
+        async with self.ready:
+            await self.ready.wait_for(lambda: not self.queued and not self.in_flight)
+
+    def stats(self):
+        return self.snapshot()
+
+    async def close(self):
+        self.closed = True
+        await self.notify()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
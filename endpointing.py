@@ -0,0 +1,93 @@
+"""
+This module contains the end pointing state machine used for voice and silence detection
+
+Endpointer decides where an utterance starts and ends from the energy of each
+frame. Time is measured in audio samples rather than wall-clock time, so the
+decisions only depend on the audio: a scheduler stall or a burst of frames
+queued up on the WebSocket no longer makes silence look longer or shorter
+than it was.
+
+States:
+    SILENCE - waiting for voice. A frame louder than the onset threshold moves to ONSET.
+    ONSET   - voice seen, waiting for onset_duration of consecutive voiced audio
+              before declaring the start of the utterance (VOICE_STARTED). A frame
+              at or below the onset threshold goes back to SILENCE.
+    SPEECH  - utterance in progress. Frames louder than the offset threshold count as
+              voice (hysteresis: the offset threshold can be lower than the onset
+              threshold), anything else counts as silence. silence_duration of
+              continuous silence ends the utterance (UTTERANCE_ENDED).
+    ENDED   - end of utterance declared, further frames are ignored.
+
+With an onset duration of 0 and equal thresholds this behaves like the
+original detector: the first frame above the threshold starts the utterance.
+"""
+
+
+class Endpointer:
+    SILENCE = "silence"
+    ONSET = "onset"
+    SPEECH = "speech"
+    ENDED = "ended"
+
+    VOICE_STARTED = "voice_started"
+    UTTERANCE_ENDED = "utterance_ended"
+
+    def __init__(self, sample_rate, onset_threshold, offset_threshold, silence_duration_secs, onset_duration_secs=0):
+        self.sample_rate = sample_rate
+        self.onset_threshold = onset_threshold
+        self.offset_threshold = offset_threshold
+        self.silence_samples_needed = int(round(silence_duration_secs * sample_rate))
+        self.onset_samples_needed = int(round(onset_duration_secs * sample_rate))
+
+        self.state = self.SILENCE
+        self.voiced = False
+        self.total_samples = 0
+        self.onset_samples = 0
+        self.speech_samples = 0
+        self.silence_samples = 0
+
+    # feed the energy of one frame of sample_count samples, returns VOICE_STARTED, UTTERANCE_ENDED or None
+    def update(self, rms, sample_count):
+        self.total_samples = self.total_samples + sample_count
+
+        if self.state == self.ENDED:
+            self.voiced = False
+            return None
+
+        if self.state == self.SPEECH:
+            self.voiced = rms > self.offset_threshold
+            self.speech_samples = self.speech_samples + sample_count
+            if self.voiced:
+                self.silence_samples = 0
+                return None
+            self.silence_samples = self.silence_samples + sample_count
+            if self.silence_samples >= self.silence_samples_needed:
+                self.state = self.ENDED
+                return self.UTTERANCE_ENDED
+            return None
+
+        self.voiced = rms > self.onset_threshold
+        if not self.voiced:
+            self.state = self.SILENCE
+            self.onset_samples = 0
+            return None
+
+        self.onset_samples = self.onset_samples + sample_count
+        if self.onset_samples >= self.onset_samples_needed:
+            self.state = self.SPEECH
+            self.speech_samples = self.onset_samples
+            return self.VOICE_STARTED
+        self.state = self.ONSET
+        return None
+
+    @property
+    def silence_secs(self):
+        return self.silence_samples / float(self.sample_rate)
+
+    @property
+    def speech_secs(self):
+        return self.speech_samples / float(self.sample_rate)
+
+    @property
+    def elapsed_secs(self):
+        return self.total_samples / float(self.sample_rate)
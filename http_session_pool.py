@@ -0,0 +1,228 @@
+"""
+This module contains the process-wide pooled HTTP session used to call Lex
+
+Every LexClientStreaming shares one requests.Session whose adapter keeps a
+bounded pool of keep-alive connections per host, so a conversational turn
+reuses an already established TCP/TLS connection instead of paying a fresh
+handshake. Connections that sat idle in the pool for longer than the idle
+timeout are closed on checkout and re-established, rather than risking a
+connection the server side has already dropped.
+
+The pool counts checkouts, hits (reused connections), misses (new connection
+objects), idle evictions and handshakes (connection establishments), which are
+available from HttpSessionPool.stats() and served on /debug/lex. warm() opens
+connections ahead of the first request to a host, warm_connections() does the
+same for any requests session (e.g. the Twilio REST client's).
+pool_trace_config() counts the same for the Lex requests of the aiohttp
+session async_server.py sends through.
+"""
+
+import logging
+import os
+import socket
+import ssl
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+class PoolStats:
+    FIELDS = ("checkouts", "hits", "misses", "evictions", "handshakes")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(self.FIELDS, 0)
+
+    def increment(self, name):
+        with self.lock:
+            self.counters[name] = self.counters[name] + 1
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters)
+
+
+def instrumented_pool_class(base, stats, idle_timeout):
+    class InstrumentedConnection(base.ConnectionCls):
+        def connect(self):
+            stats.increment("handshakes")
+            super().connect()
+
+        # a tls 1.3 server sends its session tickets after the handshake. until something is read from a connection
+        # that was only warmed up they leave the socket readable, which urllib3 takes for a dropped connection. they
+        # are read here, the connection counts as dropped only if it was closed or holds anything else
+        @property
+        def is_connected(self):
+            if super().is_connected:
+                return True
+            if not isinstance(self.sock, ssl.SSLSocket):
+                return False
+            timeout = self.sock.gettimeout()
+            self.sock.settimeout(0.0)
+            try:
+                self.sock.recv(1)
+                return False
+            except ssl.SSLWantReadError:
+                return True
+            except OSError:
+                return False
+            finally:
+                self.sock.settimeout(timeout)
+
+    class InstrumentedConnectionPool(base):
+        ConnectionCls = InstrumentedConnection
+
+        def _get_conn(self, timeout=None):
+            conn = super()._get_conn(timeout)
+            stats.increment("checkouts")
+            last_used = getattr(conn, "last_used", None)
+            if last_used is None:
+                # _new_conn() was called for this checkout
+                stats.increment("misses")
+            elif time.monotonic() - last_used > idle_timeout:
+                stats.increment("evictions")
+                conn.close()
+            else:
+                stats.increment("hits")
+            return conn
+
+        def _put_conn(self, conn):
+            if conn is not None:
+                conn.last_used = time.monotonic()
+            super()._put_conn(conn)
+
+    return InstrumentedConnectionPool
+
+
+class InstrumentedHTTPAdapter(HTTPAdapter):
+    def __init__(self, stats, idle_timeout, keep_alive, **kwargs):
+        self.stats = stats
+        self.idle_timeout = idle_timeout
+        self.keep_alive = keep_alive
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        if self.keep_alive:
+            pool_kwargs["socket_options"] = HTTPConnection.default_socket_options + [
+                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        super().init_poolmanager(connections, maxsize, block, **pool_kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": instrumented_pool_class(HTTPConnectionPool, self.stats, self.idle_timeout),
+            "https": instrumented_pool_class(HTTPSConnectionPool, self.stats, self.idle_timeout)
+        }
+
+
+# open up to connections pooled connections of session to the host of url, returns how many had to be established
+def warm_connections(session, url, connections=1, ca_bundle=None):
+    request = requests.Request("POST", url).prepare()
+    verify = session.merge_environment_settings(url, {}, None, ca_bundle, None)["verify"]
+    adapter = session.get_adapter(url)
+    if hasattr(adapter, "get_connection_with_tls_context"):
+        pool = adapter.get_connection_with_tls_context(request, verify)
+    else:
+        # requests before 2.32 applies the tls settings to the pool when sending
+        pool = adapter.get_connection(url)
+        adapter.cert_verify(pool, url, verify, None)
+    # all of them are checked out at once, one at a time the pool would hand back the same connection
+    conns = []
+    established = 0
+    try:
+        for _ in range(connections):
+            conn = pool._get_conn()
+            conns.append(conn)
+            if conn.sock is None:
+                conn.connect()
+                established = established + 1
+    finally:
+        for conn in conns:
+            pool._put_conn(conn)
+    return established
+
+
+# counts the connections an aiohttp session uses for requests to the host of url into stats, as the instrumented pool
+# does: a checkout per request, a hit for a reused connection, a miss and a handshake for a new one. the connector
+# closes idle connections itself, so there are no evictions to count
+def pool_trace_config(stats, url):
+    import aiohttp
+    import yarl
+
+    target = yarl.URL(url)
+
+    async def on_request_start(session, context, params):
+        context.counted = (params.url.host, params.url.port) == (target.host, target.port)
+        if context.counted:
+            stats.increment("checkouts")
+
+    async def on_connection_reuseconn(session, context, params):
+        if getattr(context, "counted", False):
+            stats.increment("hits")
+
+    async def on_connection_create_end(session, context, params):
+        if getattr(context, "counted", False):
+            stats.increment("misses")
+            stats.increment("handshakes")
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    return trace_config
+
+
+class HttpSessionPool:
+    http_pool_config = {
+        "PoolSize": int(os.environ.get('LEX_POOL_SIZE', 50)),
+        "IdleTimeoutInSecs": float(os.environ.get('LEX_POOL_IDLE_TIMEOUT_SECS', 50)),
+        "KeepAlive": os.environ.get('LEX_POOL_KEEPALIVE', 'true').lower() == 'true',
+        "CaBundle": os.environ.get('LEX_CA_BUNDLE')
+    }
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, pool_size, idle_timeout, keep_alive=True, ca_bundle=None):
+        self.logger = logging.getLogger(__name__)
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.pool_stats = PoolStats()
+        self.ca_bundle = ca_bundle
+        self.session = requests.Session()
+
+        adapter = InstrumentedHTTPAdapter(self.pool_stats, idle_timeout, keep_alive,
+                                          pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.logger.info("http session pool configured with pool size {0}, idle timeout {1} secs, keep alive {2}"
+                         .format(pool_size, idle_timeout, keep_alive))
+
+    # process-wide pool shared by every lex client, built from http_pool_config on first use
+    @classmethod
+    def shared(cls):
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls(cls.http_pool_config["PoolSize"],
+                                      cls.http_pool_config["IdleTimeoutInSecs"],
+                                      cls.http_pool_config["KeepAlive"],
+                                      cls.http_pool_config["CaBundle"])
+        return cls._shared
+
+    def post(self, url, **kwargs):
+        # passed per request, as REQUESTS_CA_BUNDLE in the environment takes precedence over session.verify
+        if self.ca_bundle:
+            kwargs.setdefault("verify", self.ca_bundle)
+        return self.session.post(url, **kwargs)
+
+    # establish pooled connections to the host of url ahead of the first request to it
+    def warm(self, url, connections=1):
+        return warm_connections(self.session, url, connections, self.ca_bundle)
+
+    def stats(self):
+        return self.pool_stats.snapshot()
+
+    def close(self):
+        self.session.close()
@@ -5,21 +5,105 @@ The LexClientStreaming runs in its own thread. Class calls post content on Lex
 and uses chunked upload of data by passing in data iterator when creating the POST
 connection to server. Clients of this class can keep adding to data by calling
 add_to_stream(). Once done, clients need to call stop(), at which point the
-iterator finally finishes. Iterator checks if there is more data to send or not
-by periodically looking at the data input queue.
+iterator finally finishes. Data is handed over through a bounded StreamBuffer:
+the iterator blocks until a chunk is added or the stream is closed, so every
+chunk is forwarded as soon as it arrives and released once it has been sent.
+
+prewarm() can be called ahead of the first chunk (e.g. while the previous
+prompt is still playing back). It starts the request thread, signs the request
+headers and opens a pooled connection, so the first chunk added goes straight
+onto the wire. Per-turn timings are available from get_timings().
+
+With accept set (e.g. audio/pcm), Lex is asked for the response in that format.
+The body is not read with the response: get_response() returns "Audio", an
+iterator (an async iterator for AsyncLexClientStreaming) over the body in
+chunks as they arrive from Lex, so playback can start before the whole prompt
+has been received.
+
+Requests take a slot from AdmissionControl (see admission.py) from opening
+the request until Lex answers, and queue for one when too many are in flight.
+A request that gets no slot in time is not sent: get_response() then returns
+a response with "Rejected" set, for the caller to be asked to try again.
+
+When the call ends mid-turn, abort() gives up on the request instead of
+stop(): the body is cut off rather than finished, so Lex does not answer a
+turn nobody is going to hear, and nothing waits for the request to end. The
+request releases its admission slot as it unwinds.
+
+AsyncLexClientStreaming is the same client for an asyncio event loop: the
+request runs as a task sending through a shared aiohttp session instead of a
+thread, and callers await drain() and stop_async() instead of blocking.
 
 Todo:
     * TBD
 """
 
-import datetime
-import hashlib
-import hmac
+import asyncio
+import collections
 import logging
 import threading
 import time
-import requests
 import os
+from admission import AdmissionControl
+from http_session_pool import HttpSessionPool
+from sigv4_signer import SigV4Signer, request_template
+
+LexResponse = collections.namedtuple("LexResponse", ["status_code", "headers"])
+
+
+class LexRequestAborted(Exception):
+    """Raised from the request body once the request has been aborted, to cut it off"""
+
+
+class StreamBuffer:
+    """Bounded producer/consumer buffer of chunks with a close signal.
+
+    Producers call put() and are blocked (up to a timeout) while the buffer is
+    full. The consumer calls get(), which blocks until a chunk is available and
+    returns None once the buffer has been closed and fully drained.
+    """
+
+    def __init__(self, max_chunks):
+        self.max_chunks = max_chunks
+        self.chunks = collections.deque()
+        self.closed = False
+        self.condition = threading.Condition()
+
+    # add a chunk, returns False if the buffer is closed or stayed full for the whole timeout
+    def put(self, chunk, timeout=None):
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.closed or len(self.chunks) < self.max_chunks, timeout):
+                return False
+            if self.closed:
+                return False
+            self.chunks.append(chunk)
+            self.condition.notify_all()
+            return True
+
+    # block until a chunk is available. returns None when closed and drained
+    def get(self):
+        with self.condition:
+            self.condition.wait_for(lambda: self.closed or self.chunks)
+            if not self.chunks:
+                return None
+            chunk = self.chunks.popleft()
+            self.condition.notify_all()
+            return chunk
+
+    # block until there is a chunk to get. returns False if the buffer was closed without any chunk added
+    def wait_for_data(self):
+        with self.condition:
+            self.condition.wait_for(lambda: self.closed or self.chunks)
+            return len(self.chunks) > 0
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def __len__(self):
+        return len(self.chunks)
+
 
 class LexClientStreaming:
     AUDIO_CONTENT_TYPE = 'audio/lpcm; sample-rate=8000; sample-size-bits=16; channel-count=1; is-big-endian=false'
@@ -30,10 +114,17 @@ class LexClientStreaming:
         "SecretAccessKey": os.environ.get('SECRET_ACCESS_KEY'),
         "Region": os.environ.get('AWS_REGION'),
         "BotName": os.environ.get('LEX_BOT_NAME'),
-        "BotAlias": os.environ.get('LEX_BOT_ALIAS')
+        "BotAlias": os.environ.get('LEX_BOT_ALIAS'),
+        "Endpoint": os.environ.get('LEX_ENDPOINT'),
+        "StreamBufferChunks": int(os.environ.get('LEX_STREAM_BUFFER_CHUNKS', 500)),
+        "StreamPutTimeoutInSecs": float(os.environ.get('LEX_STREAM_PUT_TIMEOUT_SECS', 1)),
+        # SigV4 requests are rejected once x-amz-date is more than 5 minutes old, re-sign pre-signed headers before that
+        "MaxPresignAgeInSecs": float(os.environ.get('LEX_MAX_PRESIGN_AGE_SECS', 240)),
+        # largest chunk of response audio handed out at a time, 640 bytes is 20 ms of 16 kHz pcm
+        "AudioChunkBytes": int(os.environ.get('LEX_AUDIO_CHUNK_BYTES', 640))
     }
 
-    def __init__(self, user_id, content_type=AUDIO_CONTENT_TYPE, stage="lex"):
+    def __init__(self, user_id, content_type=AUDIO_CONTENT_TYPE, stage="lex", accept=None):
         self.logger = logging.getLogger(__name__)
         self.region = self.lex_config["Region"]
         self.access_key = self.lex_config["AccessKeyId"]
@@ -41,30 +132,57 @@ class LexClientStreaming:
         self.bot_name = self.lex_config["BotName"]
         self.bot_alias = self.lex_config["BotAlias"]
         self.host_name = "runtime.lex.{0}.amazonaws.com".format(self.region)
-        self.endpoint = "https://runtime.lex.{0}.amazonaws.com".format(self.region)
+        self.endpoint = self.lex_endpoint()
         self.service = "lex"
-        self.data = []
-        self.data_index = 0
+        self.data = StreamBuffer(self.lex_config["StreamBufferChunks"])
+        self.put_timeout = self.lex_config["StreamPutTimeoutInSecs"]
         self.close_stream = False
         self.user_id = user_id
         self.lex_user_id = "{0}_{1}".format(stage, user_id)
         self.content_type = content_type
+        self.accept = accept
         self.response = None
         self.crashed = False
+        self.rejected = False
+        self.aborted = False
         self.request_thread = None
+        self.prewarmed = False
+        self.headers = None
+        self.signed_at = None
+        self.timings = {}
+        self.session_pool = HttpSessionPool.shared()
+        self.admission = AdmissionControl.shared()
+        self.signer = SigV4Signer.shared(self.access_key, self.secret_key)
+        canonical_uri = "/bot/{0}/alias/{1}/user/{2}/content".format(self.bot_name, self.bot_alias, self.lex_user_id)
+        self.template = request_template(self.host_name, canonical_uri, content_type, self.region, self.service)
+
+    @classmethod
+    def lex_endpoint(cls):
+        return cls.lex_config["Endpoint"] or "https://runtime.lex.{0}.amazonaws.com".format(cls.lex_config["Region"])
+
+    # prepare the request before any data is added: start the request thread, which signs the headers, opens a
+    # pooled connection to lex and then waits for the first chunk
+    def prewarm(self):
+        if self.request_thread is None:
+            self.prewarmed = True
+            self.request_thread = threading.Thread(target=self.run)
+            self.request_thread.start()
 
     # add data if stream is not closed. no-op otherwise
     def add_to_stream(self, data):
+        if "first_frame" not in self.timings:
+            self.timings["first_frame"] = time.monotonic()
 
         # start a connection first time we see that data is added to stream
         if self.request_thread is None:
             self.request_thread = threading.Thread(target=self.run)
             self.request_thread.start()
 
-        # python operation to append data to new list seems thread safe
-        # http://effbot.org/pyfaq/what-kinds-of-global-value-mutation-are-thread-safe.htm
-        if self.close_stream is False:
-            self.data.append(data)
+        # the buffer wakes up the request thread as soon as data is added. if lex is not keeping up the caller
+        # is blocked for at most put_timeout, after which the chunk is dropped rather than stalling the media loop
+        if self.close_stream is False and not self.crashed and not self.rejected:
+            if not self.data.put(data, self.put_timeout):
+                self.logger.warning("lex stream buffer full or closed, dropping %d bytes", len(data))
 
     def is_alive(self):
         return self.request_thread is not None and self.request_thread.is_alive()
@@ -73,34 +191,41 @@ class LexClientStreaming:
     def stop(self):
         self.logger.debug("closing lex streaming client")
         self.close_stream = True
+        self.timings["stop"] = time.monotonic()
+        self.data.close()
         if self.request_thread is not None:
             self.logger.debug("waiting for lex connection thread to stop")
             self.request_thread.join()
             self.logger.debug("lex connection thread stopped")
 
-    # check (every X milliseconds) and return new chunk if there is data added to stream
-    def stream_iterator(self):
-        while not self.close_stream:
-            if self.data_index < len(self.data):
-                if self.content_type == LexClientStreaming.TEXT_CONTENT_TYPE:
-                    yield str.encode(self.data[self.data_index])
-                else:
-                    yield self.data[self.data_index]
-
-                self.data_index = self.data_index + 1
-            else:
-                # sleeping for 100 ms to check if the stream is closed or not
-                time.sleep(0.1)
-
-        # check if anything is left to send as loop could have stopped if stream got closed and chunks have not yet been
-        # sent.
+    # the call has ended: close the stream without waiting for the request thread. a request still sending its body
+    # is cut off, a response that arrives all the same is let go of
+    def abort(self):
+        self.logger.debug("aborting lex streaming client")
+        self.aborted = True
+        self.close_stream = True
+        self.data.close()
 
-        while self.data_index < len(self.data):
+    # block until a new chunk is added to stream and return it. finishes once the stream is closed and every chunk
+    # added before stop() has been sent
+    def stream_iterator(self):
+        while True:
+            chunk = self.data.get()
+            if self.aborted:
+                raise LexRequestAborted()
+            if chunk is None:
+                self.timings["last_byte"] = time.monotonic()
+                return
+            if "first_byte" not in self.timings:
+                self.timings["first_byte"] = time.monotonic()
             if self.content_type == LexClientStreaming.TEXT_CONTENT_TYPE:
-                yield str.encode(self.data[self.data_index])
+                yield str.encode(chunk)
             else:
-                yield self.data[self.data_index]
-            self.data_index = self.data_index + 1
+                yield chunk
+
+    # block until the first chunk is added, False if the stream was stopped without any
+    def wait_for_data(self):
+        return self.data.wait_for_data()
 
     def is_crashed(self):
         return self.crashed
@@ -108,120 +233,246 @@ class LexClientStreaming:
     def run(self):
         try:
             self.__run()
+        except LexRequestAborted:
+            self.logger.info("call ended during the turn, lex request cut off")
         except Exception as e:
             self.logger.exception(e)
             self.crashed = True
+            self.data.close()
 
     def __run(self):
-        headers = {}
-        user_id = self.lex_user_id
-        content_type = self.content_type
-        data_type = "content"
-        payload_hash = "UNSIGNED-PAYLOAD"
-        headers['x-amz-content-sha256'] = "UNSIGNED-PAYLOAD"
-
-        t = datetime.datetime.utcnow()
-        amz_date = t.strftime('%Y%m%dT%H%M%SZ')  # '20170714T010101Z'
-        date_stamp = t.strftime('%Y%m%d')  # Date w/o time, used in credential scope '20170714'
-
-        # ************* TASK 1: CREATE A CANONICAL REQUEST *************
-        # http://docs.aws.amazon.com/general/latest/gr/sigv4-create-canonical-request.html
-
-        # Step 1 is to define the verb (GET, POST, etc.)
-        verb = "POST"
-
-        # Step 2: Create canonical URI--the part of the URI from domain to query
-        # string (use '/' if no path)
-        canonical_uri = "/bot/{0}/alias/{1}/user/{2}/{3}".format(self.bot_name, self.bot_alias, user_id, data_type)
-
-        # Step 3: Create the canonical query string. In this example, request
-        # parameters are passed in the body of the request and the query string
-        # is blank.
-        canonical_query_string = ""
-
-        # Step 4: Create the canonical headers. Header names must be trimmed
-        # and lowercase, and sorted in code point order from low to high.
-        # Note that there is a trailing \n.
-        canonical_headers = 'content-type:' + content_type + '\n' + 'host:' + self.host_name + '\n' + 'x-amz-date:' + amz_date + '\n'
-
-        # Step 5: Create the list of signed headers. This lists the headers
-        # in the canonical_headers list, delimited with ";" and in alpha order.
-        # Note: The request can include any headers; canonical_headers and
-        # signed_headers include those that you want to be included in the
-        # hash of the request. "Host" and "x-amz-date" are always required.
-        # For Lex, content-type and x-amz-target are also required.
-        signed_headers = 'content-type;host;x-amz-date'
-
-        # Step 6: Create payload hash. In this example, the payload (body of
-        # the request) contains the request parameters.
-
-        # overwrite payload hash if it is post text call
-        # if data_type == "text":
-        #    payload_hash = hashlib.sha256(request_parameters.encode('utf-8')).hexdigest()
-
-        # Step 7: Combine elements to create create canonical request
-        canonical_request = verb + '\n' + canonical_uri + '\n' + canonical_query_string + '\n' + canonical_headers + '\n' + signed_headers + '\n' + payload_hash
-
-        # ************* TASK 2: CREATE THE STRING TO SIGN *************
-        # Match the algorithm to the hashing algorithm you use, either SHA-1 or
-        # SHA-256 (recommended)
-        algorithm = 'AWS4-HMAC-SHA256'
-        credential_scope = date_stamp + '/' + self.region + '/' + self.service + '/' + 'aws4_request'
-        string_to_sign = algorithm + '\n' + amz_date + '\n' + credential_scope + '\n' + hashlib.sha256(
-            canonical_request.encode('utf-8')).hexdigest()
-
-        # ************* TASK 3: CALCULATE THE SIGNATURE *************
-        # Create the signing key using the function defined above.
-        signing_key = self.__get_signature_key(self.secret_key, date_stamp, self.region, self.service)
-
-        # Sign the string_to_sign using the signing_key
-        signature = hmac.new(signing_key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
-
-        # ************* TASK 4: ADD SIGNING INFORMATION TO THE REQUEST *************
-        # Put the signature information in a header named Authorization.
-        authorization_header = algorithm + ' ' \
-                               + 'Credential=' + self.access_key + '/' + credential_scope + ', ' \
-                               + 'SignedHeaders=' + signed_headers + ', ' \
-                               + 'Signature=' + signature
-
-        # For Lex, the request can include any headers, but MUST include "host", "x-amz-date",
-        # "x-amz-target", "content-type", and "Authorization". Except for the authorization
-        # header, the headers must be included in the canonical_headers and signed_headers values, as
-        # noted earlier. Order here is not significant.
-        # Python note: The 'host' header is added automatically by the Python 'requests' library.
-        headers['Content-Type'] = content_type
-        headers['X-Amz-Date'] = amz_date
-        headers['Authorization'] = authorization_header
-
-        # ************* SEND THE REQUEST *************
-        self.logger.debug("Calling Lex to stream data, endpoint: %s", self.endpoint)
-        self.response = requests.post(self.endpoint + canonical_uri, data=self.stream_iterator(), headers=headers)
+        if self.prewarmed:
+            self.sign_headers()
+            try:
+                self.session_pool.warm(self.endpoint)
+            except Exception as e:
+                self.logger.warning("could not pre-open connection to lex, continuing without it: %s", e)
+
+        if not self.wait_for_data() or self.aborted:
+            self.logger.debug("lex stream closed before any data was added, not calling lex")
+            return
+
+        if self.headers is None or time.monotonic() - self.signed_at > self.lex_config["MaxPresignAgeInSecs"]:
+            self.sign_headers()
+
+        # the data added meanwhile stays in the buffer
+        if not self.admission.acquire_lex():
+            self.reject()
+            return
+        if self.aborted:
+            self.admission.release_lex()
+            return
+        try:
+            # ************* SEND THE REQUEST *************
+            self.logger.debug("Calling Lex to stream data, endpoint: %s", self.endpoint)
+            self.timings["request_start"] = time.monotonic()
+            # with accept the body is left on the connection for audio_chunks() to read
+            self.response = self.session_pool.post(self.endpoint + self.template.canonical_uri, data=self.stream_iterator(),
+                                                   headers=self.headers, stream=self.accept is not None)
+            self.timings["response"] = time.monotonic()
+        finally:
+            self.admission.release_lex()
         self.logger.info("Lex response headers %s ", self.response.headers)
+        if self.aborted:
+            self.release()
+
+    # no lex request slot in time: the turn is not sent to lex, the audio added to it is dropped
+    def reject(self):
+        self.logger.warning("no lex request slot within %s secs, too many lex requests in flight, not calling lex",
+                            self.admission.lex_queue_timeout)
+        self.rejected = True
+        self.data.close()
+
+    def sign_headers(self):
+        self.headers = self.template.sign(self.signer)
+        # not part of the signed headers, so it can be added after signing
+        if self.accept is not None:
+            self.headers["Accept"] = self.accept
+        self.signed_at = time.monotonic()
+
+    # milliseconds between the points of this turn. time to first byte is from the first add_to_stream() call
+    # until the first chunk is handed to the request body
+    def get_timings(self):
+        def elapsed(start, end):
+            if start in self.timings and end in self.timings:
+                return round((self.timings[end] - self.timings[start]) * 1000, 3)
+            return None
+
+        return {"Prewarmed": self.prewarmed,
+                "TimeToFirstByteMs": elapsed("first_frame", "first_byte"),
+                "FirstFrameToRequestMs": elapsed("first_frame", "request_start"),
+                "StopToResponseMs": elapsed("stop", "response")}
+
+    # the response body in chunks as they arrive, the connection goes back to the pool once it has been read
+    def audio_chunks(self):
+        try:
+            for chunk in self.response.iter_content(self.lex_config["AudioChunkBytes"]):
+                yield chunk
+        finally:
+            self.response.close()
 
-    # Key derivation functions.
-    # See: http://docs.aws.amazon.com/general/latest/gr/signature-v4-examples.html#signature-v4-examples-python
-    @staticmethod
-    def __sign(key, msg):
-        return hmac.new(key, msg.encode('utf-8'), hashlib.sha256).digest()
-
-    def __get_signature_key(self, key, date_stamp, region_name, service_name):
+    def get_response(self):
 
-        k_date = self.__sign(('AWS4' + key).encode('utf-8'), date_stamp)
-        k_region = self.__sign(k_date, region_name)
-        k_service = self.__sign(k_region, service_name)
-        k_signing = self.__sign(k_service, 'aws4_request')
-        return k_signing
+        if self.rejected:
+            return {"DialogState": None, "Message": None, "Utterance": None, "LexRequestId": None, "IntentName": None,
+                    "Audio": None, "Rejected": True}
 
-    def get_response(self):
-        
         if self.response is None:
             raise Exception("Cannot normalize response as there is no response from lex yet. check if add_to_stream() has been called.")
 
         if self.response.status_code != 200:
+            self.release()
             raise Exception("Cannot normalize response as call to Lex did not end with status code 200")
         
         return {"DialogState":self.response.headers.get("x-amz-lex-dialog-state"),
                 "Message":self.response.headers.get("x-amz-lex-message"),
                 "Utterance":self.response.headers.get("x-amz-lex-input-transcript"),
                 "LexRequestId":self.response.headers.get("x-amzn-RequestId"),
-                "IntentName": self.response.headers.get("x-amz-lex-intent-name")}
+                "IntentName": self.response.headers.get("x-amz-lex-intent-name"),
+                "Audio": self.audio_chunks() if self.accept is not None else None}
+
+    # let go of a response body that is not going to be read
+    def release(self):
+        if self.accept is not None and self.response is not None:
+            self.response.close()
+
+
+class AsyncLexClientStreaming(LexClientStreaming):
+    session = None
+
+    def __init__(self, user_id, content_type=LexClientStreaming.AUDIO_CONTENT_TYPE, stage="lex", accept=None):
+        super().__init__(user_id, content_type, stage, accept)
+        self.queue = asyncio.Queue()
+        self.max_chunks = self.lex_config["StreamBufferChunks"]
+        self.high_water = max(1, self.max_chunks // 2)
+        self.writable = asyncio.Event()
+        self.writable.set()
+        self.request_task = None
+        self.audio_response = None
+
+    # aiohttp session shared by every client on the loop, set once at server start up
+    @classmethod
+    def use_session(cls, session):
+        cls.session = session
+
+    # only sign ahead of time, opening the request would hold a lex request open for the whole playback
+    def prewarm(self):
+        self.prewarmed = True
+        self.sign_headers()
+
+    # add data if stream is not closed. never blocks, callers await drain() for backpressure
+    def add_to_stream(self, data):
+        if "first_frame" not in self.timings:
+            self.timings["first_frame"] = time.monotonic()
+
+        if self.request_task is None:
+            self.request_task = asyncio.get_running_loop().create_task(self.run_async())
+
+        if self.close_stream is False and not self.crashed and not self.rejected:
+            if self.queue.qsize() >= self.max_chunks:
+                self.logger.warning("lex stream buffer full, dropping %d bytes", len(data))
+                return
+            self.queue.put_nowait(data)
+            if self.queue.qsize() >= self.high_water:
+                self.writable.clear()
+
+    # wait until lex has caught up with the data added so far
+    async def drain(self):
+        await self.writable.wait()
+
+    def is_alive(self):
+        return self.request_task is not None and not self.request_task.done()
+
+    # close the stream without waiting for the response, await stop_async() to wait for it
+    def stop(self):
+        if self.close_stream:
+            return
+        self.logger.debug("closing lex streaming client")
+        self.close_stream = True
+        self.timings["stop"] = time.monotonic()
+        self.queue.put_nowait(None)
+        self.writable.set()
+
+    async def stop_async(self):
+        self.stop()
+        if self.request_task is not None:
+            await self.request_task
+
+    # cancelling the request task cuts off the request body, or stops waiting for a slot or the response
+    def abort(self):
+        self.logger.debug("aborting lex streaming client")
+        self.aborted = True
+        self.close_stream = True
+        self.writable.set()
+        if self.request_task is not None:
+            self.request_task.cancel()
+
+    # abort() and wait for the request task to unwind, which releases its admission slot
+    async def abort_async(self):
+        self.abort()
+        if self.request_task is not None:
+            await asyncio.gather(self.request_task, return_exceptions=True)
+        self.release()
+
+    async def audio_chunks(self):
+        try:
+            async for chunk in self.audio_response.content.iter_chunked(self.lex_config["AudioChunkBytes"]):
+                yield chunk
+        finally:
+            self.audio_response.release()
+
+    def release(self):
+        if self.audio_response is not None:
+            self.audio_response.release()
+
+    # nothing is going to read the queue, callers must not wait for it in drain()
+    def reject(self):
+        super().reject()
+        self.writable.set()
+
+    async def stream_iterator_async(self):
+        while True:
+            chunk = await self.queue.get()
+            if self.queue.qsize() < self.high_water:
+                self.writable.set()
+            if chunk is None:
+                self.timings["last_byte"] = time.monotonic()
+                return
+            if "first_byte" not in self.timings:
+                self.timings["first_byte"] = time.monotonic()
+            if self.content_type == LexClientStreaming.TEXT_CONTENT_TYPE:
+                yield str.encode(chunk)
+            else:
+                yield chunk
+
+    async def run_async(self):
+        try:
+            await self.__run_async()
+        except Exception as e:
+            self.logger.exception(e)
+            self.crashed = True
+            self.writable.set()
+
+    async def __run_async(self):
+        if self.headers is None or time.monotonic() - self.signed_at > self.lex_config["MaxPresignAgeInSecs"]:
+            self.sign_headers()
+
+        # the data added meanwhile stays in the queue, drain() holds the caller back once it fills up
+        if not await self.admission.acquire_lex_async():
+            self.reject()
+            return
+        try:
+            self.logger.debug("Calling Lex to stream data, endpoint: %s", self.endpoint)
+            self.timings["request_start"] = time.monotonic()
+            response = await self.session.post(self.endpoint + self.template.canonical_uri,
+                                               data=self.stream_iterator_async(), headers=self.headers)
+            # with accept the body is left on the connection for audio_chunks() to read
+            if self.accept is None:
+                await response.read()
+                response.release()
+        finally:
+            self.admission.release_lex()
+        self.audio_response = response
+        self.response = LexResponse(response.status, response.headers)
+        self.timings["response"] = time.monotonic()
+        self.logger.info("Lex response headers %s ", self.response.headers)
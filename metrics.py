@@ -0,0 +1,305 @@
+"""
+This module contains the per-turn timing spans and their histograms, served on /metrics
+
+A turn is traced through points in time, recorded once each:
+
+    first_voiced_frame  - the first frame streamed to Lex (voice detected)
+    lex_request_open    - the Lex request started
+    lex_first_byte      - the first audio handed to the request body
+    silence_declared    - the end of the utterance, the Lex stream is closed
+    lex_last_byte       - the request body has been sent
+    lex_response        - the Lex response headers arrived
+    twilio_update_sent  - the call update has been sent to Twilio
+    updatecall_fetched  - Twilio fetched the TwiML from /updatecall
+    first_audio_sent    - the first media message of the answer (PLAYBACK_MODE=stream)
+
+The Lex points are taken from the timings LexClientStreaming keeps anyway,
+once the response is there. A span is observed into its histogram as soon as
+both of its points are known, e.g. silence_to_update when the update has
+been sent. Durations that are not between two points (twiml_persist,
+twilio_update, updatecall_pop) are observed directly.
+
+Calls are sampled with METRICS_SAMPLE_RATE (1.0 traces every call, 0 turns
+tracing off). Nothing is recorded per media frame; an untraced call gets
+NULL_TRACE, whose methods do nothing. The spans of the last
+METRICS_RECENT_TURNS traced turns, tagged with CallSid and turn number, are
+kept for /debug/traces. /metrics renders the histograms in the Prometheus
+text format. The histograms and counters live in a WorkerTable (see
+workers.py), so with several workers /metrics sums those of all of them and
+stays the same whichever worker a scrape lands on; /debug/traces shows the
+worker that answers it.
+"""
+
+import collections
+import logging
+import os
+import random
+import threading
+import time
+
+from workers import WorkerTable, worker_config, worker_index
+
+# upper bounds of the histogram buckets in seconds, the last bucket is +Inf
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# span name, start point, end point
+SPANS = (
+    ("utterance", "first_voiced_frame", "silence_declared"),
+    ("lex_request_open", "first_voiced_frame", "lex_request_open"),
+    ("lex_first_byte", "first_voiced_frame", "lex_first_byte"),
+    ("lex_last_byte", "silence_declared", "lex_last_byte"),
+    ("lex_response", "lex_last_byte", "lex_response"),
+    ("silence_to_response", "silence_declared", "lex_response"),
+    ("silence_to_update", "silence_declared", "twilio_update_sent"),
+    ("update_to_fetch", "twilio_update_sent", "updatecall_fetched"),
+    ("silence_to_first_audio", "silence_declared", "first_audio_sent")
+)
+
+# spans measured directly rather than between two points
+DURATIONS = ("twiml_persist", "twilio_update", "updatecall_pop")
+
+HISTOGRAMS = [span for span, _, _ in SPANS] + list(DURATIONS)
+
+COUNTERS = ("CallsTraced", "CallsNotSampled", "TurnsTraced")
+
+# LexClientStreaming timings and the points they stand for
+LEX_TIMINGS = (
+    ("first_frame", "first_voiced_frame"),
+    ("request_start", "lex_request_open"),
+    ("first_byte", "lex_first_byte"),
+    ("stop", "silence_declared"),
+    ("last_byte", "lex_last_byte"),
+    ("response", "lex_response")
+)
+
+
+class Histogram:
+    # values are the count of each bucket then the sum, a slice of a WorkerTable row. the count is the buckets' total,
+    # so it always matches the +Inf bucket
+    def __init__(self, values, buckets=BUCKETS):
+        self.buckets = buckets
+        self.values = values
+
+    @staticmethod
+    def width(buckets=BUCKETS):
+        return len(buckets) + 2
+
+    @property
+    def count(self):
+        return int(sum(self.values[:-1]))
+
+    @property
+    def sum(self):
+        return self.values[-1]
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index = index + 1
+        self.values[index] = self.values[index] + 1
+        self.values[-1] = self.values[-1] + value
+
+    # cumulative counts per upper bound, as in the prometheus format
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(list(self.buckets) + [float("inf")], self.values[:-1]):
+            total = total + int(count)
+            yield bound, total
+
+
+class CallTrace:
+    """The points and spans of the current turn of one traced call"""
+
+    def __init__(self, metrics, call_sid):
+        self.metrics = metrics
+        self.call_sid = call_sid
+        self.turn = 0
+        self.points = {}
+        self.spans = {}
+
+    # start the next turn, keeping the spans of this one for /debug/traces
+    def next_turn(self):
+        with self.metrics.lock:
+            self.metrics.keep(self)
+            self.turn = self.turn + 1
+            self.points = {}
+            self.spans = {}
+
+    # record a point of the current turn, at time.monotonic() unless given. a point already recorded is kept
+    def mark(self, point, at=None):
+        with self.metrics.lock:
+            self.add_point(point, time.monotonic() if at is None else at)
+
+    # the points LexClientStreaming recorded in its timings
+    def lex_timings(self, timings):
+        with self.metrics.lock:
+            for timing, point in LEX_TIMINGS:
+                if timing in timings:
+                    self.add_point(point, timings[timing])
+
+    def duration(self, span, secs):
+        with self.metrics.lock:
+            self.spans[span] = secs
+            self.metrics.observe(span, secs)
+
+    # the caller holds the lock
+    def add_point(self, point, at):
+        if point in self.points:
+            return
+        self.points[point] = at
+        for span, start, end in SPANS:
+            if point in (start, end) and start in self.points and end in self.points and span not in self.spans:
+                # points can come in out of order: a prewarmed lex request is opened before the first frame, and twilio
+                # can fetch /updatecall before the response to the update has been read
+                secs = max(0.0, self.points[end] - self.points[start])
+                self.spans[span] = secs
+                self.metrics.observe(span, secs)
+
+    def end(self):
+        self.metrics.end_call(self)
+
+
+class NullCallTrace:
+    """Stands in for the CallTrace of a call that is not sampled"""
+    call_sid = None
+    turn = 0
+
+    def next_turn(self):
+        pass
+
+    def mark(self, point, at=None):
+        pass
+
+    def lex_timings(self, timings):
+        pass
+
+    def duration(self, span, secs):
+        pass
+
+    def end(self):
+        pass
+
+
+NULL_TRACE = NullCallTrace()
+
+
+class TurnMetrics:
+    metrics_config = {
+        "SampleRate": float(os.environ.get('METRICS_SAMPLE_RATE', 1.0)),
+        "RecentTurns": int(os.environ.get('METRICS_RECENT_TURNS', 100))
+    }
+
+    # the histograms then the counters of every worker. mapped when the server is imported, before the workers fork
+    WIDTH = len(HISTOGRAMS) * Histogram.width() + len(COUNTERS)
+    table = WorkerTable(worker_config["Workers"], WIDTH)
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    # a table of its own unless given one
+    def __init__(self, sample_rate, recent_turns, table=None, worker=None):
+        self.logger = logging.getLogger(__name__)
+        self.sample_rate = sample_rate
+        self.lock = threading.Lock()
+        self.table = WorkerTable(1, self.WIDTH) if table is None else table
+        self.values = self.table.row(worker)
+        self.histograms = self.histograms_of(self.values)
+        self.counters = self.values[len(HISTOGRAMS) * Histogram.width():]
+        self.calls = {}
+        self.recent = collections.deque(maxlen=recent_turns)
+
+    @classmethod
+    def shared(cls):
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls(cls.metrics_config["SampleRate"], cls.metrics_config["RecentTurns"],
+                                      cls.table, worker_index())
+        return cls._shared
+
+    @staticmethod
+    def histograms_of(values):
+        width = Histogram.width()
+        histograms = collections.OrderedDict()
+        for index, span in enumerate(HISTOGRAMS):
+            histograms[span] = Histogram(values[index * width:(index + 1) * width])
+        return histograms
+
+    # the caller holds the lock
+    def count(self, name):
+        index = COUNTERS.index(name)
+        self.counters[index] = self.counters[index] + 1
+
+    @staticmethod
+    def counter(counters, name):
+        return int(counters[COUNTERS.index(name)])
+
+    # the trace of a new call, NULL_TRACE if the call is not sampled
+    def start_call(self, call_sid):
+        with self.lock:
+            if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+                self.count("CallsNotSampled")
+                return NULL_TRACE
+            self.count("CallsTraced")
+            trace = self.calls[call_sid] = CallTrace(self, call_sid)
+        return trace
+
+    # points and durations recorded away from the call's media loop, e.g. by the call update dispatcher
+    def mark(self, call_sid, point):
+        trace = self.call(call_sid)
+        if trace is not None:
+            trace.mark(point)
+
+    def duration(self, call_sid, span, secs):
+        trace = self.call(call_sid)
+        if trace is not None:
+            trace.duration(span, secs)
+
+    # the trace of a call in progress, None if it is not traced. the trace takes the lock again to record
+    def call(self, call_sid):
+        with self.lock:
+            return self.calls.get(call_sid)
+
+    def end_call(self, trace):
+        with self.lock:
+            self.keep(trace)
+            if self.calls.get(trace.call_sid) is trace:
+                del self.calls[trace.call_sid]
+
+    # the caller holds the lock
+    def observe(self, span, secs):
+        self.histograms[span].observe(secs)
+
+    # the caller holds the lock
+    def keep(self, trace):
+        if not trace.spans:
+            return
+        self.count("TurnsTraced")
+        spans = {span: round(secs * 1000, 3) for span, secs in trace.spans.items()}
+        self.recent.append({"CallSid": trace.call_sid, "Turn": trace.turn, "SpansMs": spans})
+        self.logger.info("turn {0} of call {1}: {2}".format(trace.turn, trace.call_sid, spans))
+
+    def traces(self):
+        with self.lock:
+            return {"SampleRate": self.sample_rate,
+                    "ActiveCalls": len(self.calls),
+                    "Counters": {name: self.counter(self.counters, name) for name in COUNTERS},
+                    "Recent": list(self.recent)}
+
+    # the histograms of all the workers in the prometheus text exposition format
+    def render(self):
+        lines = ["# HELP lex_twilio_span_seconds Time between the points of a turn, see metrics.py",
+                 "# TYPE lex_twilio_span_seconds histogram"]
+        totals = self.table.totals()
+        counters = totals[len(HISTOGRAMS) * Histogram.width():]
+        for span, histogram in self.histograms_of(totals).items():
+            for bound, count in histogram.cumulative():
+                lines.append('lex_twilio_span_seconds_bucket{{span="{0}",le="{1}"}} {2}'.format(
+                    span, "+Inf" if bound == float("inf") else repr(bound), count))
+            lines.append('lex_twilio_span_seconds_sum{{span="{0}"}} {1!r}'.format(span, histogram.sum))
+            lines.append('lex_twilio_span_seconds_count{{span="{0}"}} {1}'.format(span, histogram.count))
+        lines.append("# TYPE lex_twilio_calls_traced_total counter")
+        lines.append("lex_twilio_calls_traced_total {0}".format(self.counter(counters, "CallsTraced")))
+        lines.append("# TYPE lex_twilio_turns_traced_total counter")
+        lines.append("lex_twilio_turns_traced_total {0}".format(self.counter(counters, "TurnsTraced")))
+        return "\n".join(lines) + "\n"
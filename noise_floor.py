@@ -0,0 +1,88 @@
+"""
+This module contains the per-call noise floor estimate behind adaptive voice thresholds
+
+With fixed thresholds (VoiceThreshold, SilenceThreshold) a line whose
+background noise is louder than the threshold, e.g. a speakerphone, looks
+voiced all the time: the utterance never ends and Lex gets audio until it
+times out. A quiet line or a soft talker stays below it and the start of an
+utterance is missed.
+
+NoiseFloor estimates the background energy of a call with minimum statistics:
+the lowest frame energy over the last WindowSecs, kept as the minima of a few
+blocks of that window so each frame costs a comparison. Speech has pauses
+between syllables and words that reach down to the noise, steady noise does
+not, so the minimum follows the noise and not the voice. The estimate follows
+a drop at once and a rise at most RiseDbPerSec, so a long stretch of speech
+without a pause only moves it a little. The first frame of a call is taken
+as the floor whatever it is: callers rarely speak right away, and starting
+from a guess would make a loud line look voiced until the floor caught up.
+
+The thresholds are the floor times OnsetRatio (to start an utterance) and
+OffsetRatio (to stay in one), kept between MinThreshold and MaxThreshold.
+One NoiseFloor lives for a whole call and is handed to the
+VoiceAndSilenceDetectingLexClient of every turn, so later turns start from
+what was learnt on the earlier ones.
+
+Adaptive thresholds are used with VAD_ADAPTIVE_THRESHOLDS=true, see
+VoiceAndSilenceDetectingLexClient.call_noise_floor().
+"""
+
+import collections
+import os
+
+noise_floor_config = {
+    # floor until the first frame has been seen
+    "InitialFloor": float(os.environ.get('VAD_NOISE_FLOOR_INITIAL', 150)),
+    "OnsetRatio": float(os.environ.get('VAD_ONSET_RATIO', 3.0)),
+    "OffsetRatio": float(os.environ.get('VAD_OFFSET_RATIO', 2.5)),
+    "MinThreshold": float(os.environ.get('VAD_MIN_THRESHOLD', 150)),
+    "MaxThreshold": float(os.environ.get('VAD_MAX_THRESHOLD', 6000)),
+    "WindowSecs": float(os.environ.get('VAD_NOISE_WINDOW_SECS', 0.5)),
+    "RiseDbPerSec": float(os.environ.get('VAD_NOISE_RISE_DB_PER_SEC', 10.0))
+}
+
+
+class NoiseFloor:
+    # the window is kept as the minima of this many blocks
+    BLOCKS = 4
+
+    def __init__(self, sample_rate, config=noise_floor_config):
+        self.onset_ratio = config["OnsetRatio"]
+        self.offset_ratio = config["OffsetRatio"]
+        self.min_threshold = config["MinThreshold"]
+        self.max_threshold = config["MaxThreshold"]
+        self.block_samples_needed = max(1, int(round(config["WindowSecs"] * sample_rate / self.BLOCKS)))
+        # the most the floor may rise from one block to the next
+        self.block_rise = 10 ** (config["RiseDbPerSec"] * config["WindowSecs"] / self.BLOCKS / 20.0)
+        self.block_minima = collections.deque(maxlen=self.BLOCKS)
+        self.block_min = None
+        self.block_samples = 0
+        self.floor = None
+        self.onset_threshold = None
+        self.offset_threshold = None
+        self.set_floor(config["InitialFloor"])
+
+    # feed the energy of one frame of sample_count samples
+    def update(self, rms, sample_count):
+        if not self.block_minima and self.block_min is None:
+            # the call's first frame. if it was speech, the floor drops to the noise at the first pause
+            self.set_floor(rms)
+        elif rms < self.floor:
+            self.set_floor(rms)
+        if self.block_min is None or rms < self.block_min:
+            self.block_min = rms
+        self.block_samples = self.block_samples + sample_count
+        if self.block_samples < self.block_samples_needed:
+            return
+        self.block_minima.append(self.block_min)
+        self.block_min = None
+        self.block_samples = 0
+        window_min = min(self.block_minima)
+        if window_min > self.floor:
+            self.set_floor(min(window_min, self.floor * self.block_rise))
+
+    def set_floor(self, floor):
+        # never 0, it could not rise from there
+        self.floor = max(float(floor), 1.0)
+        self.onset_threshold = min(max(self.floor * self.onset_ratio, self.min_threshold), self.max_threshold)
+        self.offset_threshold = min(max(self.floor * self.offset_ratio, self.min_threshold), self.max_threshold)
@@ -0,0 +1,240 @@
+"""
+This module contains the playback of Lex audio over a bidirectional Twilio media stream
+
+With PLAYBACK_MODE=stream the call is connected to the media stream with
+<Connect><Stream> (templates/connect_stream.xml) instead of <Start><Stream>,
+and Lex is asked for audio (Accept: audio/pcm, 16 kHz 16-bit linear). The
+audio is converted to 8 kHz mu-law chunk by chunk as the response body
+arrives and sent back over the WebSocket as 20 ms media messages, followed by
+a mark once the body has been read; Twilio buffers it, plays it out and echoes the
+mark once it has been played. When voice is detected while a prompt is still
+playing, a clear message makes Twilio drop the rest of it: the caller can
+barge in instead of sitting through the whole prompt, and no call redirect is
+needed for a turn.
+
+MediaStreamPlayback tracks one call's prompts and builds the messages; the
+servers send them. PlaybackMetrics keeps process-wide totals, including the
+prompt time saved by barge-in and the time from the Lex response to the first
+audio frame sent, available on /debug/playback.
+
+Lex (V1) has no mu-law output, so the PCM is converted here. LEX_AUDIO_ACCEPT
+and LEX_AUDIO_RATE can point at an 8 kHz PCM format where Lex offers one,
+which skips the resampling.
+"""
+
+import base64
+import json
+import os
+import threading
+import time
+
+try:
+    import audioop
+except ImportError:
+    audioop = None
+
+from vad_engines import NUMPY_AVAILABLE, import_numpy
+
+REDIRECT = "redirect"
+STREAM = "stream"
+PLAYBACK_MODE = os.environ.get('PLAYBACK_MODE', REDIRECT)
+
+LEX_AUDIO_ACCEPT = os.environ.get('LEX_AUDIO_ACCEPT', 'audio/pcm')
+LEX_AUDIO_RATE = int(os.environ.get('LEX_AUDIO_RATE', 16000))
+TWILIO_RATE = 8000
+# twilio media frames are 20 ms of 8 kHz mu-law
+FRAME_BYTES = 160
+# mu-law code of a zero sample
+ULAW_SILENCE = b"\xff"
+
+ULAW_BIAS = 0x84
+ULAW_CLIP = 8159
+ULAW_SEGMENT_ENDS = (0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF)
+
+
+# 14-bit linear (a 16-bit sample >> 2) to G.711 mu-law, identical to audioop.lin2ulaw(data, 2)
+def linear14_to_ulaw(sample):
+    if sample < 0:
+        sample = -sample
+        mask = 0x7F
+    else:
+        mask = 0xFF
+    sample = min(sample, ULAW_CLIP) + (ULAW_BIAS >> 2)
+    segment = 0
+    while segment < 8 and sample > ULAW_SEGMENT_ENDS[segment]:
+        segment = segment + 1
+    if segment >= 8:
+        return 0x7F ^ mask
+    return ((segment << 4) | ((sample >> (segment + 1)) & 0xF)) ^ mask
+
+
+# indexed by the 14-bit sample as an unsigned value, (sample16 >> 2) & 0x3fff
+ULAW_ENCODE_TABLE = bytes(linear14_to_ulaw(index - 0x4000 if index & 0x2000 else index) for index in range(0x4000))
+
+
+# 16-bit little-endian linear pcm at rate to 8 kHz mu-law. state carries the resampler state between chunks
+def pcm_to_ulaw(pcm_data, rate=LEX_AUDIO_RATE, state=None):
+    if audioop is not None:
+        if rate != TWILIO_RATE:
+            pcm_data, state = audioop.ratecv(pcm_data, 2, 1, rate, TWILIO_RATE, state)
+        return audioop.lin2ulaw(pcm_data, 2), state
+    step = rate // TWILIO_RATE
+    if NUMPY_AVAILABLE:
+        numpy = import_numpy()
+        samples = numpy.frombuffer(pcm_data[:len(pcm_data) // (2 * step) * 2 * step], dtype="<i2")
+        if step > 1:
+            samples = samples.reshape(-1, step).astype(numpy.int32).sum(axis=1) // step
+        return numpy.frombuffer(ULAW_ENCODE_TABLE, dtype=numpy.uint8)[(samples >> 2) & 0x3fff].tobytes(), state
+    samples = memoryview(pcm_data[:len(pcm_data) // 2 * 2]).cast("h")
+    return bytes(ULAW_ENCODE_TABLE[(sum(samples[index:index + step]) // step >> 2) & 0x3fff]
+                 for index in range(0, len(samples) - step + 1, step)), state
+
+
+class UlawFramer:
+    """Converts pcm chunks of any size to 20 ms mu-law frames, carrying partial samples and frames over"""
+
+    def __init__(self, rate=LEX_AUDIO_RATE):
+        self.rate = rate
+        # bytes per output sample, so the fallback converters always see whole resampling steps
+        self.step_bytes = 2 * max(1, rate // TWILIO_RATE)
+        self.state = None
+        self.pcm_remainder = b""
+        self.ulaw_remainder = b""
+
+    def feed(self, pcm_chunk):
+        pcm_data = self.pcm_remainder + pcm_chunk
+        usable = len(pcm_data) // self.step_bytes * self.step_bytes
+        self.pcm_remainder = pcm_data[usable:]
+        ulaw_data, self.state = pcm_to_ulaw(pcm_data[:usable], self.rate, self.state)
+        ulaw_data = self.ulaw_remainder + ulaw_data
+        whole = len(ulaw_data) // FRAME_BYTES * FRAME_BYTES
+        self.ulaw_remainder = ulaw_data[whole:]
+        return [ulaw_data[offset:offset + FRAME_BYTES] for offset in range(0, whole, FRAME_BYTES)]
+
+    # the last, partial frame, padded with silence to 20 ms. a lone odd byte of pcm is dropped
+    def flush(self):
+        frames = [self.ulaw_remainder.ljust(FRAME_BYTES, ULAW_SILENCE)] if self.ulaw_remainder else []
+        self.ulaw_remainder = b""
+        return frames
+
+
+class PlaybackMetrics:
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {"Calls": 0, "Prompts": 0, "BargeIns": 0}
+        self.prompt_secs = 0.0
+        self.saved_secs = 0.0
+        self.first_audio_secs = 0.0
+
+    @classmethod
+    def shared(cls):
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls()
+        return cls._shared
+
+    def record_call(self, call_stats):
+        with self.lock:
+            self.counters["Calls"] = self.counters["Calls"] + 1
+            self.counters["Prompts"] = self.counters["Prompts"] + call_stats["Prompts"]
+            self.counters["BargeIns"] = self.counters["BargeIns"] + call_stats["BargeIns"]
+            self.prompt_secs = self.prompt_secs + call_stats["PromptSecs"]
+            self.saved_secs = self.saved_secs + call_stats["SavedSecs"]
+            self.first_audio_secs = self.first_audio_secs + call_stats["FirstAudioSecs"]
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats.update({"Mode": PLAYBACK_MODE,
+                          "PromptSecs": round(self.prompt_secs, 3),
+                          "SavedSecs": round(self.saved_secs, 3),
+                          "SavedSecsPerCall": round(self.saved_secs / stats["Calls"], 3) if stats["Calls"] else 0.0,
+                          "SavedRatio": round(self.saved_secs / self.prompt_secs, 3) if self.prompt_secs else 0.0,
+                          "MeanTimeToFirstAudioMs": round(self.first_audio_secs / stats["Prompts"] * 1000, 3) if stats["Prompts"] else None})
+        return stats
+
+
+class MediaStreamPlayback:
+    HANGUP_MARK = "hangup"
+
+    def __init__(self, stream_sid, metrics=None):
+        self.stream_sid = stream_sid
+        self.metrics = metrics or PlaybackMetrics.shared()
+        self.prompts = 0
+        self.barge_ins = 0
+        self.prompt_secs = 0.0
+        self.saved_secs = 0.0
+        self.first_audio_secs = 0.0
+        self.playing = None
+        self.started_at = None
+        self.first_audio_at = None
+        self.duration_secs = 0.0
+        self.framer = None
+        self.recorded = False
+
+    # start a prompt, its audio is added with feed() as it arrives. with hang_up the call ends once it has been played
+    def start(self, hang_up=False):
+        self.prompts = self.prompts + 1
+        self.playing = "{0}-{1}".format(self.HANGUP_MARK if hang_up else "prompt", self.prompts)
+        self.started_at = time.monotonic()
+        self.first_audio_at = None
+        self.duration_secs = 0.0
+        self.framer = UlawFramer()
+
+    # media messages for the next chunk of lex pcm, in 20 ms frames
+    def feed(self, pcm_chunk):
+        return self.media_messages(self.framer.feed(pcm_chunk))
+
+    # media messages for the rest of the audio, followed by a mark named after the prompt
+    def finish(self):
+        messages = self.media_messages(self.framer.flush())
+        messages.append(json.dumps({"event": "mark", "streamSid": self.stream_sid, "mark": {"name": self.playing}}))
+        return messages
+
+    def media_messages(self, ulaw_frames):
+        if ulaw_frames and self.first_audio_at is None:
+            self.first_audio_at = time.monotonic()
+            self.first_audio_secs = self.first_audio_secs + self.first_audio_at - self.started_at
+        audio_secs = sum(len(ulaw_frame) for ulaw_frame in ulaw_frames) / float(TWILIO_RATE)
+        self.duration_secs = self.duration_secs + audio_secs
+        self.prompt_secs = self.prompt_secs + audio_secs
+        return [self.media_message(ulaw_frame) for ulaw_frame in ulaw_frames]
+
+    def media_message(self, ulaw_frame):
+        return json.dumps({"event": "media", "streamSid": self.stream_sid,
+                           "media": {"payload": base64.b64encode(ulaw_frame).decode("ascii")}})
+
+    # the clear message stopping the prompt being played, None if nothing is playing
+    def barge_in(self):
+        if self.playing is None:
+            return None
+        played_secs = time.monotonic() - (self.first_audio_at or self.started_at)
+        self.saved_secs = self.saved_secs + max(0.0, self.duration_secs - played_secs)
+        self.barge_ins = self.barge_ins + 1
+        self.playing = None
+        return json.dumps({"event": "clear", "streamSid": self.stream_sid})
+
+    # twilio echoes a mark once the audio before it has been played (or cleared). returns True when that was the
+    # last prompt of the call
+    def mark_received(self, message):
+        name = message.get("mark", {}).get("name", "")
+        if name == self.playing:
+            self.playing = None
+        return name.startswith(self.HANGUP_MARK)
+
+    def stats(self):
+        return {"Prompts": self.prompts,
+                "BargeIns": self.barge_ins,
+                "PromptSecs": round(self.prompt_secs, 3),
+                "SavedSecs": round(self.saved_secs, 3),
+                "FirstAudioSecs": round(self.first_audio_secs, 6)}
+
+    # add this call to the process-wide totals, once
+    def record(self):
+        if not self.recorded:
+            self.recorded = True
+            self.metrics.record_call(self.stats())
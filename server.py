@@ -1,76 +1,175 @@
+# gevent has to patch the standard library before anything else imports it. unpatched, a call blocking on a
+# socket (reading the lex audio for playback, waiting for lex) or on a lock stops every other call in the process
+from gevent import monkey
+monkey.patch_all()
+
 from flask import Flask, render_template, request, render_template_string, jsonify
 from flask_sockets import Sockets
+from geventwebsocket.exceptions import WebSocketError
+from werkzeug.routing import Rule
 
 import os
 import json
 import uuid
 import logging
+import struct
 import threading
-from twilio.twiml.voice_response import VoiceResponse
-from twilio.rest import Client
+import time
+from twilio_call import TwilioCall, build_twiml, fallback_twiml, is_goodbye
+from playback import LEX_AUDIO_ACCEPT, PLAYBACK_MODE, STREAM, MediaStreamPlayback, PlaybackMetrics
+from twiml_store import shared_store
+from http_session_pool import HttpSessionPool
+from media_frames import media_payload
+from metrics import NULL_TRACE, TurnMetrics
+from call_updates import CallUpdateDispatcher
+from vad_diagnostics import VadDiagnostics
 from voice_and_silence_detecting_lex_wrapper import VoiceAndSilenceDetectingLexClient
+from workers import WorkerStats, reuse_port_socket, run_workers, worker_config
+from admission import WS_TRY_AGAIN_LATER, AdmissionControl, busy_twiml, retry_twiml
+from warm_up import Readiness, warm_up, warm_up_steps
 
 HTTP_SERVER_PORT = int(os.environ.get('CONTAINER_PORT'))
 
 app = Flask(__name__)
 sockets = Sockets(app)
 
-updated_twimls = {}
-
 def log(msg, *args):
     print("Media WS: ", msg, *args)
 
+# liveness, with the load shedding signal for whoever is watching (see admission.py)
 @app.route("/ping")
 def healthCheckResponse():
-    return jsonify({"message" : "echo...health check...."})
+    admission = AdmissionControl.shared()
+    return jsonify({"message" : "echo...health check....",
+                    "Shedding": admission.shedding(),
+                    "Load": round(admission.load(), 3)})
+
+# 503 until the warm-up is done and again while draining, see warm_up.py. /ping only says the process is alive
+@app.route("/ready")
+def readinessResponse():
+    readiness = Readiness.shared()
+    return jsonify(readiness.snapshot()), 200 if readiness.is_ready() else 503
+
+@app.route("/metrics")
+def metricsResponse():
+    return TurnMetrics.shared().render() + AdmissionControl.shared().render(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+@app.route("/debug/traces")
+def tracesResponse():
+    return jsonify(TurnMetrics.shared().traces())
+
+@app.route("/debug/vad")
+def vadDiagnosticsResponse():
+    return jsonify(VadDiagnostics.shared().snapshot())
+
+@app.route("/debug/twiml")
+def twimlStoreResponse():
+    return jsonify(shared_store().stats())
+
+@app.route("/debug/lex")
+def lexPoolResponse():
+    return jsonify(HttpSessionPool.shared().stats())
+
+@app.route("/debug/twilio")
+def callUpdatesResponse():
+    stats = CallUpdateDispatcher.shared().stats()
+    stats["ConnectionPool"] = TwilioCall.pool_stats.snapshot()
+    return jsonify(stats)
+
+@app.route("/debug/playback")
+def playbackResponse():
+    return jsonify(PlaybackMetrics.shared().snapshot())
+
+@app.route("/debug/worker")
+def workerResponse():
+    return jsonify(WorkerStats.shared().snapshot())
+
+@app.route("/debug/admission")
+def admissionResponse():
+    return jsonify(AdmissionControl.shared().snapshot())
 
 @app.route('/updatecall', methods=['POST'])
 def returnTwimlForCallSid():
     request_object = request.form.to_dict()
-    response = updated_twimls[request_object["CallSid"]]
+    TurnMetrics.shared().mark(request_object["CallSid"], "updatecall_fetched")
+    started = time.monotonic()
+    response = shared_store().pop(request_object["CallSid"])
+    TurnMetrics.shared().duration(request_object["CallSid"], "updatecall_pop", time.monotonic() - started)
 
-    updated_twimls.pop(request_object["CallSid"])
+    if response is None:
+        logging.getLogger(__name__).warning("no TwiML stored for call {0}".format(request_object["CallSid"]))
+        return fallback_twiml()
     return response
 
 @app.route('/twiml', methods=['POST'])
 def return_twiml():
     print("POST TwiML")
+    if not AdmissionControl.shared().admit_twiml():
+        return busy_twiml(), 200, {"Content-Type": "text/xml"}
+    # a bidirectional stream needs <Connect><Stream>, the call stays on it until the websocket is closed
+    if PLAYBACK_MODE == STREAM:
+        return render_template('connect_stream.xml')
     return render_template('streams.xml')
 
-@sockets.route('/')
 def echo(ws):
     print("Connection accepted")
+    admission = AdmissionControl.shared()
+    if not admission.admit_call():
+        reject_call(ws)
+        return
     client_data_processor = TwilioDataProcessor(ws)
-    client_data_processor.start()
+    try:
+        client_data_processor.start()
+    finally:
+        admission.call_ended()
 
-class TwilioCall:
-    AUTH_TOKEN = os.environ.get('TWILIO_AUTH_TOKEN')
-    SERVICE_DNS = os.environ.get('URL')
-    
-    def __init__(self, account_sid, call_sid):
-        self.account_sid = account_sid
-        self.auth_token = self.AUTH_TOKEN
-        self.service_dns = self.SERVICE_DNS
-        self.call_sid = call_sid
+# werkzeug 2 and later only match a websocket request to a rule marked as one, which Sockets.route() cannot do
+sockets.url_map.add(Rule('/', endpoint=echo, websocket=True))
 
-    def update(self):
-        update_url = "{0}/{1}".format(self.service_dns, "updatecall")
-        rest_client = Client(self.account_sid, self.auth_token)
-        rest_client.calls(self.call_sid).update(method="POST", url=update_url)
-
-    def persist(self, response):
-        updated_twimls[self.call_sid] = response
+# a stream over the call limit: the call is updated to the busy TwiML, which hangs up, and the stream is closed
+def reject_call(ws):
+    while not ws.closed:
+        message = ws.receive()
+        if message is None:
+            break
+        data = json.loads(message)
+        if data['event'] == "start":
+            twilio_call = TwilioCall(data["start"]["accountSid"], data["start"]["callSid"])
+            twilio_call.persist(busy_twiml())
+            CallUpdateDispatcher.shared().submit(twilio_call)
+            break
+    close_with_code(ws, WS_TRY_AGAIN_LATER)
 
+# gevent-websocket's close() ignores code and sends the message through str(), so a status code cannot be passed to
+# it. the close frame is sent here instead, and the websocket marked closed so that close() is not called after it
+def close_with_code(ws, code):
+    if ws.closed:
+        return
+    try:
+        ws.send_frame(struct.pack('!H', code), ws.OPCODE_CLOSE)
+    except WebSocketError:
+        logging.getLogger(__name__).debug("could not send the close frame, the connection is gone")
+    finally:
+        ws.closed = True
 
 class TwilioDataProcessor:
+    # prepare the next turn's lex stream while the current prompt is still being played back
+    PREWARM_LEX_STREAM = os.environ.get('LEX_PREWARM', 'false').lower() == 'true'
+
     def __init__(self, ws):
         self.logger = logging.getLogger(__name__)
         self.ws = ws
         raw_id = str(uuid.uuid4())
         self.user_id = raw_id[0:24].replace("-", "").upper()
-        self.lex_streaming_client = VoiceAndSilenceDetectingLexClient(self.user_id, [self], [self])
+        # with stream playback lex answers with audio, which is played back over this websocket
+        self.accept = LEX_AUDIO_ACCEPT if PLAYBACK_MODE == STREAM else None
+        # carried from turn to turn, with adaptive thresholds
+        self.noise_floor = VoiceAndSilenceDetectingLexClient.call_noise_floor()
+        self.lex_streaming_client = VoiceAndSilenceDetectingLexClient(self.user_id, [self], [self], self.PREWARM_LEX_STREAM, self.accept, self.noise_floor)
         self.listen_switch = threading.Event()
         self.twilio_call = None
+        self.trace = NULL_TRACE
+        self.playback = None
 
     def start(self):
         try:
@@ -81,6 +180,12 @@ class TwilioDataProcessor:
                         print('No message')
                         break
 
+                    # media frames skip the json decoder
+                    payload = media_payload(message)
+                    if payload is not None:
+                        self.lex_streaming_client.stream_to_lex(payload)
+                        continue
+
                     data = json.loads(message)
                     if data['event'] == "connected":
                         log("Connected Message received", message)
@@ -88,22 +193,36 @@ class TwilioDataProcessor:
                         log("Start Message received", message)
                         print("Media WS: received media and metadata: " + str(data))
                         self.twilio_call = TwilioCall(data["start"]["accountSid"], data["start"]["callSid"])
+                        self.trace = TurnMetrics.shared().start_call(data["start"]["callSid"])
+                        if PLAYBACK_MODE == STREAM:
+                            self.playback = MediaStreamPlayback(data["start"]["streamSid"])
 
                     if data['event'] == "media":
                         self.lex_streaming_client.stream_to_lex(data["media"]["payload"])
+                    if data['event'] == "mark" and self.playback is not None:
+                        # the goodbye prompt has been played, closing the stream ends <Connect> and the call
+                        if self.playback.mark_received(data):
+                            self.ws.close()
+                            break
                     if data['event'] == "closed":
                         log("Closed Message received", message)
                         break
 
         except Exception as e:
             self.logger.exception(e)
+        finally:
+            self.lex_streaming_client.close()
+            self.trace.end()
+            if self.playback is not None:
+                self.playback.record()
+                self.logger.info("playback for call: {0}".format(self.playback.stats()))
 
     def pause_listening(self):
         self.listen_switch.set()
 
     def reset(self):
         self.logger.info("recreating VAD lex client")
-        self.lex_streaming_client = VoiceAndSilenceDetectingLexClient(self.user_id, [self], [self])
+        self.lex_streaming_client = VoiceAndSilenceDetectingLexClient(self.user_id, [self], [self], self.PREWARM_LEX_STREAM, self.accept, self.noise_floor)
         self.listen_switch.clear()
 
     def voice_detected(self):
@@ -115,42 +234,98 @@ class TwilioDataProcessor:
         for key, value in kwargs.items():
             self.logger.info("{0} = {1}".format(key, value))
         self.listen_switch.set()
+        self.trace.next_turn()
+        self.trace.lex_timings(self.lex_streaming_client.get_lex_timestamps())
         self.process()
         self.send_data_to_client(kwargs.get("lex_response"))
         self.listen_switch.clear()
         self.reset()
 
+    # barge-in: drop the rest of the prompt twilio is playing
     def pause_playback(self):
-        self.logger.info("if something is being played back on connection, now is the time to stop it")
-        # stop playback processing here
+        if self.playback is None:
+            return
+        clear = self.playback.barge_in()
+        if clear is not None:
+            self.logger.info("voice detected during playback, clearing the prompt")
+            self.ws.send(clear)
 
     def process(self):
         self.logger.info("processing data listened so far")
 
+    # play the lex audio back over the media stream, or
     # create a new TwiML,
-    # update the call.
+    # queue the call update, the media loop carries on while it is sent.
     def send_data_to_client(self, lex_response):
         self.logger.info("sending data to client {0}".format(lex_response))
-        response = VoiceResponse()
-        response.say(lex_response.get("Message"))
-
-        dialog_state = lex_response.get("DialogState")
-        intent_name = lex_response.get("IntentName")
-
-        if intent_name is not None and intent_name == "GoodbyeIntent" and dialog_state == "Fulfilled" :
-            # hang up the call after this
-            response.hangup()
-        else:
-            response.pause(40)
+        if lex_response.get("Rejected"):
+            self.retry_turn()
+            return
+        if self.playback is not None:
+            self.play(lex_response)
+            return
+        response = build_twiml(lex_response)
 
         self.logger.info("response is {0}".format(response))
+        started = time.monotonic()
         self.twilio_call.persist(response.to_xml())
-        self.twilio_call.update()
+        self.trace.duration("twiml_persist", time.monotonic() - started)
+        CallUpdateDispatcher.shared().submit(self.twilio_call)
 
-if __name__ == '__main__':
+    # lex had no room for the turn, ask the caller to say it again. playing back over the stream there is nothing
+    # to play, and a call update would end <Connect>, so the call just keeps listening
+    def retry_turn(self):
+        if self.playback is not None:
+            self.logger.warning("no lex request slot for the turn, listening for the caller again")
+            return
+        self.twilio_call.persist(retry_twiml())
+        CallUpdateDispatcher.shared().submit(self.twilio_call)
+
+    # send the lex audio over the media stream as it arrives from lex
+    def play(self, lex_response):
+        if lex_response.get("Audio") is None:
+            self.logger.warning("lex returned no audio, nothing to play back")
+            return
+        self.playback.start(is_goodbye(lex_response))
+        for chunk in lex_response["Audio"]:
+            for message in self.playback.feed(chunk):
+                self.ws.send(message)
+        for message in self.playback.finish():
+            self.ws.send(message)
+        if self.playback.first_audio_at is not None:
+            self.trace.mark("first_audio_sent", self.playback.first_audio_at)
+
+# run the server until SIGTERM, then wait for the active calls to end for up to the drain timeout. workers share
+# the port through SO_REUSEPORT
+def serve(worker_index):
+    import signal
+    import gevent
     from gevent import pywsgi
+    from gevent.pool import Pool
+    from gevent import socket as gevent_socket
     from geventwebsocket.handler import WebSocketHandler
 
-    server = pywsgi.WSGIServer(('', HTTP_SERVER_PORT), app, handler_class=WebSocketHandler)
-    print("Server listening on: http://localhost:" + str(HTTP_SERVER_PORT))
+    listener = ('', HTTP_SERVER_PORT)
+    if worker_index is not None:
+        listener = gevent_socket.socket(fileno=reuse_port_socket(HTTP_SERVER_PORT).detach())
+    # stop() only waits for the connections of a pool, without one it returns at once and the calls are cut off.
+    # serve_forever() stops the server again once it returns, with stop_timeout
+    server = pywsgi.WSGIServer(listener, app, handler_class=WebSocketHandler, spawn=Pool())
+    server.stop_timeout = worker_config["DrainTimeoutInSecs"]
+
+    # stop() closes the listening socket, then waits for the active connections before killing them
+    def drain():
+        stats = WorkerStats.shared()
+        stats.draining = True
+        logging.getLogger(__name__).info("draining {0} active calls".format(stats.active_calls))
+        server.stop()
+
+    gevent.signal_handler(signal.SIGTERM, lambda: gevent.spawn(drain))
+    print("Server listening on: http://localhost:{0}{1}".format(HTTP_SERVER_PORT, "" if worker_index is None else " (worker {0})".format(worker_index)))
+    # warm up once listening, so the health check sees a live process that is not ready yet
+    server.start()
+    threading.Thread(target=warm_up, args=(warm_up_steps(),), daemon=True).start()
     server.serve_forever()
+
+if __name__ == '__main__':
+    run_workers(serve)
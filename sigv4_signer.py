@@ -0,0 +1,120 @@
+"""
+This module contains AWS Signature Version 4 signing for Lex runtime requests
+
+SigV4Signer derives the signing key (four chained HMACs) once per date, region
+and service and caches it until the UTC day rolls over. RequestTemplate holds
+everything about a request that does not change between utterances (canonical
+URI, canonical headers, credential scope suffix), so signing a request is one
+SHA-256 and one HMAC. Both are safe to share between threads; use
+SigV4Signer.shared() and request_template() to get process-wide instances.
+
+See: http://docs.aws.amazon.com/general/latest/gr/sigv4_signing.html
+"""
+
+import datetime
+import functools
+import hashlib
+import hmac
+import threading
+
+
+class SigV4Signer:
+    ALGORITHM = 'AWS4-HMAC-SHA256'
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, access_key, secret_key):
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.keys = {}
+        self.lock = threading.Lock()
+        self.derivations = 0
+
+    # one signer per set of credentials, shared by every client in the process
+    @classmethod
+    def shared(cls, access_key, secret_key):
+        signer = cls._shared.get((access_key, secret_key))
+        if signer is None:
+            with cls._shared_lock:
+                signer = cls._shared.setdefault((access_key, secret_key), cls(access_key, secret_key))
+        return signer
+
+    # return the signing key for (date, region, service), deriving it only if it is not cached yet
+    def get_signing_key(self, date_stamp, region, service):
+        cache_key = (date_stamp, region, service)
+        signing_key = self.keys.get(cache_key)
+        if signing_key is not None:
+            return signing_key
+
+        with self.lock:
+            signing_key = self.keys.get(cache_key)
+            if signing_key is None:
+                signing_key = self.__derive_key(date_stamp, region, service)
+                # keys are only valid for their date, drop the ones for days that have passed
+                self.keys = {key: value for key, value in self.keys.items() if key[0] >= date_stamp}
+                self.keys[cache_key] = signing_key
+                self.derivations = self.derivations + 1
+        return signing_key
+
+    # Key derivation functions.
+    # See: http://docs.aws.amazon.com/general/latest/gr/signature-v4-examples.html#signature-v4-examples-python
+    @staticmethod
+    def __sign(key, msg):
+        return hmac.new(key, msg.encode('utf-8'), hashlib.sha256).digest()
+
+    def __derive_key(self, date_stamp, region_name, service_name):
+        k_date = self.__sign(('AWS4' + self.secret_key).encode('utf-8'), date_stamp)
+        k_region = self.__sign(k_date, region_name)
+        k_service = self.__sign(k_region, service_name)
+        k_signing = self.__sign(k_service, 'aws4_request')
+        return k_signing
+
+
+class RequestTemplate:
+    SIGNED_HEADERS = 'content-type;host;x-amz-date'
+    PAYLOAD_HASH = "UNSIGNED-PAYLOAD"
+
+    def __init__(self, host_name, canonical_uri, content_type, region, service, verb="POST"):
+        self.region = region
+        self.service = service
+        self.canonical_uri = canonical_uri
+        self.content_type = content_type
+
+        # canonical request is verb, uri, (empty) query string, canonical headers, signed headers and payload hash.
+        # only the x-amz-date header changes between requests, so everything around it is built once.
+        self.canonical_request_prefix = verb + '\n' + canonical_uri + '\n' + '\n' \
+            + 'content-type:' + content_type + '\n' + 'host:' + host_name + '\n' + 'x-amz-date:'
+        self.canonical_request_suffix = '\n' + '\n' + self.SIGNED_HEADERS + '\n' + self.PAYLOAD_HASH
+        self.scope_suffix = '/' + region + '/' + service + '/' + 'aws4_request'
+
+    # return the headers for a request sent at the given time (utc now by default)
+    def sign(self, signer, now=None):
+        t = now or datetime.datetime.utcnow()
+        amz_date = t.strftime('%Y%m%dT%H%M%SZ')  # '20170714T010101Z'
+        date_stamp = amz_date[:8]  # Date w/o time, used in credential scope '20170714'
+
+        canonical_request = self.canonical_request_prefix + amz_date + self.canonical_request_suffix
+        credential_scope = date_stamp + self.scope_suffix
+        string_to_sign = SigV4Signer.ALGORITHM + '\n' + amz_date + '\n' + credential_scope + '\n' \
+            + hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()
+
+        signing_key = signer.get_signing_key(date_stamp, self.region, self.service)
+        signature = hmac.new(signing_key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+
+        # Python note: The 'host' header is added automatically by the Python 'requests' library.
+        return {
+            'x-amz-content-sha256': self.PAYLOAD_HASH,
+            'Content-Type': self.content_type,
+            'X-Amz-Date': amz_date,
+            'Authorization': SigV4Signer.ALGORITHM + ' '
+                             + 'Credential=' + signer.access_key + '/' + credential_scope + ', '
+                             + 'SignedHeaders=' + self.SIGNED_HEADERS + ', '
+                             + 'Signature=' + signature
+        }
+
+
+# templates are cached per (host, uri, content type, region, service), i.e. per bot, alias and user
+@functools.lru_cache(maxsize=4096)
+def request_template(host_name, canonical_uri, content_type, region, service, verb="POST"):
+    return RequestTemplate(host_name, canonical_uri, content_type, region, service, verb)
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# the modules under test live at the top of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from lex_streaming_client import LexClientStreaming
+
+
+# lex settings for clients built in a test, pointing at a port nothing listens on unless Endpoint is set again
+@pytest.fixture
+def lex_config(monkeypatch):
+    for name, value in {"Region": "us-east-1", "AccessKeyId": "AKIDEXAMPLE", "SecretAccessKey": "secret",
+                        "BotName": "TestBot", "BotAlias": "test", "Endpoint": "http://127.0.0.1:1"}.items():
+        monkeypatch.setitem(LexClientStreaming.lex_config, name, value)
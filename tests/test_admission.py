@@ -0,0 +1,173 @@
+import asyncio
+import threading
+import time
+
+from admission import AdmissionControl
+from lex_streaming_client import AsyncLexClientStreaming, LexClientStreaming
+from workers import WorkerTable
+
+
+def lex_limited(max_lex_requests, queue_timeout):
+    return AdmissionControl(0, max_lex_requests, queue_timeout, 0.9, False)
+
+
+def test_acquire_lex_times_out_while_every_slot_is_taken():
+    admission = lex_limited(1, 0.05)
+    assert admission.acquire_lex()
+    started = time.monotonic()
+    assert not admission.acquire_lex()
+    assert time.monotonic() - started >= 0.05
+    snapshot = admission.snapshot()
+    assert snapshot["LexInFlight"] == 1
+    assert snapshot["LexQueued"] == 0
+    assert snapshot["Counters"]["LexQueued"] == 1
+    assert snapshot["Counters"]["LexRejected"] == 1
+
+
+def test_acquire_lex_gets_a_released_slot():
+    admission = lex_limited(1, 5)
+    assert admission.acquire_lex()
+    result = []
+    waiting = threading.Thread(target=lambda: result.append(admission.acquire_lex()))
+    waiting.start()
+    time.sleep(0.05)
+    admission.release_lex()
+    waiting.join(5)
+    assert result == [True]
+    assert admission.snapshot()["LexInFlight"] == 1
+
+
+def test_acquire_lex_async_times_out_while_every_slot_is_taken():
+    async def acquire():
+        admission = lex_limited(1, 0.05)
+        assert await admission.acquire_lex_async()
+        assert not await admission.acquire_lex_async()
+        return admission.snapshot()
+
+    snapshot = asyncio.run(acquire())
+    assert snapshot["LexInFlight"] == 1
+    assert snapshot["LexQueued"] == 0
+    assert snapshot["Counters"]["LexRejected"] == 1
+
+
+def test_a_released_slot_is_handed_to_the_longest_waiting_request():
+    async def acquire():
+        admission = lex_limited(1, 5)
+        assert await admission.acquire_lex_async()
+        first = asyncio.ensure_future(admission.acquire_lex_async())
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(admission.acquire_lex_async())
+        await asyncio.sleep(0)
+        assert admission.snapshot()["LexQueued"] == 2
+
+        # the slot goes straight to the waiting request, it is never free for a newcomer to take
+        admission.release_lex()
+        assert await first
+        assert not second.done()
+        assert admission.snapshot()["LexInFlight"] == 1
+
+        admission.release_lex()
+        assert await second
+        admission.release_lex()
+        return admission.snapshot()
+
+    snapshot = asyncio.run(acquire())
+    assert snapshot["LexInFlight"] == 0
+    assert snapshot["LexQueued"] == 0
+
+
+def test_a_slot_released_on_another_thread_is_handed_over_by_the_event_loop():
+    async def acquire():
+        admission = lex_limited(1, 5)
+        assert admission.acquire_lex()
+        waiting = asyncio.ensure_future(admission.acquire_lex_async())
+        await asyncio.sleep(0)
+        assert admission.snapshot()["LexQueued"] == 1
+
+        # released while the loop sleeps in select(), which only call_soon_threadsafe() wakes
+        threading.Timer(0.05, admission.release_lex).start()
+        started = time.monotonic()
+        assert await asyncio.wait_for(waiting, 1)
+        assert time.monotonic() - started < 0.5
+        return admission.snapshot()
+
+    snapshot = asyncio.run(acquire())
+    assert snapshot["LexInFlight"] == 1
+    assert snapshot["LexQueued"] == 0
+
+
+def test_a_slot_handed_over_after_the_wait_ended_is_passed_on():
+    async def acquire():
+        admission = lex_limited(1, 5)
+        assert admission.acquire_lex()
+        abandoned = asyncio.ensure_future(admission.acquire_lex_async())
+        await asyncio.sleep(0)
+        waiting = asyncio.ensure_future(admission.acquire_lex_async())
+        await asyncio.sleep(0)
+
+        # the first request gives up, and the loop has yet to act on it when the slot is released
+        abandoned.cancel()
+        releasing = threading.Thread(target=admission.release_lex)
+        releasing.start()
+        releasing.join(5)
+        assert await asyncio.wait_for(waiting, 1)
+        assert abandoned.cancelled()
+        admission.release_lex()
+        return admission.snapshot()
+
+    snapshot = asyncio.run(acquire())
+    assert snapshot["LexInFlight"] == 0
+    assert snapshot["LexQueued"] == 0
+
+
+def test_a_turn_without_a_lex_slot_is_answered_as_rejected(lex_config):
+    client = LexClientStreaming("TEST")
+    client.admission = lex_limited(1, 0.05)
+    client.admission.acquire_lex()
+    client.add_to_stream(b"\x00" * 320)
+    client.stop()
+    assert not client.is_crashed()
+    assert client.get_response()["Rejected"]
+
+
+def test_an_async_turn_without_a_lex_slot_is_answered_as_rejected(lex_config):
+    async def turn():
+        client = AsyncLexClientStreaming("TEST")
+        client.admission = lex_limited(1, 0.05)
+        await client.admission.acquire_lex_async()
+        for _ in range(client.max_chunks):
+            client.add_to_stream(b"\x00" * 320)
+        await asyncio.sleep(0.1)
+        # nothing is left waiting for a request that is not going to be sent
+        await asyncio.wait_for(client.drain(), 1)
+        await client.stop_async()
+        return client
+
+    client = asyncio.run(turn())
+    assert not client.is_crashed()
+    assert client.get_response()["Rejected"]
+
+
+def test_metrics_cover_every_worker():
+    table = WorkerTable(2, len(AdmissionControl.GAUGES) + len(AdmissionControl.COUNTERS))
+    first = AdmissionControl(0, 2, 0.01, 0.9, False, table, 0)
+    second = AdmissionControl(0, 2, 0.01, 0.9, False, table, 1)
+    assert first.acquire_lex()
+    assert second.acquire_lex()
+    assert second.acquire_lex()
+    assert not second.acquire_lex()
+
+    text = first.render()
+    assert text == second.render()
+    assert "lex_twilio_lex_requests_in_flight 3" in text
+    assert "lex_twilio_lex_requests_rejected_total 1" in text
+    assert 'lex_twilio_load{worker="0"} 0.5' in text
+    assert 'lex_twilio_load{worker="1"} 1.0' in text
+    assert 'lex_twilio_shedding{worker="1"} 1' in text
+
+    # the replacement of a worker starts without requests in flight and carries on with the counters
+    replacement = AdmissionControl(0, 2, 0.01, 0.9, False, table, 1)
+    text = replacement.render()
+    assert "lex_twilio_lex_requests_in_flight 1" in text
+    assert "lex_twilio_lex_requests_rejected_total 1" in text
+    assert replacement.snapshot()["Counters"]["LexRejected"] == 1
@@ -0,0 +1,102 @@
+import threading
+
+from call_updates import CallUpdateDispatcher, CallUpdateQueue
+
+
+class FakeCall:
+    def __init__(self, call_sid, twiml, failures=None):
+        self.call_sid = call_sid
+        self.twiml = twiml
+        self.failures = list(failures or [])
+        self.attempts = 0
+
+    def update(self):
+        self.attempts = self.attempts + 1
+        if self.failures:
+            raise self.failures.pop(0)
+
+
+class HttpError(Exception):
+    def __init__(self, status):
+        super().__init__("HTTP {0}".format(status))
+        self.status = status
+
+
+def test_newer_update_replaces_the_pending_one():
+    queue = CallUpdateQueue(1, 10, 3, 0)
+    assert queue.enqueue(FakeCall("CA1", "first"))
+    assert queue.enqueue(FakeCall("CA1", "second"))
+    assert queue.dequeue().twiml == "second"
+    assert queue.dequeue() is None
+    assert queue.counters["Coalesced"] == 1
+
+
+def test_update_submitted_while_one_is_in_flight_goes_out_after_it():
+    queue = CallUpdateQueue(1, 10, 3, 0)
+    queue.enqueue(FakeCall("CA1", "first"))
+    in_flight = queue.dequeue()
+    queue.enqueue(FakeCall("CA1", "second"))
+    queue.enqueue(FakeCall("CA1", "third"))
+    # never two updates of one call at the same time
+    assert queue.dequeue() is None
+    queue.finish(in_flight, True, 0.0)
+    assert queue.dequeue().twiml == "third"
+    assert queue.counters["Coalesced"] == 1
+
+
+def test_full_queue_rejects_updates_for_new_calls_only():
+    queue = CallUpdateQueue(1, 1, 3, 0)
+    assert queue.enqueue(FakeCall("CA1", "first"))
+    assert not queue.enqueue(FakeCall("CA2", "first"))
+    assert queue.enqueue(FakeCall("CA1", "second"))
+    assert queue.counters["Rejected"] == 1
+
+
+def test_retriable_errors():
+    queue = CallUpdateQueue(1, 10, 3, 0)
+    assert queue.retriable(HttpError(503))
+    assert queue.retriable(HttpError(429))
+    assert not queue.retriable(HttpError(404))
+    assert not queue.retriable(ValueError())
+
+
+def test_dispatcher_retries_server_errors_and_gives_up_on_client_errors():
+    dispatcher = CallUpdateDispatcher(2, 10, 3, 0.001)
+    try:
+        retried = FakeCall("CA1", "twiml", [HttpError(503), HttpError(503)])
+        refused = FakeCall("CA2", "twiml", [HttpError(400)])
+        dispatcher.submit(retried)
+        dispatcher.submit(refused)
+        assert dispatcher.join(5)
+        assert retried.attempts == 3
+        assert refused.attempts == 1
+        stats = dispatcher.stats()
+        assert stats["Sent"] == 1
+        assert stats["Failed"] == 1
+        assert stats["Retries"] == 2
+    finally:
+        dispatcher.close()
+
+
+def test_dispatcher_sends_the_latest_update_of_a_call():
+    dispatcher = CallUpdateDispatcher(1, 10, 3, 0)
+    sending = threading.Event()
+    release = threading.Event()
+    sent = []
+
+    class SlowCall(FakeCall):
+        def update(self):
+            sent.append(self.twiml)
+            sending.set()
+            release.wait(5)
+
+    try:
+        dispatcher.submit(SlowCall("CA1", "first"))
+        assert sending.wait(5)
+        dispatcher.submit(SlowCall("CA1", "second"))
+        dispatcher.submit(SlowCall("CA1", "third"))
+        release.set()
+        assert dispatcher.join(5)
+        assert sent == ["first", "third"]
+    finally:
+        dispatcher.close()
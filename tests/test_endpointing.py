@@ -0,0 +1,62 @@
+from endpointing import Endpointer
+
+RATE = 8000
+FRAME = 160  # 20 ms
+
+
+def feed(endpointer, rms, frames):
+    return [endpointer.update(rms, FRAME) for _ in range(frames)]
+
+
+def test_first_loud_frame_starts_the_utterance_without_an_onset_duration():
+    endpointer = Endpointer(RATE, 100, 100, 0.2)
+    assert endpointer.update(50, FRAME) is None
+    assert endpointer.update(150, FRAME) == Endpointer.VOICE_STARTED
+    assert endpointer.state == Endpointer.SPEECH
+
+
+def test_voice_shorter_than_the_onset_duration_falls_back_to_silence():
+    endpointer = Endpointer(RATE, 100, 100, 0.2, onset_duration_secs=0.1)
+    assert feed(endpointer, 150, 4) == [None] * 4
+    assert endpointer.state == Endpointer.ONSET
+    assert endpointer.update(50, FRAME) is None
+    assert endpointer.state == Endpointer.SILENCE
+    assert endpointer.onset_samples == 0
+    # the onset starts over, a click before the utterance does not count towards it
+    assert feed(endpointer, 150, 4) == [None] * 4
+    assert endpointer.update(150, FRAME) == Endpointer.VOICE_STARTED
+    assert endpointer.speech_secs == 0.1
+
+
+def test_silence_duration_ends_the_utterance_once():
+    endpointer = Endpointer(RATE, 100, 100, 0.1)
+    endpointer.update(150, FRAME)
+    assert feed(endpointer, 50, 4) == [None] * 4
+    assert endpointer.update(50, FRAME) == Endpointer.UTTERANCE_ENDED
+    assert endpointer.state == Endpointer.ENDED
+    assert feed(endpointer, 150, 3) == [None] * 3
+    assert not endpointer.voiced
+
+
+def test_voice_in_a_pause_restarts_the_silence_timer():
+    endpointer = Endpointer(RATE, 100, 100, 0.1)
+    endpointer.update(150, FRAME)
+    feed(endpointer, 50, 4)
+    endpointer.update(150, FRAME)
+    assert endpointer.silence_samples == 0
+    assert feed(endpointer, 50, 4) == [None] * 4
+    assert endpointer.update(50, FRAME) == Endpointer.UTTERANCE_ENDED
+
+
+def test_offset_threshold_below_the_onset_threshold_keeps_quieter_speech_going():
+    endpointer = Endpointer(RATE, 100, 60, 0.1)
+    assert endpointer.update(80, FRAME) is None
+    endpointer.update(150, FRAME)
+    assert feed(endpointer, 80, 10) == [None] * 10
+    assert endpointer.silence_samples == 0
+
+
+def test_time_is_counted_in_samples():
+    endpointer = Endpointer(RATE, 100, 100, 1.0)
+    feed(endpointer, 50, 50)
+    assert endpointer.elapsed_secs == 1.0
@@ -0,0 +1,65 @@
+import warnings
+
+import pytest
+from requests.adapters import HTTPAdapter
+
+from benchmarks.fake_services import FakeLex, self_signed_context
+from http_session_pool import HttpSessionPool
+
+CONTENT_PATH = "/bot/TestBot/alias/test/user/lex_TEST/content"
+
+
+# a lex stand-in over TLS and the certificate to trust for it
+@pytest.fixture(scope="module")
+def https_lex():
+    context, cert_path = self_signed_context()
+    lex = FakeLex(ssl_context=context).start_in_thread()
+    yield lex, cert_path
+    lex.stop_in_thread()
+
+
+def test_sequential_requests_reuse_one_tls_connection(https_lex):
+    lex, cert_path = https_lex
+    pool = HttpSessionPool(4, 50, ca_bundle=cert_path)
+    for _ in range(2):
+        response = pool.post(lex.endpoint + CONTENT_PATH, data=b"\x00" * 320)
+        assert response.status_code == 200
+    assert pool.stats() == {"checkouts": 2, "hits": 1, "misses": 1, "evictions": 0, "handshakes": 1}
+    pool.close()
+
+
+def test_idle_connections_are_reestablished(https_lex):
+    lex, cert_path = https_lex
+    pool = HttpSessionPool(4, 0, ca_bundle=cert_path)
+    for _ in range(2):
+        pool.post(lex.endpoint + CONTENT_PATH, data=b"\x00" * 320)
+    stats = pool.stats()
+    assert stats["evictions"] == 1
+    assert stats["handshakes"] == 2
+    pool.close()
+
+
+def test_warmed_connection_is_used_by_the_first_request(https_lex):
+    lex, cert_path = https_lex
+    pool = HttpSessionPool(4, 50, ca_bundle=cert_path)
+    assert pool.warm(lex.endpoint, connections=2) == 2
+    pool.post(lex.endpoint + CONTENT_PATH, data=b"\x00" * 320)
+    stats = pool.stats()
+    assert stats["handshakes"] == 2
+    assert stats["hits"] == 1
+    pool.close()
+
+
+def test_warming_falls_back_to_get_connection_before_requests_2_32(https_lex, monkeypatch):
+    lex, cert_path = https_lex
+    pool = HttpSessionPool(4, 50, ca_bundle=cert_path)
+    with monkeypatch.context() as older_requests, warnings.catch_warnings():
+        older_requests.delattr(HTTPAdapter, "get_connection_with_tls_context")
+        # get_connection() is deprecated from 2.32 on
+        warnings.simplefilter("ignore", DeprecationWarning)
+        # the handshake verifies the stand-in's certificate, so cert_verify() gave the pool the ca bundle
+        assert pool.warm(lex.endpoint) == 1
+        # and the connection went back to the pool it was taken from
+        assert pool.warm(lex.endpoint) == 0
+    assert pool.stats()["handshakes"] == 1
+    pool.close()
@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+import aiohttp
+import pytest
+
+from admission import AdmissionControl
+from benchmarks.fake_services import FakeLex
+from lex_streaming_client import AsyncLexClientStreaming, LexClientStreaming
+
+
+@pytest.fixture
+def fake_lex(lex_config, monkeypatch):
+    lex = FakeLex().start_in_thread()
+    monkeypatch.setitem(LexClientStreaming.lex_config, "Endpoint", lex.endpoint)
+    yield lex
+    lex.stop_in_thread()
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_a_stopped_turn_is_sent_to_lex(fake_lex):
+    client = LexClientStreaming("TEST")
+    client.admission = AdmissionControl(0, 1, 1, 0.9, False)
+    client.add_to_stream(b"\x00" * 320)
+    client.stop()
+    assert client.get_response()["DialogState"] == "ElicitSlot"
+    assert fake_lex.requests == 1
+
+
+def test_aborting_cuts_off_the_request_and_frees_its_slot(fake_lex):
+    client = LexClientStreaming("TEST")
+    client.admission = AdmissionControl(0, 1, 1, 0.9, False)
+    client.add_to_stream(b"\x00" * 320)
+    wait_until(lambda: "first_byte" in client.timings)
+    assert client.admission.snapshot()["LexInFlight"] == 1
+
+    client.abort()
+    client.request_thread.join(5)
+    assert not client.is_alive()
+    assert not client.is_crashed()
+    assert client.admission.snapshot()["LexInFlight"] == 0
+    # lex never gets the end of the body, so it does not answer the turn
+    time.sleep(0.2)
+    assert fake_lex.requests == 0
+
+    # the cut off connection is not handed to the next turn
+    next_turn = LexClientStreaming("TEST")
+    next_turn.add_to_stream(b"\x00" * 320)
+    next_turn.stop()
+    assert next_turn.get_response()["DialogState"] == "ElicitSlot"
+
+
+def test_aborting_an_async_turn_cuts_off_the_request_and_frees_its_slot(fake_lex):
+    async def turn():
+        async with aiohttp.ClientSession() as session:
+            AsyncLexClientStreaming.use_session(session)
+            client = AsyncLexClientStreaming("TEST")
+            client.admission = AdmissionControl(0, 1, 1, 0.9, False)
+            client.add_to_stream(b"\x00" * 320)
+            while "first_byte" not in client.timings:
+                await asyncio.sleep(0.01)
+            assert client.admission.snapshot()["LexInFlight"] == 1
+            await asyncio.wait_for(client.abort_async(), 1)
+            return client
+
+    client = asyncio.run(turn())
+    assert not client.is_alive()
+    assert not client.is_crashed()
+    assert client.admission.snapshot()["LexInFlight"] == 0
+    time.sleep(0.2)
+    assert fake_lex.requests == 0
@@ -0,0 +1,66 @@
+import base64
+import binascii
+import json
+
+import pytest
+
+from media_frames import media_payload
+
+# 0xff bytes encode to "/", which json may escape
+PAYLOAD = base64.b64encode(bytes(range(157)) + b"\xff" * 3).decode("ascii")
+
+
+def media_message(payload, **fields):
+    message = {"event": "media", "sequenceNumber": "4",
+               "media": {"track": "inbound", "chunk": "3", "timestamp": "60", "payload": payload},
+               "streamSid": "MZ00000000"}
+    message.update(fields)
+    # as twilio sends it, without whitespace
+    return json.dumps(message, separators=(",", ":"))
+
+
+@pytest.mark.parametrize("message", [
+    media_message(PAYLOAD),
+    media_message(""),
+    media_message("/////w=="),
+    '{"event":"media","media":{"payload":"' + PAYLOAD + '"}}',
+])
+def test_payload_is_the_one_json_loads_reads(message):
+    payload = media_payload(message)
+    assert payload == json.loads(message)["media"]["payload"]
+    assert binascii.a2b_base64(payload) == base64.b64decode(json.loads(message)["media"]["payload"])
+
+
+@pytest.mark.parametrize("message", [
+    # escaped characters are left to the json decoder
+    media_message(PAYLOAD).replace("/", "\\/"),
+    media_message(PAYLOAD).replace(PAYLOAD[:4], "\\u0041" + PAYLOAD[1:4]),
+    # other events and another key order
+    json.dumps({"event": "start", "start": {"callSid": "CA00000000"}}, separators=(",", ":")),
+    json.dumps({"media": {"payload": PAYLOAD}, "event": "media"}, separators=(",", ":")),
+    json.dumps({"event": "media", "media": {"payload": PAYLOAD}}),
+])
+def test_messages_the_fast_path_cannot_read_go_to_json_loads(message):
+    assert media_payload(message) is None
+    # and the json decoder reads the same audio
+    if json.loads(message)["event"] == "media":
+        assert base64.b64decode(json.loads(message)["media"]["payload"]) == base64.b64decode(PAYLOAD)
+
+
+@pytest.mark.parametrize("message", [
+    media_message(PAYLOAD)[:-1],
+    media_message(PAYLOAD)[:60],
+    '{"event":"media","media":{"payload":"' + PAYLOAD,
+    '{"event":"media","media":{"payload":"' + PAYLOAD + '"',
+    '{"event":"media"}',
+])
+def test_malformed_media_messages_are_not_read(message):
+    assert media_payload(message) is None
+    with pytest.raises((ValueError, KeyError)):
+        json.loads(message)["media"]["payload"]
+
+
+def test_binary_messages_go_to_json_loads():
+    message = media_message(PAYLOAD).encode("utf-8")
+    assert media_payload(message) is None
+    assert json.loads(message)["media"]["payload"] == PAYLOAD
@@ -0,0 +1,61 @@
+import os
+
+import pytest
+
+from metrics import TurnMetrics
+from workers import WorkerTable
+
+
+def sample(text, name):
+    for line in text.splitlines():
+        if line.startswith(name + " "):
+            return line.split(" ")[1]
+    raise AssertionError("no sample {0}".format(name))
+
+
+def traced_turn(metrics, call_sid, secs):
+    trace = metrics.start_call(call_sid)
+    trace.mark("silence_declared", 10.0)
+    trace.mark("lex_response", 10.0 + secs)
+    trace.end()
+
+
+def test_every_worker_renders_the_totals_of_all_of_them():
+    table = WorkerTable(2, TurnMetrics.WIDTH)
+    first = TurnMetrics(1.0, 10, table, 0)
+    second = TurnMetrics(1.0, 10, table, 1)
+    traced_turn(first, "CA1", 0.02)
+    traced_turn(second, "CA2", 0.2)
+    traced_turn(second, "CA3", 3)
+
+    text = first.render()
+    assert text == second.render()
+    assert sample(text, 'lex_twilio_span_seconds_bucket{span="silence_to_response",le="0.025"}') == "1"
+    assert sample(text, 'lex_twilio_span_seconds_bucket{span="silence_to_response",le="0.25"}') == "2"
+    assert sample(text, 'lex_twilio_span_seconds_bucket{span="silence_to_response",le="+Inf"}') == "3"
+    assert sample(text, 'lex_twilio_span_seconds_count{span="silence_to_response"}') == "3"
+    assert float(sample(text, 'lex_twilio_span_seconds_sum{span="silence_to_response"}')) == pytest.approx(3.22)
+    assert sample(text, "lex_twilio_calls_traced_total") == "3"
+    # /debug/traces stays per worker
+    assert first.traces()["Counters"]["CallsTraced"] == 1
+    assert second.traces()["Counters"]["CallsTraced"] == 2
+
+
+def test_a_forked_worker_counts_into_the_table_of_the_parent():
+    table = WorkerTable(2, TurnMetrics.WIDTH)
+    pid = os.fork()
+    if pid == 0:
+        try:
+            traced_turn(TurnMetrics(1.0, 10, table, 1), "CA1", 0.02)
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+    assert sample(TurnMetrics(1.0, 10, table, 0).render(), "lex_twilio_calls_traced_total") == "1"
+
+
+def test_a_replaced_worker_carries_on_counting():
+    table = WorkerTable(2, TurnMetrics.WIDTH)
+    traced_turn(TurnMetrics(1.0, 10, table, 1), "CA1", 0.02)
+    replacement = TurnMetrics(1.0, 10, table, 1)
+    traced_turn(replacement, "CA2", 0.02)
+    assert sample(replacement.render(), "lex_twilio_calls_traced_total") == "2"
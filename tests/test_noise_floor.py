@@ -0,0 +1,69 @@
+from noise_floor import NoiseFloor, noise_floor_config
+
+RATE = 8000
+FRAME = 160  # 20 ms
+
+
+# blocks of one frame, so the window is the last 4 frames
+def noise_floor(**overrides):
+    config = dict(noise_floor_config, WindowSecs=0.08, RiseDbPerSec=100.0, **overrides)
+    return NoiseFloor(RATE, config)
+
+
+def feed(floor, rms, frames):
+    for _ in range(frames):
+        floor.update(rms, FRAME)
+
+
+def test_first_frame_is_taken_as_the_floor():
+    floor = noise_floor()
+    floor.update(1000, FRAME)
+    assert floor.floor == 1000
+    assert floor.onset_threshold == 1000 * floor.onset_ratio
+    assert floor.offset_threshold == 1000 * floor.offset_ratio
+
+
+def test_floor_follows_a_drop_at_once():
+    floor = noise_floor()
+    floor.update(1000, FRAME)
+    floor.update(200, FRAME)
+    assert floor.floor == 200
+
+
+def test_floor_rises_at_most_by_the_rise_rate():
+    floor = noise_floor()
+    floor.update(100, FRAME)
+    feed(floor, 1000, 3)
+    # the window still holds the quiet frame
+    assert floor.floor == 100
+    floor.update(1000, FRAME)
+    assert floor.floor == 100 * floor.block_rise
+    feed(floor, 1000, 200)
+    assert floor.floor == 1000
+
+
+def test_speech_with_pauses_does_not_raise_the_floor():
+    floor = noise_floor()
+    floor.update(100, FRAME)
+    for _ in range(50):
+        feed(floor, 5000, 2)
+        floor.update(100, FRAME)
+    assert floor.floor == 100
+
+
+def test_thresholds_stay_within_their_limits():
+    floor = noise_floor(MinThreshold=150, MaxThreshold=6000)
+    floor.update(10, FRAME)
+    assert floor.onset_threshold == 150
+    assert floor.offset_threshold == 150
+    floor.set_floor(5000)
+    assert floor.onset_threshold == 6000
+    assert floor.offset_threshold == 6000
+
+
+def test_floor_never_reaches_zero():
+    floor = noise_floor()
+    floor.update(0, FRAME)
+    assert floor.floor == 1.0
+    feed(floor, 50, 200)
+    assert floor.floor == 50
@@ -0,0 +1,96 @@
+import random
+import struct
+
+import pytest
+
+import playback
+from playback import FRAME_BYTES, UlawFramer, pcm_to_ulaw
+from vad_engines import NUMPY_AVAILABLE, PythonVadEngine
+
+BACKENDS = [name for name, available in (("audioop", playback.audioop is not None),
+                                         ("numpy", NUMPY_AVAILABLE),
+                                         ("python", True)) if available]
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, monkeypatch):
+    if request.param != "audioop":
+        monkeypatch.setattr(playback, "audioop", None)
+    if request.param == "python":
+        monkeypatch.setattr(playback, "NUMPY_AVAILABLE", False)
+    return request.param
+
+
+# a second of 16-bit pcm: a sweep over the whole range, then random samples
+def pcm(sample_count=16000):
+    rng = random.Random(3)
+    samples = [-32768 + index * 65535 // 4000 for index in range(4000)]
+    samples = samples[:sample_count] + [rng.randrange(-32768, 32768) for _ in range(sample_count - len(samples))]
+    return struct.pack("<{0}h".format(len(samples)), *samples)
+
+
+def test_encoder_matches_lin2ulaw_on_every_backend(backend):
+    pcm_data = pcm()
+    ulaw_data, _ = pcm_to_ulaw(pcm_data, rate=8000)
+    assert ulaw_data == bytes(playback.linear14_to_ulaw(sample >> 2)
+                              for sample in struct.unpack("<{0}h".format(len(pcm_data) // 2), pcm_data))
+    if playback.audioop is not None:
+        assert ulaw_data == playback.audioop.lin2ulaw(pcm_data, 2)
+
+
+def test_encoded_audio_decodes_back_within_one_step():
+    decoder = PythonVadEngine()
+    pcm_data = pcm(4000)
+    samples = struct.unpack("<4000h", pcm_data)
+    decoded = struct.unpack("<4000h", decoder.decode(pcm_to_ulaw(pcm_data, rate=8000)[0]))
+    # a mu-law step is 1/16 of its segment, the largest segment spans 16384
+    assert all(abs(sample - decoded_sample) <= 1024 for sample, decoded_sample in zip(samples, decoded))
+
+
+def test_fallback_backends_resample_alike(monkeypatch):
+    pcm_data = pcm()
+    monkeypatch.setattr(playback, "audioop", None)
+    if not NUMPY_AVAILABLE:
+        pytest.skip("numpy is not installed")
+    with_numpy, _ = pcm_to_ulaw(pcm_data, rate=16000)
+    monkeypatch.setattr(playback, "NUMPY_AVAILABLE", False)
+    assert pcm_to_ulaw(pcm_data, rate=16000)[0] == with_numpy
+    assert len(with_numpy) == len(pcm_data) // 4
+
+
+# the frames of a whole prompt, fed in chunks of the given sizes in turn
+def framed(pcm_data, chunk_sizes, rate=16000):
+    framer = UlawFramer(rate)
+    frames = []
+    offset = 0
+    index = 0
+    while offset < len(pcm_data):
+        size = chunk_sizes[index % len(chunk_sizes)]
+        frames.extend(framer.feed(pcm_data[offset:offset + size]))
+        offset = offset + size
+        index = index + 1
+    return frames + framer.flush()
+
+
+@pytest.mark.parametrize("rate", [8000, 16000])
+def test_odd_sized_chunks_give_the_frames_of_the_whole_prompt(backend, rate):
+    pcm_data = pcm()
+    whole = framed(pcm_data, [len(pcm_data)], rate)
+    assert framed(pcm_data, [1, 3, 641, 7, 1000, 319], rate) == whole
+    assert framed(pcm_data, [1], rate) == whole
+    assert b"".join(whole) == pcm_to_ulaw(pcm_data, rate)[0]
+
+
+def test_every_frame_is_20_ms_and_the_last_one_is_padded_with_silence(backend):
+    # 1.01 s at 16 kHz, 50 frames and half of one
+    pcm_data = pcm(16160)
+    frames = framed(pcm_data, [640])
+    assert [len(frame) for frame in frames] == [FRAME_BYTES] * 51
+    assert frames[-1][80:] == b"\xff" * 80
+    assert frames[-1][:80] == pcm_to_ulaw(pcm_data, 16000)[0][-80:]
+
+
+def test_flush_without_a_partial_frame_adds_nothing():
+    framer = UlawFramer(8000)
+    assert len(framer.feed(pcm(160))) == 1
+    assert framer.flush() == []
@@ -0,0 +1,55 @@
+import audioop
+import base64
+
+import pytest
+
+from vad_replay import ReplayVoiceAndSilenceDetectingLexClient
+from voice_and_silence_detecting_lex_wrapper import VoiceAndSilenceDetectingLexClient
+
+# mu-law frames well below the voice threshold, each one different so that their order shows
+QUIET_FRAMES = [bytes([0xf0 + index]) * 160 for index in range(12)]
+VOICED_FRAME = bytes([0x00, 0x80]) * 80
+
+
+def pcm(*frames):
+    return audioop.ulaw2lin(b"".join(frames), 2)
+
+
+def first_chunk(frames):
+    client = ReplayVoiceAndSilenceDetectingLexClient("TEST")
+    for frame in frames:
+        client.stream_to_lex(base64.b64encode(frame).decode("ascii"))
+    return client.lex_client.chunks[0]
+
+
+@pytest.fixture
+def vad_config(monkeypatch):
+    def configure(**config):
+        for name, value in config.items():
+            monkeypatch.setitem(VoiceAndSilenceDetectingLexClient.vad_sd_config, name, value)
+    configure(VoiceThreshold=500, SilenceThreshold=None, VoiceOnsetDurationInSecs=0, AdaptiveThresholds=False)
+    return configure
+
+
+def test_the_frames_before_voice_reach_lex_in_order_with_the_first_voiced_frame(vad_config):
+    vad_config(PreRollMs=200)
+    # more quiet frames than the pre-roll holds, so its buffers are reused
+    chunk = first_chunk(QUIET_FRAMES + [VOICED_FRAME])
+    assert chunk == pcm(*QUIET_FRAMES[-10:], VOICED_FRAME)
+
+
+def test_a_pre_roll_not_yet_full_is_sent_whole(vad_config):
+    vad_config(PreRollMs=200)
+    assert first_chunk(QUIET_FRAMES[:3] + [VOICED_FRAME]) == pcm(*QUIET_FRAMES[:3], VOICED_FRAME)
+
+
+def test_the_onset_follows_the_pre_roll(vad_config):
+    vad_config(PreRollMs=60, VoiceOnsetDurationInSecs=0.04)
+    # the frame held during the onset, then the one that completes it
+    chunk = first_chunk(QUIET_FRAMES + [VOICED_FRAME] * 2)
+    assert chunk == pcm(*QUIET_FRAMES[-3:], VOICED_FRAME, VOICED_FRAME)
+
+
+def test_without_a_pre_roll_lex_gets_the_voice_only(vad_config):
+    vad_config(PreRollMs=0)
+    assert first_chunk(QUIET_FRAMES + [VOICED_FRAME]) == pcm(VOICED_FRAME)
@@ -0,0 +1,71 @@
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import aiohttp
+import pytest
+
+from admission import WS_TRY_AGAIN_LATER
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+
+def free_port():
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        return listener.getsockname()[1]
+
+
+# a server allowing one call, calls updates go nowhere
+@pytest.fixture(params=["server.py", "async_server.py"])
+def server_url(request, tmp_path):
+    port = free_port()
+    environment = dict(os.environ,
+                       CONTAINER_PORT=str(port),
+                       ADMISSION_MAX_CALLS="1",
+                       TWILIO_API_URL="http://127.0.0.1:1",
+                       TWILIO_AUTH_TOKEN="fake",
+                       AWS_REGION="us-east-1")
+    environment.pop("WORKERS", None)
+    log = open(tmp_path / "server.log", "w")
+    server = subprocess.Popen([sys.executable, request.param], cwd=ROOT, env=environment,
+                              stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 20
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            break
+        except OSError:
+            assert server.poll() is None and time.monotonic() < deadline, "server did not start"
+            time.sleep(0.1)
+    yield "ws://127.0.0.1:{0}/".format(port)
+    server.kill()
+    server.wait()
+    log.close()
+
+
+def start_message(call_sid):
+    return json.dumps({"event": "start",
+                       "start": {"accountSid": "AC00000000", "callSid": call_sid, "streamSid": "MZ" + call_sid}})
+
+
+async def close_code_of_second_call(url):
+    async with aiohttp.ClientSession() as session:
+        async with session.ws_connect(url) as admitted:
+            await admitted.send_str(json.dumps({"event": "connected"}))
+            await admitted.send_str(start_message("CA1"))
+            # the first call is taken on before the second one connects
+            await asyncio.sleep(0.5)
+            async with session.ws_connect(url) as turned_away:
+                await turned_away.send_str(start_message("CA2"))
+                message = await turned_away.receive(timeout=10)
+                assert message.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSED)
+                return turned_away.close_code
+
+
+def test_stream_over_the_call_limit_is_closed_with_try_again_later(server_url):
+    assert asyncio.run(close_code_of_second_call(server_url)) == WS_TRY_AGAIN_LATER
@@ -0,0 +1,80 @@
+import datetime
+import hashlib
+import hmac
+
+from sigv4_signer import SigV4Signer, request_template
+
+ACCESS_KEY = "AKIDEXAMPLE"
+SECRET_KEY = "wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY"
+REGION = "us-east-1"
+SERVICE = "lex"
+HOST = "runtime.lex.us-east-1.amazonaws.com"
+CONTENT_TYPE = 'audio/lpcm; sample-rate=8000; sample-size-bits=16; channel-count=1; is-big-endian=false'
+CANONICAL_URI = "/bot/TestBot/alias/test/user/lex_USER1/content"
+
+
+# the signing LexClientStreaming did before sigv4_signer, everything derived from scratch for every request
+def legacy_authorization(t):
+    def sign(key, msg):
+        return hmac.new(key, msg.encode('utf-8'), hashlib.sha256).digest()
+
+    amz_date = t.strftime('%Y%m%dT%H%M%SZ')
+    date_stamp = t.strftime('%Y%m%d')
+    canonical_headers = 'content-type:' + CONTENT_TYPE + '\n' + 'host:' + HOST + '\n' + 'x-amz-date:' + amz_date + '\n'
+    signed_headers = 'content-type;host;x-amz-date'
+    canonical_request = "POST" + '\n' + CANONICAL_URI + '\n' + "" + '\n' + canonical_headers + '\n' + signed_headers + '\n' + "UNSIGNED-PAYLOAD"
+    credential_scope = date_stamp + '/' + REGION + '/' + SERVICE + '/' + 'aws4_request'
+    string_to_sign = 'AWS4-HMAC-SHA256' + '\n' + amz_date + '\n' + credential_scope + '\n' + hashlib.sha256(
+        canonical_request.encode('utf-8')).hexdigest()
+    k_signing = sign(sign(sign(sign(('AWS4' + SECRET_KEY).encode('utf-8'), date_stamp), REGION), SERVICE), 'aws4_request')
+    signature = hmac.new(k_signing, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+    return 'AWS4-HMAC-SHA256 Credential=' + ACCESS_KEY + '/' + credential_scope + ', SignedHeaders=' \
+           + signed_headers + ', Signature=' + signature
+
+
+def sign(signer, t):
+    return request_template(HOST, CANONICAL_URI, CONTENT_TYPE, REGION, SERVICE).sign(signer, t)
+
+
+def test_signature_matches_the_legacy_signer():
+    t = datetime.datetime(2017, 7, 14, 1, 1, 1)
+    headers = sign(SigV4Signer(ACCESS_KEY, SECRET_KEY), t)
+    assert headers["Authorization"] == legacy_authorization(t)
+    assert headers["X-Amz-Date"] == "20170714T010101Z"
+    assert headers["Content-Type"] == CONTENT_TYPE
+    assert headers["x-amz-content-sha256"] == "UNSIGNED-PAYLOAD"
+
+
+def test_signing_key_is_derived_once_per_day():
+    signer = SigV4Signer(ACCESS_KEY, SECRET_KEY)
+    for second in range(3):
+        sign(signer, datetime.datetime(2017, 7, 14, 12, 0, second))
+    assert signer.derivations == 1
+
+
+def test_signing_key_rolls_over_at_midnight_utc():
+    signer = SigV4Signer(ACCESS_KEY, SECRET_KEY)
+    before = datetime.datetime(2017, 7, 14, 23, 59, 59)
+    after = datetime.datetime(2017, 7, 15, 0, 0, 1)
+    assert sign(signer, before)["Authorization"] == legacy_authorization(before)
+    assert sign(signer, after)["Authorization"] == legacy_authorization(after)
+    assert signer.derivations == 2
+    # the key of the day that has passed is dropped
+    assert list(signer.keys) == [("20170715", REGION, SERVICE)]
+    sign(signer, after + datetime.timedelta(hours=1))
+    assert signer.derivations == 2
+
+
+def test_templates_are_cached_per_request_target():
+    template = request_template(HOST, CANONICAL_URI, CONTENT_TYPE, REGION, SERVICE)
+    hits = request_template.cache_info().hits
+    assert request_template(HOST, CANONICAL_URI, CONTENT_TYPE, REGION, SERVICE) is template
+    assert request_template.cache_info().hits == hits + 1
+    other_user = request_template(HOST, CANONICAL_URI.replace("USER1", "USER2"), CONTENT_TYPE, REGION, SERVICE)
+    assert other_user is not template
+    assert other_user.canonical_uri.endswith("/user/lex_USER2/content")
+
+
+def test_shared_signer_is_one_per_set_of_credentials():
+    assert SigV4Signer.shared(ACCESS_KEY, SECRET_KEY) is SigV4Signer.shared(ACCESS_KEY, SECRET_KEY)
+    assert SigV4Signer.shared(ACCESS_KEY, SECRET_KEY) is not SigV4Signer.shared(ACCESS_KEY, "another secret")
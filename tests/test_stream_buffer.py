@@ -0,0 +1,78 @@
+import threading
+import time
+
+from lex_streaming_client import StreamBuffer
+
+
+def test_chunks_come_out_in_order_then_none_once_closed():
+    buffer = StreamBuffer(4)
+    assert buffer.put(b"a")
+    assert buffer.put(b"b")
+    buffer.close()
+    assert buffer.get() == b"a"
+    assert buffer.get() == b"b"
+    assert buffer.get() is None
+
+
+def test_put_times_out_while_full():
+    buffer = StreamBuffer(1)
+    assert buffer.put(b"a")
+    started = time.monotonic()
+    assert not buffer.put(b"b", timeout=0.05)
+    assert time.monotonic() - started >= 0.05
+    assert len(buffer) == 1
+
+
+def test_put_after_close_is_refused():
+    buffer = StreamBuffer(1)
+    buffer.close()
+    assert not buffer.put(b"a", timeout=0)
+    assert buffer.get() is None
+
+
+def test_get_wakes_up_a_blocked_put():
+    buffer = StreamBuffer(1)
+    buffer.put(b"a")
+    result = []
+    producer = threading.Thread(target=lambda: result.append(buffer.put(b"b", timeout=5)))
+    producer.start()
+    time.sleep(0.05)
+    assert buffer.get() == b"a"
+    producer.join(5)
+    assert result == [True]
+    assert buffer.get() == b"b"
+
+
+def test_close_wakes_up_a_blocked_put():
+    buffer = StreamBuffer(1)
+    buffer.put(b"a")
+    result = []
+    producer = threading.Thread(target=lambda: result.append(buffer.put(b"b", timeout=5)))
+    producer.start()
+    time.sleep(0.05)
+    started = time.monotonic()
+    buffer.close()
+    producer.join(5)
+    assert result == [False]
+    assert time.monotonic() - started < 1
+
+
+def test_close_wakes_up_a_blocked_get():
+    buffer = StreamBuffer(1)
+    result = []
+    consumer = threading.Thread(target=lambda: result.append(buffer.get()))
+    consumer.start()
+    time.sleep(0.05)
+    buffer.close()
+    consumer.join(5)
+    assert result == [None]
+
+
+def test_wait_for_data():
+    buffer = StreamBuffer(2)
+    added = threading.Timer(0.05, buffer.put, [b"a"])
+    added.start()
+    assert buffer.wait_for_data()
+    empty = StreamBuffer(2)
+    threading.Timer(0.05, empty.close).start()
+    assert not empty.wait_for_data()
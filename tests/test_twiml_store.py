@@ -0,0 +1,96 @@
+import time
+
+import pytest
+
+from benchmarks.fake_redis import FakeRedisServer
+from twiml_store import InMemoryTwimlStore, RedisTwimlStore
+
+
+def test_pop_returns_the_twiml_once():
+    store = InMemoryTwimlStore(60, 10)
+    store.put("CA1", "<Response/>")
+    assert store.pop("CA1") == "<Response/>"
+    assert store.pop("CA1") is None
+    assert store.stats()["Hits"] == 1
+    assert store.stats()["Misses"] == 1
+
+
+def test_twiml_past_its_ttl_is_not_served():
+    store = InMemoryTwimlStore(0.05, 10)
+    store.put("CA1", "<Response/>")
+    time.sleep(0.1)
+    assert store.pop("CA1") is None
+    assert store.stats()["Expired"] == 1
+    assert len(store) == 0
+
+
+def test_put_drops_expired_entries():
+    store = InMemoryTwimlStore(0.05, 10)
+    store.put("CA1", "<Response/>")
+    store.put("CA2", "<Response/>")
+    time.sleep(0.1)
+    store.put("CA3", "<Response/>")
+    assert len(store) == 1
+    assert store.stats()["Expired"] == 2
+    assert store.pop("CA3") == "<Response/>"
+
+
+def test_least_recently_stored_entry_is_evicted_over_max_entries():
+    store = InMemoryTwimlStore(60, 2)
+    store.put("CA1", "<Response>1</Response>")
+    store.put("CA2", "<Response>2</Response>")
+    store.put("CA3", "<Response>3</Response>")
+    assert len(store) == 2
+    assert store.stats()["Evicted"] == 1
+    assert store.stats()["Expired"] == 0
+    assert store.pop("CA1") is None
+    assert store.pop("CA2") == "<Response>2</Response>"
+    assert store.pop("CA3") == "<Response>3</Response>"
+
+
+def test_storing_again_makes_an_entry_the_most_recent():
+    store = InMemoryTwimlStore(60, 2)
+    store.put("CA1", "<Response>1</Response>")
+    store.put("CA2", "<Response>2</Response>")
+    store.put("CA1", "<Response>1 again</Response>")
+    store.put("CA3", "<Response>3</Response>")
+    assert store.pop("CA2") is None
+    assert store.pop("CA1") == "<Response>1 again</Response>"
+    assert store.pop("CA3") == "<Response>3</Response>"
+
+
+@pytest.fixture
+def fake_redis():
+    server = FakeRedisServer().start()
+    yield server
+    server.stop()
+
+
+def test_redis_store_round_trip(fake_redis):
+    store = RedisTwimlStore(60, fake_redis.url)
+    store.put("CA1", "<Response><Say>héllo</Say></Response>")
+    assert list(fake_redis.data) == [b"twiml:CA1"]
+    assert store.pop("CA1") == "<Response><Say>héllo</Say></Response>"
+    # popped once, in the same transaction as it was read
+    assert store.pop("CA1") is None
+    assert fake_redis.data == {}
+    assert store.stats()["Hits"] == 1
+    assert store.stats()["Misses"] == 1
+
+
+def test_redis_store_sets_the_ttl_and_does_not_serve_expired_twiml(fake_redis):
+    store = RedisTwimlStore(0.05, fake_redis.url)
+    store.put("CA1", "<Response/>")
+    store.put("CA2", "<Response/>")
+    assert store.pop("CA2") == "<Response/>"
+    time.sleep(0.1)
+    assert store.pop("CA1") is None
+    assert store.stats()["Misses"] == 1
+
+
+def test_redis_stores_of_two_tasks_share_the_twiml(fake_redis):
+    holding_the_call = RedisTwimlStore(60, fake_redis.url)
+    serving_updatecall = RedisTwimlStore(60, fake_redis.url)
+    holding_the_call.put("CA1", "<Response/>")
+    assert serving_updatecall.pop("CA1") == "<Response/>"
+    assert holding_the_call.pop("CA1") is None
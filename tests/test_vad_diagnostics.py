@@ -0,0 +1,56 @@
+from vad_diagnostics import EnergyRingBuffer, VadDiagnostics
+
+
+# frames 1 to count, every third one voiced, at an energy of 100 per frame number
+def filled(capacity, count):
+    energies = EnergyRingBuffer(capacity)
+    for frame in range(1, count + 1):
+        energies.append(frame * 100, frame % 3 == 0)
+    return energies
+
+
+def test_an_overfilled_ring_keeps_the_last_frames_oldest_first():
+    energies = filled(5, 12)
+    assert len(energies) == 5
+    assert energies.retained() == ([800, 900, 1000, 1100, 1200], [0, 1, 0, 0, 1])
+    assert energies.graph() == ".^..^"
+
+
+def test_a_ring_filled_a_whole_number_of_times_starts_at_its_first_slot():
+    energies = filled(4, 8)
+    assert energies.retained() == ([500, 600, 700, 800], [0, 1, 0, 0])
+
+
+def test_a_ring_not_yet_full_keeps_every_frame():
+    energies = filled(5, 3)
+    assert energies.retained() == ([100, 200, 300], [0, 0, 1])
+    assert energies.percentiles() == {"p10": 100, "p50": 200, "p90": 300, "p99": 300}
+
+
+def test_percentiles_cover_the_retained_frames_and_the_counts_the_whole_turn():
+    energies = filled(5, 12)
+    # 1200 is written over the slot that held 700 last
+    assert energies.percentiles() == {"p10": 800, "p50": 1000, "p90": 1200, "p99": 1200}
+    summary = energies.summary(0.24)
+    assert summary == {"Frames": 12, "RetainedFrames": 5, "VoicedFrames": 4, "VoicedRatio": 0.333,
+                       "DurationSecs": 0.24, "EnergyMax": 1200,
+                       "EnergyP10": 800, "EnergyP50": 1000, "EnergyP90": 1200, "EnergyP99": 1200}
+
+
+def test_energies_above_the_array_range_are_clamped_but_the_max_is_not():
+    energies = EnergyRingBuffer(2)
+    energies.append(70000, True)
+    assert energies.retained() == ([0xffff], [1])
+    assert energies.summary(0.02)["EnergyMax"] == 70000
+
+
+def test_recent_turns_are_bounded_and_the_totals_are_not():
+    diagnostics = VadDiagnostics(1, 0)
+    diagnostics.record_turn(dict(filled(5, 12).summary(0.24), Ended=True))
+    diagnostics.record_turn(filled(5, 3).summary(0.06))
+    snapshot = diagnostics.snapshot()
+    assert snapshot["Turns"] == 2
+    assert snapshot["EndedTurns"] == 1
+    assert snapshot["Frames"] == 15
+    assert snapshot["VoicedRatio"] == 0.333
+    assert [turn["Frames"] for turn in snapshot["RecentTurns"]] == [3]
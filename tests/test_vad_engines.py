@@ -0,0 +1,71 @@
+import base64
+import random
+
+import pytest
+
+from vad_engines import PythonVadEngine, available_engines, create_engine
+from vad_replay import ReplayVoiceAndSilenceDetectingLexClient, replay
+
+FRAME = 160
+
+
+# random frames with codes from quiet to full scale, plus silence, full scale and an odd length
+def frames():
+    rng = random.Random(7)
+    result = [bytes([0xff]) * FRAME, bytes([0x00, 0x80]) * (FRAME // 2), bytes(range(256)), b"\x10\x90\x33"]
+    for loudest in range(0, 256, 8):
+        result.append(bytes(rng.randrange(loudest, 256) ^ rng.choice((0, 0x80)) for _ in range(FRAME)))
+    return result
+
+
+# speech between quiet stretches, at levels around the default voice threshold of 500
+def payloads():
+    rng = random.Random(11)
+    result = []
+    for level in (0xf8, 0xe0, 0xb0, 0xc8, 0xf0, 0xd8, 0xfc):
+        for _ in range(rng.randrange(40, 160)):
+            frame = bytes(rng.randrange(level, 256) ^ rng.choice((0, 0x80)) for _ in range(FRAME))
+            result.append(base64.b64encode(frame).decode("ascii"))
+    return result
+
+
+@pytest.mark.parametrize("name", available_engines())
+def test_engines_decode_and_measure_like_the_reference(name):
+    engine = create_engine(name)
+    reference = PythonVadEngine()
+    for ulaw_data in frames():
+        pcm_data = reference.decode(ulaw_data)
+        rms = reference.rms(pcm_data)
+        assert engine.decode(ulaw_data) == pcm_data
+        assert engine.rms(pcm_data) == rms
+        assert engine.process(ulaw_data) == (pcm_data, rms)
+        out = bytearray(len(pcm_data))
+        assert engine.process_into(ulaw_data, memoryview(out)) == rms
+        assert bytes(out) == pcm_data
+
+
+@pytest.mark.parametrize("name", available_engines())
+def test_batches_match_frame_by_frame(name):
+    engine = create_engine(name)
+    batch = [ulaw_data for ulaw_data in frames() if len(ulaw_data) == FRAME]
+    pcm_frames, energies = engine.process_batch(batch)
+    assert list(zip(pcm_frames, energies)) == [engine.process(ulaw_data) for ulaw_data in batch]
+
+
+def test_energy_from_the_codes_matches_the_decoded_pcm():
+    engine = PythonVadEngine()
+    for ulaw_data in frames():
+        assert engine.ulaw_rms(ulaw_data) == engine.rms(engine.decode(ulaw_data))
+    assert engine.ulaw_rms(b"") == 0
+
+
+def test_every_engine_takes_the_same_decisions(monkeypatch):
+    recorded = payloads()
+    results = {}
+    for name in available_engines():
+        monkeypatch.setitem(ReplayVoiceAndSilenceDetectingLexClient.vad_sd_config, "Engine", name)
+        results[name] = replay(recorded)
+    decisions, turn_audio = results["python"]
+    assert {"voice_detected", "silence_detected"} <= {decision["Event"] for decision in decisions}
+    for name, result in results.items():
+        assert result == (decisions, turn_audio), name
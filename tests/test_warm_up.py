@@ -0,0 +1,109 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from async_server import readiness_response
+from warm_up import Readiness, warm_up, warm_up_async, warm_up_config, warm_up_steps
+
+
+# the steps that import modules or reach out of the process, stubbed to record that they ran
+@pytest.fixture
+def steps_run(lex_config, monkeypatch):
+    steps = []
+    monkeypatch.setattr("warm_up.load_modules", lambda: steps.append("imports"))
+    monkeypatch.setattr("warm_up.warm_lex", lambda: steps.append("lex"))
+    monkeypatch.setattr("warm_up.warm_twilio", lambda: steps.append("twilio"))
+    return steps
+
+
+# a readiness of its own for every test
+@pytest.fixture
+def readiness(steps_run, monkeypatch):
+    monkeypatch.setattr(Readiness, "_shared", None)
+    monkeypatch.setitem(warm_up_config, "Enabled", True)
+    monkeypatch.setitem(warm_up_config, "TimeoutInSecs", 5)
+    return Readiness.shared()
+
+
+def ready_status():
+    return asyncio.run(readiness_response(None)).status
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_ready_once_the_steps_are_done(readiness, steps_run):
+    assert not readiness.is_ready()
+    assert ready_status() == 503
+    assert readiness.snapshot()["WarmUpMs"] is None
+
+    warm_up(warm_up_steps())
+    assert steps_run == ["imports", "lex", "twilio"]
+    assert readiness.is_ready()
+    assert ready_status() == 200
+    snapshot = readiness.snapshot()
+    assert list(snapshot["StepsMs"]) == ["imports", "signing_key", "lex", "twilio"]
+    assert snapshot["Errors"] == {}
+    assert snapshot["WarmUpMs"] is not None
+
+
+def test_a_failed_step_is_recorded_and_the_rest_still_run(readiness, steps_run, monkeypatch):
+    def unreachable():
+        raise ConnectionError("lex is unreachable")
+
+    monkeypatch.setattr("warm_up.warm_lex", unreachable)
+    warm_up(warm_up_steps())
+    assert steps_run == ["imports", "twilio"]
+    assert readiness.is_ready()
+    assert readiness.snapshot()["Errors"] == {"lex": "lex is unreachable"}
+
+
+def test_a_hung_warm_up_is_made_ready_by_the_timer(readiness, steps_run, monkeypatch):
+    monkeypatch.setitem(warm_up_config, "TimeoutInSecs", 0.1)
+    unblock = threading.Event()
+    monkeypatch.setattr("warm_up.warm_lex", unblock.wait)
+    warming_up = threading.Thread(target=warm_up, args=(warm_up_steps(),), daemon=True)
+    warming_up.start()
+    assert ready_status() == 503
+
+    wait_until(readiness.is_ready)
+    assert ready_status() == 200
+    snapshot = readiness.snapshot()
+    assert snapshot["Errors"] == {"ready": "warm-up timed out"}
+    assert "lex" not in snapshot["StepsMs"]
+    assert snapshot["WarmUpMs"] >= 100
+
+    # the step finishing later leaves the worker ready
+    unblock.set()
+    warming_up.join(5)
+    assert steps_run == ["imports", "twilio"]
+    assert readiness.is_ready()
+
+
+def test_a_hung_async_warm_up_is_made_ready_on_timeout(readiness, monkeypatch):
+    monkeypatch.setitem(warm_up_config, "TimeoutInSecs", 0.1)
+
+    async def run():
+        steps = [("imports", lambda: None), ("lex", lambda: asyncio.sleep(60))]
+        warming_up = asyncio.ensure_future(warm_up_async(steps))
+        await asyncio.sleep(0)
+        status = (await readiness_response(None)).status
+        await warming_up
+        return status
+
+    assert asyncio.run(run()) == 503
+    assert readiness.is_ready()
+    assert readiness.snapshot()["Errors"] == {"ready": "warm-up timed out"}
+
+
+def test_ready_as_soon_as_listening_without_warm_up(readiness, steps_run, monkeypatch):
+    monkeypatch.setitem(warm_up_config, "Enabled", False)
+    warm_up(warm_up_steps())
+    assert steps_run == []
+    assert readiness.is_ready()
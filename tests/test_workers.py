@@ -0,0 +1,101 @@
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+from workers import WorkerSupervisor
+
+
+# a worker that waits to be signalled
+def idle_worker(index):
+    while True:
+        time.sleep(1)
+
+
+# a worker that does not stop on SIGTERM
+def stubborn_worker(index):
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    idle_worker(index)
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # a zombie until reaped still counts
+    return True
+
+
+@pytest.fixture
+def restore_signals():
+    handlers = {signum: signal.getsignal(signum) for signum in (signal.SIGTERM, signal.SIGINT)}
+    yield
+    for signum, handler in handlers.items():
+        signal.signal(signum, handler)
+
+
+def reap_all(supervisor, timeout):
+    deadline = time.monotonic() + timeout
+    while supervisor.children and time.monotonic() < deadline:
+        supervisor.reap()
+        time.sleep(0.01)
+
+
+def test_a_killed_worker_is_respawned_after_the_minimum_uptime():
+    supervisor = WorkerSupervisor(1, idle_worker, drain_timeout=1)
+    supervisor.MIN_UPTIME_SECS = 0.3
+    supervisor.spawn(0)
+    [(pid, (index, started_at))] = supervisor.children.items()
+    try:
+        os.kill(pid, signal.SIGKILL)
+        deadline = time.monotonic() + 5
+        while pid in supervisor.children:
+            assert time.monotonic() < deadline
+            supervisor.reap()
+            time.sleep(0.01)
+        [(new_pid, (new_index, new_started_at))] = supervisor.children.items()
+        assert new_pid != pid
+        assert new_index == 0
+        # it exited right after it started, so it is not respawned straight away
+        assert new_started_at - started_at >= supervisor.MIN_UPTIME_SECS
+    finally:
+        supervisor.stop(signal.SIGTERM, None)
+        reap_all(supervisor, 5)
+    assert supervisor.children == {}
+
+
+def test_stop_reaps_every_worker_within_the_drain_timeout():
+    supervisor = WorkerSupervisor(3, idle_worker, drain_timeout=2)
+    for index in range(3):
+        supervisor.spawn(index)
+    pids = list(supervisor.children)
+    started = time.monotonic()
+    supervisor.stop(signal.SIGTERM, None)
+    reap_all(supervisor, supervisor.drain_timeout)
+    assert supervisor.children == {}
+    assert time.monotonic() - started < supervisor.drain_timeout
+    # reaped, not respawned while stopping
+    assert not any(alive(pid) for pid in pids)
+
+
+def test_run_drains_on_sigterm(restore_signals):
+    supervisor = WorkerSupervisor(2, idle_worker, drain_timeout=2)
+    threading.Timer(0.5, os.kill, (os.getpid(), signal.SIGTERM)).start()
+    started = time.monotonic()
+    supervisor.run()
+    assert supervisor.children == {}
+    assert time.monotonic() - started < 0.5 + supervisor.drain_timeout
+
+
+def test_run_kills_workers_that_outlast_the_drain_timeout(restore_signals):
+    supervisor = WorkerSupervisor(2, stubborn_worker, drain_timeout=0.3)
+    supervisor.KILL_GRACE_SECS = 0.2
+    threading.Timer(0.5, os.kill, (os.getpid(), signal.SIGTERM)).start()
+    started = time.monotonic()
+    supervisor.run()
+    assert supervisor.children == {}
+    elapsed = time.monotonic() - started
+    assert 0.5 + supervisor.drain_timeout + supervisor.KILL_GRACE_SECS <= elapsed < 5
@@ -0,0 +1,146 @@
+"""
+This module contains the Twilio side of a conversational turn
+
+TwilioCall persists the TwiML built from a Lex response in the TwiML store
+(see twiml_store.py) and points the live call at /updatecall, which serves
+that TwiML back to Twilio. With the inline store the TwiML is sent with the
+call update instead. It is shared by the gevent server (server.py) and the
+asyncio server (async_server.py).
+
+REST clients are cached per account and share one pool of keep-alive
+connections to the Twilio API (TWILIO_API_URL), so a call update does not
+pay for a new client and a new TLS handshake every turn. Updates are sent by
+the dispatchers in call_updates.py rather than from the media loop.
+"""
+
+import asyncio
+import os
+import threading
+
+from http_session_pool import PoolStats
+from twiml_store import shared_store
+
+DEFAULT_API_URL = "https://api.twilio.com"
+
+
+# twilio.rest and the TwiML builders take a while to import and are not needed until the first turn is answered, so
+# they are imported on first use (or by the warm-up, see warm_up.py) rather than when the server starts
+def rest_client_class():
+    from twilio.rest import Client
+    return Client
+
+
+def voice_response():
+    from twilio.twiml.voice_response import VoiceResponse
+    return VoiceResponse()
+
+
+class TwilioCall:
+    AUTH_TOKEN = os.environ.get('TWILIO_AUTH_TOKEN')
+    SERVICE_DNS = os.environ.get('URL')
+    API_URL = os.environ.get('TWILIO_API_URL', DEFAULT_API_URL)
+    POOL_SIZE = int(os.environ.get('TWILIO_POOL_SIZE', 10))
+    API_TIMEOUT_SECS = float(os.environ.get('TWILIO_API_TIMEOUT_SECS', 10))
+
+    rest_clients = {}
+    rest_clients_lock = threading.Lock()
+    pool_stats = PoolStats()
+    http_client = None
+    http_client_lock = threading.Lock()
+
+    def __init__(self, account_sid, call_sid):
+        self.account_sid = account_sid
+        self.auth_token = self.AUTH_TOKEN
+        self.service_dns = self.SERVICE_DNS
+        self.call_sid = call_sid
+        self.store = shared_store()
+        self.twiml = None
+
+    def update_url(self):
+        return "{0}/{1}".format(self.service_dns, "updatecall")
+
+    # the http client every rest client sends through, created on first use
+    @classmethod
+    def pooled_http_client(cls):
+        if cls.http_client is None:
+            with cls.http_client_lock:
+                if cls.http_client is None:
+                    from twilio_http import PooledTwilioHttpClient
+                    cls.http_client = PooledTwilioHttpClient(cls.API_URL, cls.pool_stats, cls.POOL_SIZE, cls.API_TIMEOUT_SECS)
+        return cls.http_client
+
+    # one rest client per account, all of them on the same connection pool
+    @classmethod
+    def rest_client(cls, account_sid, auth_token):
+        key = (account_sid, auth_token)
+        client = cls.rest_clients.get(key)
+        if client is None:
+            with cls.rest_clients_lock:
+                client = cls.rest_clients.get(key)
+                if client is None:
+                    client = rest_client_class()(account_sid, auth_token, http_client=cls.pooled_http_client())
+                    cls.rest_clients[key] = client
+        return client
+
+    def update(self):
+        rest_client = self.rest_client(self.account_sid, self.auth_token)
+        if self.store.inline:
+            rest_client.calls(self.call_sid).update(twiml=self.twiml)
+        else:
+            rest_client.calls(self.call_sid).update(method="POST", url=self.update_url())
+
+    def update_params(self):
+        if self.store.inline:
+            return {"Twiml": self.twiml}
+        return {"Url": self.update_url(), "Method": "POST"}
+
+    # same call update as update(), sent with the given aiohttp session instead of the twilio rest client
+    async def update_async(self, session):
+        import aiohttp
+
+        call_url = "{0}/2010-04-01/Accounts/{1}/Calls/{2}.json".format(self.API_URL, self.account_sid, self.call_sid)
+        async with session.post(call_url,
+                                data=self.update_params(),
+                                auth=aiohttp.BasicAuth(self.account_sid, self.auth_token)) as response:
+            response.raise_for_status()
+            await response.read()
+
+    def persist(self, response):
+        self.twiml = response
+        if not self.store.inline:
+            self.store.put(self.call_sid, response)
+
+    # persist() off the event loop when the store does network I/O
+    async def persist_async(self, response):
+        if self.store.blocking:
+            await asyncio.get_event_loop().run_in_executor(None, self.persist, response)
+        else:
+            self.persist(response)
+
+
+# whether the call ends after this lex response is played back
+def is_goodbye(lex_response):
+    dialog_state = lex_response.get("DialogState")
+    intent_name = lex_response.get("IntentName")
+    return intent_name is not None and intent_name == "GoodbyeIntent" and dialog_state == "Fulfilled"
+
+
+# create the TwiML that plays back the lex response, hanging up once the goodbye intent is fulfilled
+def build_twiml(lex_response):
+    response = voice_response()
+    response.say(lex_response.get("Message"))
+
+    if is_goodbye(lex_response):
+        # hang up the call after this
+        response.hangup()
+    else:
+        response.pause(40)
+
+    return response
+
+
+# served by /updatecall when the store has no TwiML for the call (expired, or already served): keep listening
+def fallback_twiml():
+    response = voice_response()
+    response.pause(40)
+    return response.to_xml()
@@ -0,0 +1,29 @@
+"""
+This module contains the Twilio REST client's HTTP client on an instrumented connection pool
+
+It is kept apart from twilio_call.py because importing it pulls in
+twilio.rest's HTTP stack, which TwilioCall only needs once the first call
+update is sent (or the start up warm-up runs, see warm_up.py).
+"""
+
+from twilio.http.http_client import TwilioHttpClient
+
+from http_session_pool import InstrumentedHTTPAdapter
+from twilio_call import DEFAULT_API_URL
+
+
+class PooledTwilioHttpClient(TwilioHttpClient):
+    """TwilioHttpClient on an instrumented connection pool, sending api.twilio.com requests to api_url"""
+
+    def __init__(self, api_url, pool_stats, pool_size, timeout):
+        super().__init__(pool_connections=True, timeout=timeout)
+        self.api_url = api_url.rstrip("/")
+        adapter = InstrumentedHTTPAdapter(pool_stats, idle_timeout=50, keep_alive=True,
+                                          pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, method, url, *args, **kwargs):
+        if url.startswith(DEFAULT_API_URL):
+            url = self.api_url + url[len(DEFAULT_API_URL):]
+        return super().request(method, url, *args, **kwargs)
@@ -0,0 +1,215 @@
+"""
+This module contains the stores that hand TwiML from a call's media stream to /updatecall
+
+After a turn, the TwiML answering the caller is stored under the CallSid and
+the call is pointed at /updatecall, which pops it from the store. With more
+than one task behind the load balancer Twilio's callback can land on another
+task than the one holding the call, so the store has to be shared.
+
+Stores (TWIML_STORE):
+    memory - in-process, bounded LRU with a TTL. Only correct with a single task/process;
+             with more than one worker (WORKERS, see workers.py) inline is used instead.
+    redis  - shared Redis (REDIS_URL), entries expire after the TTL. Needs the redis
+             package from requirements-optional.txt.
+    inline - nothing is stored; the TwiML is sent with the call update itself
+             (the twiml parameter), skipping the /updatecall round-trip.
+
+inline is the default, here and for the TwimlStore parameter
+serviceinfra_cfn.yml sets TWIML_STORE from, so a service scaled out to more
+tasks does not serve /updatecall from a task that never saw the call, and a
+local run behaves like a deployed one.
+
+Every store counts puts, hits, misses and expired entries and the time spent
+in put and pop, available from stats(). The memory store also counts the
+entries it evicted to stay within TWIML_MAX_ENTRIES, before their TTL.
+"""
+
+import collections
+import logging
+import os
+import threading
+import time
+
+from workers import worker_config
+
+
+class TwimlStore:
+    name = None
+    inline = False
+    # whether put and pop block on network I/O
+    blocking = False
+
+    def __init__(self, ttl_secs):
+        self.logger = logging.getLogger(__name__)
+        self.ttl_secs = ttl_secs
+        self.stats_lock = threading.Lock()
+        self.counters = {"Puts": 0, "Hits": 0, "Misses": 0, "Expired": 0, "Evicted": 0}
+        self.put_secs = 0.0
+        self.pop_secs = 0.0
+
+    def put(self, call_sid, twiml):
+        started = time.perf_counter()
+        self.put_twiml(call_sid, twiml)
+        with self.stats_lock:
+            self.counters["Puts"] = self.counters["Puts"] + 1
+            self.put_secs = self.put_secs + time.perf_counter() - started
+
+    # return and remove the TwiML stored for call_sid, None if there is none
+    def pop(self, call_sid):
+        started = time.perf_counter()
+        twiml = self.pop_twiml(call_sid)
+        with self.stats_lock:
+            self.counters["Hits" if twiml is not None else "Misses"] += 1
+            self.pop_secs = self.pop_secs + time.perf_counter() - started
+        return twiml
+
+    def count_expired(self, count=1):
+        with self.stats_lock:
+            self.counters["Expired"] = self.counters["Expired"] + count
+
+    def count_evicted(self, count=1):
+        with self.stats_lock:
+            self.counters["Evicted"] = self.counters["Evicted"] + count
+
+    def put_twiml(self, call_sid, twiml):
+        raise NotImplementedError
+
+    def pop_twiml(self, call_sid):
+        raise NotImplementedError
+
+    def stats(self):
+        with self.stats_lock:
+            stats = dict(self.counters)
+            pops = stats["Hits"] + stats["Misses"]
+            stats.update({"Backend": self.name,
+                          "HitRate": round(stats["Hits"] / float(pops), 3) if pops else None,
+                          "MeanPutMs": round(self.put_secs / stats["Puts"] * 1000, 3) if stats["Puts"] else None,
+                          "MeanPopMs": round(self.pop_secs / pops * 1000, 3) if pops else None})
+        return stats
+
+
+class InMemoryTwimlStore(TwimlStore):
+    name = "memory"
+
+    def __init__(self, ttl_secs, max_entries):
+        super().__init__(ttl_secs)
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def put_twiml(self, call_sid, twiml):
+        now = time.monotonic()
+        with self.lock:
+            self.entries.pop(call_sid, None)
+            self.entries[call_sid] = (twiml, now + self.ttl_secs)
+            expired, evicted = self.__evict(now)
+        if expired:
+            self.count_expired(expired)
+        if evicted:
+            self.count_evicted(evicted)
+
+    def pop_twiml(self, call_sid):
+        with self.lock:
+            entry = self.entries.pop(call_sid, None)
+        if entry is None:
+            return None
+        twiml, expires_at = entry
+        if expires_at < time.monotonic():
+            self.count_expired()
+            return None
+        return twiml
+
+    # drop expired entries from the oldest end, then the least recently stored ones above max_entries. returns how
+    # many of each were dropped
+    def __evict(self, now):
+        expired = 0
+        evicted = 0
+        while self.entries:
+            call_sid, (_, expires_at) = next(iter(self.entries.items()))
+            if expires_at < now:
+                expired = expired + 1
+            elif len(self.entries) > self.max_entries:
+                evicted = evicted + 1
+            else:
+                break
+            self.entries.popitem(last=False)
+        return expired, evicted
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class RedisTwimlStore(TwimlStore):
+    name = "redis"
+    blocking = True
+    KEY_PREFIX = "twiml:"
+
+    def __init__(self, ttl_secs, redis_url, client=None):
+        super().__init__(ttl_secs)
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(redis_url)
+        self.client = client
+
+    def put_twiml(self, call_sid, twiml):
+        self.client.set(self.KEY_PREFIX + call_sid, twiml, px=max(1, int(self.ttl_secs * 1000)))
+
+    def pop_twiml(self, call_sid):
+        # GET and DEL in one transaction, works on servers without GETDEL (added in redis 6.2)
+        pipeline = self.client.pipeline(transaction=True)
+        pipeline.get(self.KEY_PREFIX + call_sid)
+        pipeline.delete(self.KEY_PREFIX + call_sid)
+        twiml, _ = pipeline.execute()
+        if twiml is None:
+            return None
+        return twiml.decode("utf-8") if isinstance(twiml, bytes) else twiml
+
+
+class InlineTwimlStore(TwimlStore):
+    name = "inline"
+    inline = True
+
+    def put_twiml(self, call_sid, twiml):
+        pass
+
+    def pop_twiml(self, call_sid):
+        return None
+
+
+twiml_store_config = {
+    "Backend": os.environ.get('TWIML_STORE', 'inline'),
+    "TtlInSecs": float(os.environ.get('TWIML_TTL_SECS', 300)),
+    "MaxEntries": int(os.environ.get('TWIML_MAX_ENTRIES', 10000)),
+    # serviceinfra_cfn.yml sets it empty unless TwimlStore is redis
+    "RedisUrl": os.environ.get('REDIS_URL') or 'redis://localhost:6379/0'
+}
+
+
+def create_store(config=twiml_store_config):
+    backend = config["Backend"]
+    # another worker of this task would not find the TwiML of a call held by this one
+    if backend == InMemoryTwimlStore.name and worker_config["Workers"] > 1:
+        logging.getLogger(__name__).warning("the memory TwiML store is not shared between {0} workers, using inline".format(
+            worker_config["Workers"]))
+        backend = InlineTwimlStore.name
+    if backend == InMemoryTwimlStore.name:
+        return InMemoryTwimlStore(config["TtlInSecs"], config["MaxEntries"])
+    if backend == RedisTwimlStore.name:
+        return RedisTwimlStore(config["TtlInSecs"], config["RedisUrl"])
+    if backend == InlineTwimlStore.name:
+        return InlineTwimlStore(config["TtlInSecs"])
+    raise ValueError("unknown TwiML store {0}, expected memory, redis or inline".format(backend))
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+# the store configured for this process, created on first use
+def shared_store():
+    global _shared
+    if _shared is None:
+        with _shared_lock:
+            if _shared is None:
+                _shared = create_store()
+    return _shared
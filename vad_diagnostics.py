@@ -0,0 +1,121 @@
+"""
+This module contains bounded per-turn diagnostics for voice and silence detection
+
+EnergyRingBuffer keeps the energy and voiced/silent decision of the last
+`capacity` frames of a turn in preallocated arrays, so a long turn (or a call
+on which voice is never detected) costs a fixed amount of memory. At the end
+of a turn it is reduced to a summary: energy percentiles, voiced ratio and
+turn duration.
+
+VadDiagnostics keeps the summaries of the most recent turns and running
+totals for the whole process; the servers expose them on /debug/vad. Only
+turns picked by debug sampling (VAD_DEBUG_SAMPLE_RATE, 0 to 1) carry the
+per-frame energies and the voice activity graph, and nothing is formatted on
+the per-frame path.
+"""
+
+import array
+import collections
+import os
+import random
+import threading
+
+
+class EnergyRingBuffer:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.energies = array.array('H', [0]) * capacity
+        self.voiced = bytearray(capacity)
+        self.frames = 0
+        self.voiced_frames = 0
+        self.max_energy = 0
+
+    def append(self, rms, voiced):
+        index = self.frames % self.capacity
+        self.energies[index] = min(rms, 0xffff)
+        self.voiced[index] = voiced
+        self.frames = self.frames + 1
+        if voiced:
+            self.voiced_frames = self.voiced_frames + 1
+        if rms > self.max_energy:
+            self.max_energy = rms
+
+    def __len__(self):
+        return min(self.frames, self.capacity)
+
+    # retained (energy, voiced) values, oldest first
+    def retained(self):
+        start = self.frames % self.capacity if self.frames > self.capacity else 0
+        order = list(range(start, len(self))) + list(range(0, start))
+        return [self.energies[index] for index in order], [self.voiced[index] for index in order]
+
+    def percentiles(self, points=(10, 50, 90, 99)):
+        ordered = sorted(self.energies[:len(self)])
+        if not ordered:
+            return {"p{0}".format(point): 0 for point in points}
+        return {"p{0}".format(point): ordered[min(len(ordered) - 1, point * len(ordered) // 100)] for point in points}
+
+    def summary(self, duration_secs):
+        summary = {"Frames": self.frames,
+                   "RetainedFrames": len(self),
+                   "VoicedFrames": self.voiced_frames,
+                   "VoicedRatio": round(self.voiced_frames / float(self.frames), 3) if self.frames else 0.0,
+                   "DurationSecs": round(duration_secs, 3),
+                   "EnergyMax": self.max_energy}
+        summary.update({"Energy" + name.upper(): value for name, value in self.percentiles().items()})
+        return summary
+
+    def graph(self):
+        return "".join("^" if voiced else "." for voiced in self.retained()[1])
+
+
+class VadDiagnostics:
+    diagnostics_config = {
+        "FramesPerTurn": int(os.environ.get('VAD_DIAGNOSTICS_FRAMES', 1500)),
+        "RecentTurns": int(os.environ.get('VAD_DIAGNOSTICS_TURNS', 100)),
+        "DebugSampleRate": float(os.environ.get('VAD_DEBUG_SAMPLE_RATE', 0))
+    }
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, recent_turns, debug_sample_rate):
+        self.recent = collections.deque(maxlen=recent_turns)
+        self.debug_sample_rate = debug_sample_rate
+        self.lock = threading.Lock()
+        self.turns = 0
+        self.ended_turns = 0
+        self.frames = 0
+        self.voiced_frames = 0
+
+    @classmethod
+    def shared(cls):
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls(cls.diagnostics_config["RecentTurns"], cls.diagnostics_config["DebugSampleRate"])
+        return cls._shared
+
+    def new_buffer(self):
+        return EnergyRingBuffer(self.diagnostics_config["FramesPerTurn"])
+
+    # decide once per turn whether it keeps per-frame detail
+    def sample_debug(self):
+        return self.debug_sample_rate > 0 and random.random() < self.debug_sample_rate
+
+    def record_turn(self, summary):
+        with self.lock:
+            self.recent.append(summary)
+            self.turns = self.turns + 1
+            if summary.get("Ended"):
+                self.ended_turns = self.ended_turns + 1
+            self.frames = self.frames + summary["Frames"]
+            self.voiced_frames = self.voiced_frames + summary["VoicedFrames"]
+
+    def snapshot(self):
+        with self.lock:
+            return {"Turns": self.turns,
+                    "EndedTurns": self.ended_turns,
+                    "Frames": self.frames,
+                    "VoicedRatio": round(self.voiced_frames / float(self.frames), 3) if self.frames else 0.0,
+                    "RecentTurns": list(self.recent)}
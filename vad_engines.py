@@ -0,0 +1,224 @@
+"""
+This module contains the engines that decode Twilio audio and measure its energy
+
+Twilio media streams carry 8 kHz G.711 mu-law. A VadEngine turns a frame of
+mu-law bytes into 16-bit little-endian linear PCM (what is streamed to Lex)
+plus its RMS energy (what voice detection compares to VoiceThreshold). The
+energy is computed exactly like audioop.rms(), i.e. the integer part of
+sqrt(sum of squares / sample count), so thresholds mean the same thing on
+every engine.
+
+Engines:
+    audioop - audioop.ulaw2lin() and audioop.rms(). audioop is removed in Python 3.13.
+    numpy   - 256-entry lookup table decode, can process many frames (of one or
+              many calls) in a single batch with process_batch(). numpy is in
+              requirements-optional.txt.
+    python  - lookup table decode in pure Python, for when neither is available.
+
+The numpy and python engines measure the energy straight from the mu-law
+codes, summing a 256-entry table of squared samples, rather than from the
+decoded PCM: the result is the same, without reading the samples back.
+
+decode_into() writes the PCM into a caller's buffer, e.g. a slice of the
+reusable buffer the next Lex chunk is collected in, instead of returning new
+bytes for every frame. process_into() does the same and returns the energy.
+
+create_engine("auto") picks audioop, then numpy, then python. On 160-sample
+frames numpy's per-call overhead dominates, so audioop stays several times
+faster than numpy per frame; numpy is what replaces it from Python 3.13 on.
+Engines hold no per-call state, so create_engine() returns one shared
+instance per engine.
+"""
+
+import array
+import importlib.util
+import math
+import sys
+
+try:
+    import audioop
+except ImportError:
+    audioop = None
+
+# numpy takes tens of milliseconds to import and is not used while audioop is available, so it is only imported
+# once something needs it: a NumpyVadEngine, or playback.py's mu-law encoder
+numpy = None
+NUMPY_AVAILABLE = importlib.util.find_spec("numpy") is not None
+
+
+def import_numpy():
+    global numpy
+    if numpy is None:
+        import numpy as numpy_module
+        numpy = numpy_module
+    return numpy
+
+
+# G.711 mu-law to 16-bit linear, identical to audioop.ulaw2lin(data, 2)
+def ulaw_to_linear(ulaw_byte):
+    ulaw_byte = ~ulaw_byte & 0xff
+    exponent = (ulaw_byte >> 4) & 0x07
+    mantissa = ulaw_byte & 0x0f
+    sample = (((mantissa << 3) + 0x84) << exponent) - 0x84
+    return -sample if ulaw_byte & 0x80 else sample
+
+
+ULAW_TABLE = tuple(ulaw_to_linear(ulaw_byte) for ulaw_byte in range(256))
+# the square of every decoded sample, a frame's sum of squares is the sum of its codes' entries
+ULAW_SQUARED_TABLE = tuple(sample * sample for sample in ULAW_TABLE)
+
+
+# rms as audioop.rms() computes it, from the sum of squares of sample_count samples
+def rms_of(sum_squares, sample_count):
+    if not sample_count:
+        return 0
+    return int(math.sqrt(float(sum_squares) / sample_count))
+
+
+class VadEngine:
+    name = None
+
+    def decode(self, ulaw_data):
+        raise NotImplementedError
+
+    def rms(self, pcm_data):
+        raise NotImplementedError
+
+    # decode a frame into out, a writable buffer of 2 bytes per sample
+    def decode_into(self, ulaw_data, out):
+        out[:] = self.decode(ulaw_data)
+
+    # decode a frame into out and return its rms
+    def process_into(self, ulaw_data, out):
+        self.decode_into(ulaw_data, out)
+        return self.rms(out)
+
+    # decode a frame and return (pcm bytes, rms)
+    def process(self, ulaw_data):
+        pcm_data = self.decode(ulaw_data)
+        return pcm_data, self.rms(pcm_data)
+
+    # decode many frames, e.g. the latest frame of every call, returns ([pcm bytes], [rms])
+    def process_batch(self, ulaw_frames):
+        results = [self.process(ulaw_data) for ulaw_data in ulaw_frames]
+        return [pcm_data for pcm_data, _ in results], [rms for _, rms in results]
+
+
+class AudioopVadEngine(VadEngine):
+    name = "audioop"
+
+    def decode(self, ulaw_data):
+        return audioop.ulaw2lin(ulaw_data, 2)
+
+    def rms(self, pcm_data):
+        return audioop.rms(pcm_data, 2)
+
+
+class PythonVadEngine(VadEngine):
+    name = "python"
+
+    def decode(self, ulaw_data):
+        samples = array.array('h', [ULAW_TABLE[ulaw_byte] for ulaw_byte in ulaw_data])
+        if sys.byteorder != "little":
+            samples.byteswap()
+        return samples.tobytes()
+
+    def decode_into(self, ulaw_data, out):
+        if sys.byteorder != "little":
+            return super().decode_into(ulaw_data, out)
+        samples = memoryview(out).cast('h')
+        for index, ulaw_byte in enumerate(ulaw_data):
+            samples[index] = ULAW_TABLE[ulaw_byte]
+
+    def rms(self, pcm_data):
+        samples = array.array('h')
+        samples.frombytes(pcm_data)
+        if sys.byteorder != "little":
+            samples.byteswap()
+        return rms_of(sum(sample * sample for sample in samples), len(samples))
+
+    def ulaw_rms(self, ulaw_data):
+        return rms_of(sum(map(ULAW_SQUARED_TABLE.__getitem__, ulaw_data)), len(ulaw_data))
+
+    def process_into(self, ulaw_data, out):
+        self.decode_into(ulaw_data, out)
+        return self.ulaw_rms(ulaw_data)
+
+    def process(self, ulaw_data):
+        return self.decode(ulaw_data), self.ulaw_rms(ulaw_data)
+
+
+class NumpyVadEngine(VadEngine):
+    name = "numpy"
+
+    def __init__(self):
+        import_numpy()
+        self.table = numpy.array(ULAW_TABLE, dtype='<i2')
+        self.squared_table = numpy.array(ULAW_SQUARED_TABLE, dtype=numpy.int64)
+
+    def decode(self, ulaw_data):
+        return self.table[numpy.frombuffer(ulaw_data, dtype=numpy.uint8)].tobytes()
+
+    def decode_into(self, ulaw_data, out):
+        numpy.take(self.table, numpy.frombuffer(ulaw_data, dtype=numpy.uint8), out=numpy.frombuffer(out, dtype='<i2'))
+
+    def rms(self, pcm_data):
+        samples = numpy.frombuffer(pcm_data, dtype='<i2').astype(numpy.int64)
+        return rms_of(samples.dot(samples), len(samples))
+
+    def process_into(self, ulaw_data, out):
+        codes = numpy.frombuffer(ulaw_data, dtype=numpy.uint8)
+        self.table.take(codes, out=numpy.frombuffer(out, dtype='<i2'))
+        return rms_of(self.squared_table.take(codes).sum(), len(codes))
+
+    def process(self, ulaw_data):
+        codes = numpy.frombuffer(ulaw_data, dtype=numpy.uint8)
+        return self.table.take(codes).tobytes(), rms_of(self.squared_table.take(codes).sum(), len(codes))
+
+    def process_batch(self, ulaw_frames):
+        if not ulaw_frames:
+            return [], []
+        frame_length = len(ulaw_frames[0])
+        if frame_length == 0 or any(len(ulaw_data) != frame_length for ulaw_data in ulaw_frames):
+            return super().process_batch(ulaw_frames)
+
+        codes = numpy.frombuffer(b"".join(ulaw_frames), dtype=numpy.uint8).reshape(len(ulaw_frames), frame_length)
+        samples = self.table.take(codes)
+        # squares summed exactly in int64, then the same float division and sqrt as audioop
+        sum_squares = self.squared_table.take(codes).sum(axis=1).astype(numpy.float64)
+        energies = numpy.sqrt(sum_squares / frame_length).astype(numpy.int64)
+        return [row.tobytes() for row in samples], energies.tolist()
+
+
+ENGINES = {
+    AudioopVadEngine.name: AudioopVadEngine,
+    NumpyVadEngine.name: NumpyVadEngine,
+    PythonVadEngine.name: PythonVadEngine
+}
+
+
+def available_engines():
+    names = []
+    if audioop is not None:
+        names.append(AudioopVadEngine.name)
+    if NUMPY_AVAILABLE:
+        names.append(NumpyVadEngine.name)
+    names.append(PythonVadEngine.name)
+    return names
+
+
+_engines = {}
+
+
+def create_engine(name="auto"):
+    if name in _engines:
+        return _engines[name]
+    requested = name
+    if name == "auto":
+        name = available_engines()[0]
+    if name not in ENGINES:
+        raise ValueError("unknown VAD engine {0}, expected one of auto, {1}".format(name, ", ".join(ENGINES)))
+    if name not in available_engines():
+        raise ValueError("VAD engine {0} is not available in this environment".format(name))
+    engine = _engines[requested] = ENGINES[name]()
+    return engine
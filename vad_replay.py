@@ -0,0 +1,123 @@
+"""
+This module replays recorded Twilio media payloads through voice and silence detection
+
+The replay runs VoiceAndSilenceDetectingLexClient exactly as a call would,
+but with a RecordingLexClient in place of the Lex stream, and feeds the
+payloads as fast as they can be processed. Since end pointing is timed by
+audio samples, the decisions are the same as in real time and the same on
+every run, which makes recorded calls usable as regression cases for
+VAD changes.
+
+Input files contain one payload per line, either the base64 payload itself or
+a Twilio media stream message (JSON) as logged by the servers; non-media
+messages are skipped.
+
+Usage:
+    python vad_replay.py recording.txt [recording2.txt ...]
+"""
+
+import json
+import sys
+
+from voice_and_silence_detecting_lex_wrapper import VoiceAndSilenceDetectingLexClient
+
+
+class RecordingLexClient:
+    """Stands in for LexClientStreaming, keeping the audio instead of sending it"""
+
+    def __init__(self, user_id, response=None, accept=None):
+        self.user_id = user_id
+        self.chunks = []
+        self.stopped = False
+        self.response = response or {"DialogState": "ElicitIntent", "Message": None, "Utterance": None,
+                                     "LexRequestId": None, "IntentName": None, "Audio": None}
+
+    def prewarm(self):
+        pass
+
+    def add_to_stream(self, data):
+        if not self.stopped:
+            self.chunks.append(data)
+
+    def stop(self):
+        self.stopped = True
+
+    def abort(self):
+        self.stopped = True
+
+    def is_crashed(self):
+        return False
+
+    def get_response(self):
+        return self.response
+
+    def get_timings(self):
+        return {}
+
+
+class ReplayVoiceAndSilenceDetectingLexClient(VoiceAndSilenceDetectingLexClient):
+    lex_client_class = RecordingLexClient
+
+
+class ReplayRecorder:
+    """Voice and silence detected callback recording where each decision was taken"""
+
+    def __init__(self):
+        self.frame_index = 0
+        self.turn = 0
+        self.decisions = []
+        self.turn_ended = False
+
+    def voice_detected(self):
+        self.decisions.append({"Turn": self.turn, "Event": "voice_detected", "Frame": self.frame_index})
+
+    def silence_detected(self, **kwargs):
+        self.decisions.append({"Turn": self.turn, "Event": "silence_detected", "Frame": self.frame_index})
+        self.turn_ended = True
+
+
+# returns the base64 payloads of the media messages in a recording
+def read_payloads(lines):
+    payloads = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("{"):
+            message = json.loads(line)
+            if message.get("event") == "media":
+                payloads.append(message["media"]["payload"])
+        else:
+            payloads.append(line)
+    return payloads
+
+
+# run the payloads through voice and silence detection, starting a new turn after every detected silence as
+# TwilioDataProcessor.reset() does, with one noise floor for the whole recording. returns the decisions and, per
+# completed turn, the chunks sent to lex
+def replay(payloads, user_id="REPLAY"):
+    recorder = ReplayRecorder()
+    noise_floor = ReplayVoiceAndSilenceDetectingLexClient.call_noise_floor()
+    client = ReplayVoiceAndSilenceDetectingLexClient(user_id, [recorder], [recorder], noise_floor=noise_floor)
+    turn_audio = []
+
+    for frame_index, payload in enumerate(payloads):
+        recorder.frame_index = frame_index
+        client.stream_to_lex(payload)
+        if recorder.turn_ended:
+            turn_audio.append(client.lex_client.chunks)
+            recorder.turn = recorder.turn + 1
+            recorder.turn_ended = False
+            client = ReplayVoiceAndSilenceDetectingLexClient(user_id, [recorder], [recorder], noise_floor=noise_floor)
+
+    return recorder.decisions, turn_audio
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        with open(path) as recording:
+            decisions, turn_audio = replay(read_payloads(recording))
+        print(path)
+        for decision in decisions:
+            print("  turn {Turn}: {Event} at frame {Frame} ({0:.2f} s)".format(decision["Frame"] * 0.02, **decision))
+        print("  audio sent to lex per turn (bytes): {0}".format([sum(len(chunk) for chunk in chunks) for chunks in turn_audio]))
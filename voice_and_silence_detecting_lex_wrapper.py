@@ -1,43 +1,95 @@
-import audioop
-import base64
+import binascii
+import collections
+import inspect
 import logging
-import time
+import math
+import os
 import threading
-from datetime import datetime
-from lex_streaming_client import LexClientStreaming
+from endpointing import Endpointer
+from lex_streaming_client import AsyncLexClientStreaming, LexClientStreaming
+from noise_floor import NoiseFloor
+from vad_diagnostics import VadDiagnostics
+from vad_engines import create_engine
 
 class VoiceAndSilenceDetectingLexClient:
+    lex_client_class = LexClientStreaming
+
     vad_sd_config = {
         "VoiceThreshold": 500,
         "SilenceDurationTimeInSecs": 2,
         "TwilioRate": 8000,
         "LexRate": 16000,
         "Width": 2,
-        "Channels": 1
+        "Channels": 1,
+        # once voice has been detected, frames at or below this count as silence. defaults to VoiceThreshold
+        "SilenceThreshold": int(os.environ['VAD_SILENCE_THRESHOLD']) if 'VAD_SILENCE_THRESHOLD' in os.environ else None,
+        # consecutive voiced audio needed before voice counts as detected
+        "VoiceOnsetDurationInSecs": float(os.environ.get('VAD_VOICE_ONSET_SECS', 0)),
+        # audio from before voice is detected that is sent to lex along with the first voiced frame
+        "PreRollMs": int(os.environ.get('VAD_PRE_ROLL_MS', 200)),
+        # speech is sent to lex in chunks of up to this much audio rather than one chunk per 20 ms frame. the end of
+        # the utterance always goes out straight away, 0 sends every frame on its own
+        "LexChunkMs": int(os.environ.get('LEX_CHUNK_MS', 100)),
+        # voice and silence thresholds follow each call's noise floor (see noise_floor.py) instead of the fixed
+        # VoiceThreshold and SilenceThreshold
+        "AdaptiveThresholds": os.environ.get('VAD_ADAPTIVE_THRESHOLDS', 'false').lower() == 'true',
+        "Engine": os.environ.get('VAD_ENGINE', 'auto')
     }
 
-    def __init__(self, user_id, voice_detected_call_backs=[], silence_detected_call_backs=[]):
+    # the noise floor a call hands to the client of each of its turns, None with fixed thresholds
+    @classmethod
+    def call_noise_floor(cls):
+        if not cls.vad_sd_config["AdaptiveThresholds"]:
+            return None
+        return NoiseFloor(cls.vad_sd_config["TwilioRate"])
+
+    def __init__(self, user_id, voice_detected_call_backs=[], silence_detected_call_backs=[], prewarm=False, accept=None,
+                 noise_floor=None):
         self.logger = logging.getLogger(__name__)
         self.voice_threshold = self.vad_sd_config["VoiceThreshold"]
         self.silence_duration_time = self.vad_sd_config["SilenceDurationTimeInSecs"]
+        self.silence_threshold = self.vad_sd_config["SilenceThreshold"]
+        if self.silence_threshold is None:
+            self.silence_threshold = self.voice_threshold
         self.twilio_rate = self.vad_sd_config["TwilioRate"]
         self.lex_rate = self.vad_sd_config["LexRate"]
         self.width = self.vad_sd_config["Width"]
         self.channels = self.vad_sd_config["Channels"]
+        self.engine = create_engine(self.vad_sd_config["Engine"])
 
-
-        self.lex_client = LexClientStreaming(user_id)
-        self.rms_graph = []
-        self.rms_values = []
-        self.last_detected_voice_time = None
+        self.lex_client = self.lex_client_class(user_id, accept=accept)
+        if prewarm:
+            self.lex_client.prewarm()
+        self.diagnostics = VadDiagnostics.shared()
+        self.energies = self.diagnostics.new_buffer()
+        self.debug_sampled = self.diagnostics.sample_debug()
+        self.diagnostics_recorded = False
+        self.onset_audio_data = []
+        # twilio sends 20 ms frames. the pre-roll frames are bytearrays, reused once they drop out of it
+        self.pre_roll = collections.deque(maxlen=int(math.ceil(self.vad_sd_config["PreRollMs"] / 20.0)))
+        # frames are decoded straight into this buffer, speech is collected in it until a chunk is full
+        self.chunk_buffer = bytearray(self.vad_sd_config["LexChunkMs"] * self.twilio_rate // 1000 * self.width)
+        self.chunk_view = memoryview(self.chunk_buffer)
+        self.chunk_length = 0
+        self.endpointer = Endpointer(self.twilio_rate,
+                                     self.voice_threshold,
+                                     self.silence_threshold,
+                                     self.silence_duration_time,
+                                     self.vad_sd_config["VoiceOnsetDurationInSecs"])
+        self.noise_floor = noise_floor
+        if noise_floor is not None:
+            self.endpointer.onset_threshold = noise_floor.onset_threshold
+            self.endpointer.offset_threshold = noise_floor.offset_threshold
 
         self.voice_detected_call_backs = voice_detected_call_backs
         self.silence_detected_call_backs = silence_detected_call_backs
 
         self.stop_data_processing = threading.Event()
-        self.logger.info("VoiceAndSilenceDetectingLexClient configured with voice threshold {0}, silence duration {1}, lex user id {2}"
-                         .format(self.voice_threshold,
+        self.logger.info("VoiceAndSilenceDetectingLexClient configured with voice threshold {0}, silence threshold {1}, silence duration {2}, VAD engine {3}, lex user id {4}"
+                         .format(self.voice_threshold if noise_floor is None else "adaptive",
+                                 self.silence_threshold if noise_floor is None else "adaptive",
                                  self.silence_duration_time,
+                                 self.engine.name,
                                  user_id))
 
 
@@ -47,57 +99,102 @@ class VoiceAndSilenceDetectingLexClient:
             return
 
         data = self.__decode_data(base_64_encoded_data)
+        frame, rms = self.decode_frame(data)
+
+        #self.logger.info("RMS value is {0}".format(rms))
+        sample_count = len(frame) // self.width
+        if self.noise_floor is not None:
+            self.noise_floor.update(rms, sample_count)
+            self.endpointer.onset_threshold = self.noise_floor.onset_threshold
+            self.endpointer.offset_threshold = self.noise_floor.offset_threshold
+        event = self.endpointer.update(rms, sample_count)
+        self.energies.append(rms, self.endpointer.voiced)
 
-        raw_audio_data = audioop.ulaw2lin(data, self.width)
-        #raw_audio_data, state = audioop.lin2adpcm(raw_audio_data, self.width, None)
+        if event == Endpointer.VOICE_STARTED:
+            # voice detected for first time
+            self.logger.debug("voice detected for first time")
+            self.voice_detected()
+            # audio from just before the threshold was crossed goes out together with this frame in one write
+            self.lex_client.add_to_stream(b"".join(list(self.pre_roll) + self.onset_audio_data + [frame]))
+            self.pre_roll.clear()
+            self.onset_audio_data = []
+        elif self.endpointer.state == Endpointer.ONSET:
+            # voice has to last for the configured onset duration before it counts, hold on to it until then
+            self.onset_audio_data.append(bytearray(frame))
+        elif self.endpointer.state == Endpointer.SPEECH:
+            self.chunk_length = self.chunk_length + len(frame)
+            # flush when the next frame of the same size would not fit
+            if self.chunk_length + len(frame) > len(self.chunk_buffer):
+                self.flush_chunk()
+        elif event == Endpointer.UTTERANCE_ENDED:
+            self.chunk_length = self.chunk_length + len(frame)
+            self.flush_chunk()
+            self.logger.debug("{0} seconds of audio since last detected voice is higher than configured time for silence {1} seconds. closing connection to lex."
+                              .format(self.endpointer.silence_secs,
+                                      self.silence_duration_time))
+            self.end_of_utterance()
+        else:
+            # keep the last frames before voice is detected, the start of soft words is often below the threshold
+            self.pre_roll.extend(self.onset_audio_data)
+            self.onset_audio_data = []
+            self.keep_pre_roll(frame)
+            #self.logger.debug("voice has not been detected even once. not starting the silence detection counter")
 
-        # raw_audio_data, state = audioop.ratecv(raw_audio_data,
-        #                                        self.width,
-        #                                        self.channels,
-        #                                        self.twilio_rate,
-        #                                        self.lex_rate,
-        #                                        None)
+    # decode a mu-law frame into the chunk buffer after the speech collected so far, returns a view of its pcm and
+    # its rms
+    def decode_frame(self, ulaw_data):
+        pcm_length = len(ulaw_data) * self.width
+        if self.chunk_length + pcm_length > len(self.chunk_buffer):
+            self.flush_chunk()
+            if pcm_length > len(self.chunk_buffer):
+                self.chunk_buffer = bytearray(pcm_length)
+                self.chunk_view = memoryview(self.chunk_buffer)
+        frame = self.chunk_view[self.chunk_length:self.chunk_length + pcm_length]
+        return frame, self.engine.process_into(ulaw_data, frame)
 
-        rms = audioop.rms(raw_audio_data, self.width)
+    # hand the speech collected in the chunk buffer to lex as one chunk
+    def flush_chunk(self):
+        if self.chunk_length:
+            self.lex_client.add_to_stream(bytes(self.chunk_view[:self.chunk_length]))
+            self.chunk_length = 0
 
-        #self.logger.info("RMS value is {0}".format(rms))
-        self.rms_values.append(rms)
-        if rms > self.voice_threshold:
-            #self.logger.debug("voice detected in input data")
-            self.rms_graph.append("^")
-
-            if self.last_detected_voice_time is None:
-                # voice detected for first time
-                self.logger.debug("voice detected for first time")
-                self.voice_detected()
-            self.last_detected_voice_time = datetime.now()
-            self.lex_client.add_to_stream(raw_audio_data)
+    # copy the frame into the pre-roll, reusing the buffer of the frame it pushes out
+    def keep_pre_roll(self, frame):
+        if not self.pre_roll.maxlen:
+            return
+        if len(self.pre_roll) == self.pre_roll.maxlen and len(self.pre_roll[0]) == len(frame):
+            reused = self.pre_roll.popleft()
+            reused[:] = frame
+            self.pre_roll.append(reused)
         else:
-            self.rms_graph.append(".")
-            #self.logger.debug("silence detected in input data")
-
-            if self.last_detected_voice_time:
-                # check if elapsed time is greater than configured time for silence
-                self.lex_client.add_to_stream(raw_audio_data)
-
-                silence_time = (datetime.now() - self.last_detected_voice_time).total_seconds()
-                if silence_time >= self.silence_duration_time:
-                    self.logger.debug("elapsed time {0} seconds since last detected voice time {1} is higher than configured time for silence {2} seconds. closing connection to lex."
-                                      .format(silence_time,
-                                              self.last_detected_voice_time,
-                                              self.silence_duration_time))
-
-                    # stop lex client now
-                    self.lex_client.stop()
-                    self.stop_data_processing.set()
-                    self.logger.info("Voice activity graph {0}".format("".join(self.rms_graph)))
-                    self.logger.info("RMS values {0}".format(self.rms_values))
-                    self.silence_detected()
-            #else:
-            #   self.logger.debug("voice has not been detected even once. not starting the silence detection counter")
+            self.pre_roll.append(bytearray(frame))
+
+    # stop lex client now and hand its response to the silence detected callbacks
+    def end_of_utterance(self):
+        self.lex_client.stop()
+        self.stop_data_processing.set()
+        self.record_diagnostics()
+        self.silence_detected()
+
+    # summarize this turn's energies once, with the per-frame detail only if the turn was picked for debug sampling
+    def record_diagnostics(self):
+        if self.diagnostics_recorded:
+            return
+        self.diagnostics_recorded = True
+        summary = self.energies.summary(self.endpointer.elapsed_secs)
+        summary["Ended"] = self.endpointer.state == Endpointer.ENDED
+        summary["VoiceThreshold"] = int(self.endpointer.onset_threshold)
+        if self.noise_floor is not None:
+            summary["NoiseFloor"] = int(self.noise_floor.floor)
+            summary["SilenceThreshold"] = int(self.endpointer.offset_threshold)
+        if self.debug_sampled:
+            summary["Energies"] = self.energies.retained()[0]
+            summary["Graph"] = self.energies.graph()
+            self.logger.debug("Voice activity graph {0}".format(summary["Graph"]))
+        self.diagnostics.record_turn(summary)
 
     def __decode_data(self, data):
-        return base64.b64decode(data)
+        return binascii.a2b_base64(data)
 
     def voice_detected(self):
         self.logger.info("invoking voice detected callbacks")
@@ -110,15 +207,81 @@ class VoiceAndSilenceDetectingLexClient:
         self.logger.info("invoking silence detected callbacks with lex data ")
         lex_response = self.lex_client.get_response()
         self.logger.info("lex response is {0}".format(lex_response))
+        self.logger.info("lex turn timings {0}".format(self.lex_client.get_timings()))
 
         for silence_detected_call_back in self.silence_detected_call_backs:
             self.logger.info("invoking silence detected callback {0}".format(silence_detected_call_back))
             silence_detected_call_back.silence_detected(lex_response = lex_response)
 
-if __name__ == '__main__':
-    data = "/v7+/v7+/n7+/v5+fn7+fn7+/v5+/n7+/v7+/v5+fn7+/H5+/vx+/vz+fv78fnz+/Hx+/P5+/P56fvp+evz6fHz6/nr++np6+P54/Ph6fPR+dvr2dnj2/HL+8Hpy9vJyeO/+b/zydnT2+nh++n5+/P5+fnz+/n56/Pp6evb6dn70fnT89Hx0+PZ4ePj6dnr2+nR+9H50+vR6ePz6enr8+g=="
-    lex_client = VoiceAndSilenceDetectingLexClient()
-    lex_client.stream_to_lex(data)
-    time.sleep(2)
-    lex_client.stream_to_lex("/////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////w==")
+    # time.monotonic() of the points of this turn the lex client recorded, see metrics.LEX_TIMINGS
+    def get_lex_timestamps(self):
+        return getattr(self.lex_client, "timings", {})
+
+    # release the underlying lex stream when the call ends, e.g. before silence has been detected. the lex request of
+    # an unfinished turn is aborted rather than completed
+    def close(self):
+        self.stop_data_processing.set()
+        self.record_diagnostics()
+        self.lex_client.abort()
+
+
+class AsyncVoiceAndSilenceDetectingLexClient(VoiceAndSilenceDetectingLexClient):
+    """VoiceAndSilenceDetectingLexClient for use on an asyncio event loop.
 
+    Detection works as in the base class, but reaching the end of an utterance
+    only closes the lex stream. The caller awaits finish_utterance() to wait for
+    the lex response and run the silence detected callbacks, which may be
+    coroutines.
+    """
+    lex_client_class = AsyncLexClientStreaming
+
+    def end_of_utterance(self):
+        self.lex_client.stop()
+        self.stop_data_processing.set()
+
+    def is_utterance_complete(self):
+        return self.stop_data_processing.is_set()
+
+    # wait for lex to catch up with the audio streamed so far
+    async def drain(self):
+        await self.lex_client.drain()
+
+    async def finish_utterance(self):
+        await self.lex_client.stop_async()
+        self.record_diagnostics()
+        await self.silence_detected_async()
+
+    async def silence_detected_async(self):
+        self.logger.info("invoking silence detected callbacks with lex data ")
+        lex_response = self.lex_client.get_response()
+        self.logger.info("lex response is {0}".format(lex_response))
+        self.logger.info("lex turn timings {0}".format(self.lex_client.get_timings()))
+
+        for silence_detected_call_back in self.silence_detected_call_backs:
+            self.logger.info("invoking silence detected callback {0}".format(silence_detected_call_back))
+            result = silence_detected_call_back.silence_detected(lex_response = lex_response)
+            if inspect.isawaitable(result):
+                await result
+
+    async def close_async(self):
+        self.stop_data_processing.set()
+        self.record_diagnostics()
+        await self.lex_client.abort_async()
+
+if __name__ == '__main__':
+    # a smoke test of one turn: quiet audio, a second of speech and silence until the end of the utterance is
+    # detected. the audio goes to lex when LEX_BOT_NAME and the AWS settings are set, to a recording stand-in
+    # otherwise. benchmarks/load_harness.py runs whole calls through a server
+    from vad_replay import RecordingLexClient
+    logging.basicConfig(level=logging.INFO)
+    quiet = "/v7+/v7+/n7+/v5+fn7+fn7+/v5+/n7+/v7+/v5+fn7+/H5+/vx+/vz+fv78fnz+/Hx+/P5+/P56fvp+evz6fHz6/nr++np6+P54/Ph6fPR+dvr2dnj2/HL+8Hpy9vJyeO/+b/zydnT2+nh++n5+/P5+fnz+/n56/Pp6evb6dn70fnT89Hx0+PZ4ePj6dnr2+nR+9H50+vR6ePz6enr8+g=="
+    voiced = binascii.b2a_base64(bytes([0x00, 0x80]) * 80, newline=False).decode("ascii")
+    silent = "/////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////w=="
+    if not LexClientStreaming.lex_config["BotName"]:
+        VoiceAndSilenceDetectingLexClient.lex_client_class = RecordingLexClient
+    lex_client = VoiceAndSilenceDetectingLexClient("MAIN")
+    for data in [quiet] * 10 + [voiced] * 50:
+        lex_client.stream_to_lex(data)
+    while not lex_client.stop_data_processing.is_set():
+        lex_client.stream_to_lex(silent)
+    lex_client.close()
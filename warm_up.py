@@ -0,0 +1,209 @@
+"""
+This module contains the start up warm-up and the readiness reported on /ready
+
+A new task used to take calls as soon as it listened: the first turns paid
+for importing twilio.rest and the TwiML builders, deriving the SigV4 signing
+key and opening TLS connections to Lex and Twilio. Once the server listens,
+warm_up() (warm_up_async() in async_server.py) does that work ahead of the
+first call:
+
+    imports      - the modules twilio_call.py imports on first use, and the
+                   VAD engine, which imports numpy when that is the engine
+    signing_key  - today's Lex signing key, cached by SigV4Signer
+    lex          - WARM_UP_LEX_CONNECTIONS pooled connections to Lex
+    twilio       - WARM_UP_TWILIO_CONNECTIONS pooled connections to the Twilio API
+
+Warming up is best effort: a step that fails is logged and recorded, and the
+server is ready once the steps are done or WARM_UP_TIMEOUT_SECS have passed,
+whichever comes first. Pooled connections left idle for longer than the pool's
+idle timeout are re-established on checkout, so warming up helps the calls
+that come in during scale-out, not the first call of a task that sat idle.
+
+/ping is liveness: it answers as soon as the server listens. /ready answers
+503 until the worker is warm, and again once it drains on SIGTERM, so a load
+balancer health check on /ready only routes calls to warm workers (see
+admission.py for /ready while shedding load). With WARM_UP=false the server
+is ready as soon as it listens.
+"""
+
+import asyncio
+import collections
+import datetime
+import logging
+import os
+import threading
+import time
+
+from admission import AdmissionControl
+from http_session_pool import HttpSessionPool, warm_connections
+from lex_streaming_client import AsyncLexClientStreaming, LexClientStreaming
+from sigv4_signer import SigV4Signer
+from twilio_call import TwilioCall, rest_client_class, voice_response
+from vad_engines import create_engine
+from voice_and_silence_detecting_lex_wrapper import VoiceAndSilenceDetectingLexClient
+from workers import WorkerStats
+
+warm_up_config = {
+    "Enabled": os.environ.get('WARM_UP', 'true').lower() == 'true',
+    "LexConnections": int(os.environ.get('WARM_UP_LEX_CONNECTIONS', 2)),
+    "TwilioConnections": int(os.environ.get('WARM_UP_TWILIO_CONNECTIONS', 1)),
+    "TimeoutInSecs": float(os.environ.get('WARM_UP_TIMEOUT_SECS', 10))
+}
+
+
+class Readiness:
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.ready = False
+        self.started_at = None
+        self.ready_at = None
+        self.steps = collections.OrderedDict()
+        self.errors = {}
+
+    @classmethod
+    def shared(cls):
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls()
+        return cls._shared
+
+    def start(self):
+        with self.lock:
+            self.started_at = time.monotonic()
+
+    def step_done(self, name, secs, error=None):
+        with self.lock:
+            self.steps[name] = round(secs * 1000, 3)
+            if error is not None:
+                self.errors[name] = str(error)
+        if error is not None:
+            self.logger.warning("warm-up step {0} failed, continuing without it: {1}".format(name, error))
+
+    def set_ready(self, reason=None):
+        with self.lock:
+            if self.ready:
+                return
+            self.ready = True
+            self.ready_at = time.monotonic()
+            if reason is not None:
+                self.errors["ready"] = reason
+        self.logger.info("ready to take calls, warm-up steps {0} ms{1}".format(
+            dict(self.steps), "" if reason is None else ", " + reason))
+
+    # ready for new calls: warmed up, not draining and, with ADMISSION_UNREADY_WHEN_SHEDDING, not shedding load
+    def is_ready(self):
+        return self.ready and not WorkerStats.shared().draining and AdmissionControl.shared().ready()
+
+    def snapshot(self):
+        with self.lock:
+            warm_up_ms = None
+            if self.started_at is not None and self.ready_at is not None:
+                warm_up_ms = round((self.ready_at - self.started_at) * 1000, 3)
+            return {"Ready": self.ready,
+                    "Draining": WorkerStats.shared().draining,
+                    "Shedding": AdmissionControl.shared().shedding(),
+                    "WarmUpMs": warm_up_ms,
+                    "StepsMs": dict(self.steps),
+                    "Errors": dict(self.errors)}
+
+
+def load_modules():
+    rest_client_class()
+    load_modules_async()
+
+
+# twilio.rest is not used by async_server.py
+def load_modules_async():
+    voice_response()
+    create_engine(VoiceAndSilenceDetectingLexClient.vad_sd_config["Engine"])
+
+
+def derive_signing_key():
+    config = LexClientStreaming.lex_config
+    date_stamp = datetime.datetime.utcnow().strftime('%Y%m%d')
+    SigV4Signer.shared(config["AccessKeyId"], config["SecretAccessKey"]).get_signing_key(date_stamp, config["Region"], "lex")
+
+
+def warm_lex():
+    HttpSessionPool.shared().warm(LexClientStreaming.lex_endpoint(), warm_up_config["LexConnections"])
+
+
+def warm_twilio():
+    warm_connections(TwilioCall.pooled_http_client().session, TwilioCall.API_URL, warm_up_config["TwilioConnections"])
+
+
+# the steps for server.py: lex streams go through HttpSessionPool and call updates through the twilio rest client
+def warm_up_steps():
+    return [("imports", load_modules),
+            ("signing_key", derive_signing_key),
+            ("lex", warm_lex),
+            ("twilio", warm_twilio)]
+
+
+# keep-alive connections of an aiohttp session, opened by requests that are in flight together
+async def open_connections(session, url, connections):
+    async def head():
+        async with session.head(url, allow_redirects=False) as response:
+            await response.read()
+
+    await asyncio.gather(*[head() for _ in range(connections)])
+
+
+# the steps for async_server.py: lex streams and call updates share the aiohttp session, twilio.rest is not used
+def warm_up_steps_async(session):
+    return [("imports", load_modules_async),
+            ("signing_key", derive_signing_key),
+            ("lex", lambda: open_connections(session, AsyncLexClientStreaming.lex_endpoint(),
+                                             warm_up_config["LexConnections"])),
+            ("twilio", lambda: open_connections(session, TwilioCall.API_URL, warm_up_config["TwilioConnections"]))]
+
+
+# run the steps, then mark the process ready. blocks, run it in its own thread
+def warm_up(steps):
+    readiness = Readiness.shared()
+    readiness.start()
+    if not warm_up_config["Enabled"]:
+        readiness.set_ready()
+        return
+    timer = threading.Timer(warm_up_config["TimeoutInSecs"], readiness.set_ready, ["warm-up timed out"])
+    timer.daemon = True
+    timer.start()
+    for name, step in steps:
+        started = time.monotonic()
+        try:
+            step()
+            readiness.step_done(name, time.monotonic() - started)
+        except Exception as e:
+            readiness.step_done(name, time.monotonic() - started, e)
+    timer.cancel()
+    readiness.set_ready()
+
+
+async def warm_up_async(steps):
+    readiness = Readiness.shared()
+    readiness.start()
+    if not warm_up_config["Enabled"]:
+        readiness.set_ready()
+        return
+
+    async def run_steps():
+        for name, step in steps:
+            started = time.monotonic()
+            try:
+                result = step()
+                if asyncio.iscoroutine(result):
+                    await result
+                readiness.step_done(name, time.monotonic() - started)
+            except Exception as e:
+                readiness.step_done(name, time.monotonic() - started, e)
+
+    try:
+        await asyncio.wait_for(run_steps(), warm_up_config["TimeoutInSecs"])
+        readiness.set_ready()
+    except asyncio.TimeoutError:
+        readiness.set_ready("warm-up timed out")
@@ -0,0 +1,213 @@
+"""
+This module contains the prefork supervisor running a server in several worker processes
+
+Frame decoding, voice detection and JSON all hold the GIL, so one server
+process uses at most one core whatever the container is given. With WORKERS
+set above 1, the server's __main__ forks that many workers; each one binds
+the port itself with SO_REUSEPORT and the kernel spreads new connections
+over them. A call's WebSocket stays on the worker that accepted it for the
+whole call.
+
+Twilio's /updatecall callback is a new connection and can land on any
+worker, so the TwiML has to be reachable from all of them: the redis store
+is shared, and the inline store sends the TwiML with the call update
+itself. The in-process memory store is not shared, create_store() uses
+inline instead when there is more than one worker.
+
+On SIGTERM (or SIGINT) the supervisor passes SIGTERM on to the workers. A
+worker stops accepting connections, lets its active calls finish for up to
+DRAIN_TIMEOUT_SECS and exits; workers still running after that are killed.
+A worker that exits on its own is replaced. With WORKERS=1 (the default) the
+server runs in this process, as before, and drains the same way.
+
+WorkerStats counts the calls a worker is handling, available from /debug/worker.
+
+Whichever worker takes a scrape of /metrics answers it, so the metrics are kept
+in WorkerTables: a row of numbers per worker, in memory mapped before the
+workers fork and shared by all of them. A worker only writes its own row and
+/metrics sums the rows, so a scrape shows the whole process group whichever
+worker answers it. A worker that is replaced takes over the row of the one
+it replaces, so counters keep counting up.
+"""
+
+import logging
+import mmap
+import os
+import random
+import signal
+import socket
+import threading
+import time
+
+worker_config = {
+    "Workers": int(os.environ.get('WORKERS', 1)),
+    "DrainTimeoutInSecs": float(os.environ.get('DRAIN_TIMEOUT_SECS', 60))
+}
+
+
+# a listening socket that other processes can bind to the same port, the kernel balances connections between them
+def reuse_port_socket(port, backlog=1024):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    listener.bind(('', port))
+    listener.listen(backlog)
+    return listener
+
+
+# the index of this worker, None when the server runs in a single process
+def worker_index():
+    return int(os.environ['WORKER_INDEX']) if 'WORKER_INDEX' in os.environ else None
+
+
+class WorkerTable:
+    """Float values, a row of `width` per worker, in shared memory. Create it before the workers fork"""
+
+    def __init__(self, workers, width):
+        self.workers = max(1, workers)
+        self.width = width
+        self.memory = mmap.mmap(-1, self.workers * width * 8)
+        self.values = memoryview(self.memory).cast('d')
+
+    # the row of the given worker, the first one in a single process
+    def row(self, worker=None):
+        start = (worker or 0) * self.width
+        return self.values[start:start + self.width]
+
+    def rows(self):
+        return [self.row(worker) for worker in range(self.workers)]
+
+    # every column summed over the workers
+    def totals(self):
+        return [sum(column) for column in zip(*self.rows())]
+
+
+class WorkerStats:
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.worker = worker_index()
+        self.active_calls = 0
+        self.calls = 0
+        self.draining = False
+
+    @classmethod
+    def shared(cls):
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls()
+        return cls._shared
+
+    def call_started(self):
+        with self.lock:
+            self.active_calls = self.active_calls + 1
+            self.calls = self.calls + 1
+
+    def call_ended(self):
+        with self.lock:
+            self.active_calls = self.active_calls - 1
+
+    def snapshot(self):
+        with self.lock:
+            return {"Worker": self.worker,
+                    "Workers": worker_config["Workers"],
+                    "Pid": os.getpid(),
+                    "ActiveCalls": self.active_calls,
+                    "Calls": self.calls,
+                    "Draining": self.draining}
+
+
+class WorkerSupervisor:
+    # a worker exiting sooner than this after its start is restarted with a delay, so a crashing one is not respawned in a loop
+    MIN_UPTIME_SECS = 1.0
+    # time given to workers on top of the drain timeout before they are killed
+    KILL_GRACE_SECS = 5.0
+
+    def __init__(self, workers, serve, drain_timeout):
+        self.logger = logging.getLogger(__name__)
+        self.workers = workers
+        self.serve = serve
+        self.drain_timeout = drain_timeout
+        # pid -> (worker index, started at)
+        self.children = {}
+        self.stopping_at = None
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for index in range(self.workers):
+            self.spawn(index)
+        while self.children:
+            self.reap()
+            if self.stopping_at is not None and time.monotonic() - self.stopping_at > self.drain_timeout + self.KILL_GRACE_SECS:
+                for pid in self.children:
+                    self.logger.warning("worker {0} did not drain in time, killing it".format(pid))
+                    self.signal_child(pid, signal.SIGKILL)
+                self.stopping_at = time.monotonic()
+            time.sleep(0.1)
+        self.logger.info("all workers exited")
+
+    def spawn(self, index):
+        pid = os.fork()
+        if pid == 0:
+            self.run_worker(index)
+        self.children[pid] = (index, time.monotonic())
+        self.logger.info("started worker {0} with pid {1}".format(index, pid))
+
+    def run_worker(self, index):
+        status = 1
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            os.environ['WORKER_INDEX'] = str(index)
+            # forked workers would otherwise share the parent's random state, e.g. the same retry jitter
+            random.seed()
+            self.serve(index)
+            status = 0
+        except BaseException:
+            self.logger.exception("worker {0} failed".format(index))
+        finally:
+            os._exit(status)
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            index, started_at = self.children.pop(pid, (None, None))
+            if index is None:
+                continue
+            self.logger.info("worker {0} (pid {1}) exited with status {2}".format(index, pid, status))
+            if self.stopping_at is None:
+                if time.monotonic() - started_at < self.MIN_UPTIME_SECS:
+                    time.sleep(self.MIN_UPTIME_SECS)
+                self.spawn(index)
+
+    # SIGTERM or SIGINT: ask every worker to drain and exit
+    def stop(self, signum, frame):
+        if self.stopping_at is not None:
+            return
+        self.logger.info("stopping {0} workers, draining calls for up to {1} s".format(len(self.children), self.drain_timeout))
+        self.stopping_at = time.monotonic()
+        for pid in self.children:
+            self.signal_child(pid, signal.SIGTERM)
+
+    def signal_child(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+
+# run serve(worker index) in WORKERS processes, or serve(None) in this one with a single worker
+def run_workers(serve, config=worker_config):
+    if config["Workers"] <= 1:
+        serve(None)
+        return
+    WorkerSupervisor(config["Workers"], serve, config["DrainTimeoutInSecs"]).run()